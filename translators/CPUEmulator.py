@@ -0,0 +1,615 @@
+import re
+import time
+from collections import namedtuple
+from argparse import ArgumentParser
+from array import array
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+from assemble import Program, ProgramBuilder, add_labels, encode_into_machine_code, \
+    new_symbol_table, parse_assembly_into_program, read_machine_code
+from oshooks import NATIVE_FUNCTIONS, NativeFunction, call_native, check_native, native_entries
+from profiler import FunctionProfiler, print_profile
+from screen import SCREEN, Screen, record_frames
+from snapshot import map_snapshot, rom_crc, write_snapshot
+from sourcemap import SourceMap
+from testscript import parse_value
+from VMTranslator import translate_directory, translate_file
+
+
+RAM_SIZE = 0x8000
+KBD = 0x6000
+
+
+def to_word(value: int) -> int:
+    # Wrap to a signed 16-bit value, as the Hack ALU does.
+    return ((value + 0x8000) & 0xFFFF) - 0x8000
+
+
+# Computations of the standard comp mnemonics, keyed by their c1..c6 bits,
+# with x = D and y = A or M. Values are signed 16-bit words.
+COMP_FUNCTIONS = {
+    0b101010: lambda x, y: 0,
+    0b111111: lambda x, y: 1,
+    0b111010: lambda x, y: -1,
+    0b001100: lambda x, y: x,
+    0b110000: lambda x, y: y,
+    0b001101: lambda x, y: ~x,
+    0b110001: lambda x, y: ~y,
+    0b001111: lambda x, y: to_word(-x),
+    0b110011: lambda x, y: to_word(-y),
+    0b011111: lambda x, y: to_word(x + 1),
+    0b110111: lambda x, y: to_word(y + 1),
+    0b001110: lambda x, y: to_word(x - 1),
+    0b110010: lambda x, y: to_word(y - 1),
+    0b000010: lambda x, y: to_word(x + y),
+    0b010011: lambda x, y: to_word(x - y),
+    0b000111: lambda x, y: to_word(y - x),
+    0b000000: lambda x, y: x & y,
+    0b010101: lambda x, y: x | y,
+}
+
+
+def alu_function(control: int) -> Callable[[int, int], int]:
+    # The ALU for any control bits, for the combinations without a mnemonic.
+    zx, nx, zy, ny, f, no = ((control >> shift) & 1 for shift in range(5, -1, -1))
+
+    def compute(x: int, y: int) -> int:
+        x = 0 if zx else x
+        x = ~x if nx else x
+        y = 0 if zy else y
+        y = ~y if ny else y
+        out = to_word(x + y) if f else x & y
+        return ~out if no else out
+    return compute
+
+
+Record = Tuple[Callable[[int, int], int], bool, int, int]
+Decoded = Union[int, Record]
+
+
+def predecode(machine_code: Sequence[int]) -> List[Decoded]:
+    # A-instructions are kept as their value and C-instructions become records
+    # of the comp function, whether it reads M, the dest bits (A=4, D=2, M=1)
+    # and the jump bits (JLT=4, JEQ=2, JGT=1), shared by equal instructions.
+    code, records = [], {}
+    for instruction in machine_code:
+        if not instruction & 0x8000:
+            code.append(instruction)
+            continue
+        record = records.get(instruction)
+        if record is None:
+            control = (instruction >> 6) & 0x3F
+            comp = COMP_FUNCTIONS.get(control) or alu_function(control)
+            record = records[instruction] = (comp, bool(instruction & 0x1000),
+                (instruction >> 3) & 7, instruction & 7)
+        code.append(record)
+    return code
+
+
+def find_halt_addresses(code: List[Decoded]) -> frozenset:
+    # Addresses of "(END) @END 0;JMP" loops, which programs end with.
+    halt_addresses = set()
+    for address in range(len(code) - 1):
+        record = code[address + 1]
+        if code[address] == address and record.__class__ is tuple and record[2:] == (0, 7):
+            halt_addresses.add(address)
+    return frozenset(halt_addresses)
+
+
+class CPUEmulator:
+    # Headless Hack computer: the ROM is decoded once by predecode() and RAM is
+    # an array of signed words covering the data memory, the screen and the
+    # keyboard. run() executes up to a number of cycles in one tight loop.
+    def __init__(self, machine_code: Sequence[int] = ()):
+        self.ram = array("h", bytes(2 * RAM_SIZE))
+        self.screen = Screen(self.ram)
+        self.a = 0
+        self.d = 0
+        self.pc = 0
+        self.cycles = 0
+        self.halted = False
+        self.natives = {}
+        self.verify_natives = False
+        self.profiler = None
+        self.load(machine_code)
+
+    @classmethod
+    def from_file(cls, path: str) -> "CPUEmulator":
+        # .hack text or packed .hackb machine code.
+        return cls(read_machine_code(path))
+
+    def load(self, machine_code: Sequence[int]) -> None:
+        self.rom = array("H", machine_code)
+        self.code = predecode(self.rom)
+        self.halt_addresses = find_halt_addresses(self.code)
+        self.profiler = None
+        self.register_natives({}, ())
+        self.reset()
+
+    def reset(self) -> None:
+        # As the reset pin: only the program counter is cleared.
+        self.pc = 0
+        self.halted = False
+
+    def set_key(self, key_code: int) -> None:
+        self.ram[KBD] = key_code
+
+    def save_snapshot(self, path: str) -> None:
+        write_snapshot(path, self.a, self.d, self.pc, self.cycles, self.rom, self.ram)
+
+    def restore_snapshot(self, path: str) -> None:
+        # The RAM becomes a copy-on-write mapping of the snapshot (see
+        # snapshot.map_snapshot), so a restore costs the same whatever the
+        # RAM holds. The screen is a view of the new RAM.
+        snapshot = map_snapshot(path, RAM_SIZE)
+        if snapshot.rom_crc != rom_crc(self.rom):
+            raise ValueError("{} is a snapshot of another program.".format(path))
+        self.ram = snapshot.ram
+        self.screen = Screen(self.ram)
+        self.a, self.d, self.pc, self.cycles = snapshot.a, snapshot.d, snapshot.pc, snapshot.cycles
+        self.halted = False
+        self.pending_checks = []
+        self.stop_addresses = self._stop_addresses()
+        if self.profiler is not None:
+            self.profiler.reset(self.cycles)
+
+    def register_natives(self, natives: Dict[str, NativeFunction],
+                         function_entries: Iterable[Tuple[int, str]], verify: bool = False) -> None:
+        # Jumps to the entry of a function in natives, found in the (address,
+        # name) pairs of function_entries, run the native function instead:
+        # its value is returned through the frame set up by the call, in no
+        # cycles. With verify, the emulated function runs as well and its
+        # value is checked when it returns.
+        self.natives = native_entries(function_entries, natives)
+        self.verify_natives = verify
+        self.pending_checks = []
+        self.stop_addresses = self._stop_addresses()
+
+    def register_profiler(self, profiler: Optional[FunctionProfiler]) -> None:
+        # Jumps to the function entries and return addresses known to the
+        # profiler are reported to it, along with the number of cycles run.
+        self.profiler = profiler
+        self.stop_addresses = self._stop_addresses()
+        if profiler is not None:
+            profiler.reset(self.cycles)
+
+    def _stop_addresses(self) -> set:
+        addresses = set(self.halt_addresses) | set(self.natives)
+        addresses.update(check[0] for check in self.pending_checks)
+        if self.profiler is not None:
+            addresses |= self.profiler.addresses
+        return addresses
+
+    def _stop(self, pc: int, cycle: int) -> int:
+        # Jumps to stop_addresses other than halt loops: entries of native
+        # functions, the return addresses of pending checks and the addresses
+        # of the profiler, cycle cycles after the start. Returns the address
+        # execution continues at.
+        ram, checks, profiler = self.ram, self.pending_checks, self.profiler
+        if profiler is not None:
+            profiler.jump(pc, cycle, ram)
+        if checks and checks[-1][0] == pc and ram[0] == checks[-1][1] + 1:
+            _, arg, name, args, expected = checks.pop()
+            check_native(name, args, expected, ram[arg])
+            if not any(check[0] == pc for check in checks) and \
+                    (profiler is None or pc not in profiler.addresses):
+                self.stop_addresses.discard(pc)
+            return pc
+        if pc not in self.natives:
+            return pc
+        name, native = self.natives[pc]
+        lcl, arg = ram[1], ram[2]
+        args = list(ram[arg:lcl - 5])
+        value = call_native(name, native, args, ram, self.verify_natives)
+        if value is None:
+            return pc
+        return_address = ram[lcl - 5] & 0x7FFF
+        if self.verify_natives:
+            checks.append((return_address, arg, name, args, value))
+            self.stop_addresses.add(return_address)
+            return pc
+        # As the return of a VM function.
+        ram[arg] = value
+        ram[0] = arg + 1
+        ram[1:5] = ram[lcl - 4:lcl]
+        if profiler is not None:
+            profiler.jump(return_address, cycle, ram)
+        return return_address
+
+    def run(self, max_cycles: int, stop_at_halt: bool = True) -> int:
+        # Returns the number of cycles executed, fewer than max_cycles if the
+        # program reached a halt loop or ran past the end of the ROM.
+        code, ram, stop_addresses = self.code, self.ram, self.stop_addresses
+        halt_addresses = self.halt_addresses if stop_at_halt else frozenset()
+        a, d, pc = self.a, self.d, self.pc
+        cycle = 0
+        self.halted = False
+        try:
+            while cycle < max_cycles:
+                instruction = code[pc]
+                cycle += 1
+                if instruction.__class__ is int:
+                    a = instruction
+                    pc += 1
+                    continue
+                comp, reads_m, dest, jump = instruction
+                address = a & 0x7FFF
+                out = comp(d, ram[address] if reads_m else a)
+                if dest:
+                    if dest & 1:
+                        ram[address] = out
+                    if dest & 2:
+                        d = out
+                    if dest & 4:
+                        a = out
+                if jump and (jump == 7 or (jump & 4 and out < 0) or (jump & 2 and out == 0)
+                    or (jump & 1 and out > 0)):
+                    pc = address
+                    if pc in stop_addresses:
+                        if pc in halt_addresses:
+                            self.halted = True
+                            break
+                        pc = self._stop(pc, self.cycles + cycle)
+                else:
+                    pc += 1
+        except IndexError:
+            # Past the end of the program.
+            self.halted = True
+        finally:
+            self.a, self.d, self.pc = a, d, pc
+            self.cycles += cycle
+        return cycle
+
+    def step(self) -> int:
+        return self.run(1, stop_at_halt=False)
+
+
+# Python expressions of the standard comp mnemonics, as COMP_FUNCTIONS.
+WRAP = "(({}) + 32768 & 65535) - 32768"
+COMP_EXPRESSIONS = {
+    0b101010: "0",
+    0b111111: "1",
+    0b111010: "-1",
+    0b001100: "{x}",
+    0b110000: "{y}",
+    0b001101: "~{x}",
+    0b110001: "~{y}",
+    0b001111: WRAP.format("-{x}"),
+    0b110011: WRAP.format("-{y}"),
+    0b011111: WRAP.format("{x} + 1"),
+    0b110111: WRAP.format("{y} + 1"),
+    0b001110: WRAP.format("{x} - 1"),
+    0b110010: WRAP.format("{y} - 1"),
+    0b000010: WRAP.format("{x} + {y}"),
+    0b010011: WRAP.format("{x} - {y}"),
+    0b000111: WRAP.format("{y} - {x}"),
+    0b000000: "{x} & {y}",
+    0b010101: "{x} | {y}",
+}
+COMP_CONTROLS = dict((function, control) for control, function in COMP_FUNCTIONS.items())
+JUMP_CONDITIONS = {1: "> 0", 2: "== 0", 3: ">= 0", 4: "< 0", 5: "!= 0", 6: "<= 0"}
+
+Block = namedtuple("Block", ("function", "num_instructions", "fallthrough", "source"))
+
+
+def block_length(code: List[Decoded], start: int) -> int:
+    # A basic block runs up to and including its first jump.
+    for address in range(start, len(code)):
+        instruction = code[address]
+        if instruction.__class__ is tuple and instruction[3]:
+            return address - start + 1
+    return len(code) - start
+
+
+def compile_block(code: List[Decoded], start: int) -> Block:
+    # Translates a basic block into a Python function (ram, a, d) -> (a, d, pc,
+    # jumped), jumped telling whether the jump ending the block was taken.
+    # A and D are tracked as constants while they are known, so A-instructions
+    # and the computations on them happen at compile time; a computation that
+    # goes to several destinations is evaluated once.
+    num_instructions = block_length(code, start)
+    lines = ["def block(ram, a, d):"]
+    namespace = {}
+    known_a, known_d = None, None
+    next_pc = "{}".format(start + num_instructions)
+    jumped = "False"
+    for address in range(start, start + num_instructions):
+        instruction = code[address]
+        if instruction.__class__ is int:
+            known_a = instruction
+            continue
+        comp, reads_m, dest, jump = instruction
+        control = COMP_CONTROLS.get(comp)
+        uses_x = control is None or not control & 0b100000
+        uses_y = control is None or not control & 0b001000
+        m_address = "{}".format(known_a & 0x7FFF) if known_a is not None else "a & 32767"
+        x = "{}".format(known_d) if known_d is not None else "d"
+        if reads_m:
+            y = "ram[{}]".format(m_address)
+        else:
+            y = "{}".format(known_a) if known_a is not None else "a"
+        constant = None
+        if (not uses_x or known_d is not None) and (not uses_y or
+                (not reads_m and known_a is not None)):
+            constant = comp(known_d or 0, known_a or 0)
+            out = "{}".format(constant)
+        elif control is not None:
+            out = COMP_EXPRESSIONS[control].format(x=x, y=y)
+        else:
+            name = "alu_{}".format(len(namespace))
+            namespace[name] = comp
+            out = "{}({}, {})".format(name, x, y)
+        if constant is None and (bin(dest).count("1") > 1 or (dest and jump)):
+            lines.append("    out = {}".format(out))
+            out = "out"
+        if jump and known_a is None:
+            lines.append("    target = a & 32767")
+            target = "target"
+        elif jump:
+            target = "{}".format(known_a & 0x7FFF)
+        if dest & 1:
+            lines.append("    ram[{}] = {}".format(m_address, out))
+        if dest & 2:
+            known_d = constant
+            if constant is None:
+                lines.append("    d = {}".format(out))
+        if dest & 4:
+            known_a = constant
+            if constant is None:
+                lines.append("    a = {}".format(out))
+        if jump == 7 or (jump and constant is not None and comp_jumps(constant, jump)):
+            next_pc, jumped = target, "True"
+        elif jump and constant is None:
+            if out != "out":
+                lines.append("    out = {}".format(out))
+            lines.append("    jumped = out {}".format(JUMP_CONDITIONS[jump]))
+            next_pc, jumped = "{} if jumped else {}".format(target, next_pc), "jumped"
+    if known_a is not None:
+        lines.append("    a = {}".format(known_a))
+    if known_d is not None:
+        lines.append("    d = {}".format(known_d))
+    lines.append("    return a, d, {}, {}".format(next_pc, jumped))
+    source = "\n".join(lines) + "\n"
+    exec(compile(source, "<block {}>".format(start), "exec"), namespace)
+    return Block(namespace["block"], num_instructions, start + num_instructions, source)
+
+
+def comp_jumps(out: int, jump: int) -> bool:
+    return bool((jump & 4 and out < 0) or (jump & 2 and out == 0) or (jump & 1 and out > 0))
+
+
+class JITEmulator(CPUEmulator):
+    # Runs basic blocks compiled by compile_block(), cached by start address.
+    # A block is interpreted until it has been entered compile_threshold times,
+    # so code that runs once (and most targets of computed jumps, such as the
+    # return addresses jumped to by "@ret_addr A=M 0;JMP") is never compiled.
+    # The interpreter also runs the last cycles of the budget when a whole
+    # block would not fit in them.
+    def __init__(self, machine_code: Sequence[int] = (), compile_threshold: int = 2):
+        self.compile_threshold = compile_threshold
+        super().__init__(machine_code)
+
+    def load(self, machine_code: Sequence[int]) -> None:
+        super().load(machine_code)
+        self.blocks = {}
+        self.num_entries = {}
+
+    def run(self, max_cycles: int, stop_at_halt: bool = True) -> int:
+        blocks, num_entries, ram = self.blocks, self.num_entries, self.ram
+        stop_addresses = self.stop_addresses
+        halt_addresses = self.halt_addresses if stop_at_halt else frozenset()
+        num_code = len(self.code)
+        cycle = 0
+        self.halted = False
+        while cycle < max_cycles:
+            pc = self.pc
+            block = blocks.get(pc)
+            if block is None and pc < num_code:
+                num_entries[pc] = num_entries.get(pc, 0) + 1
+                if num_entries[pc] >= self.compile_threshold:
+                    block = blocks[pc] = compile_block(self.code, pc)
+            if block is None or cycle + block.num_instructions > max_cycles:
+                length = block_length(self.code, pc) if pc < num_code else 1
+                cycle += super().run(min(length, max_cycles - cycle), stop_at_halt)
+                if self.halted:
+                    break
+                continue
+            # Blocks are chained here without going back through the dispatch above.
+            a, d = self.a, self.d
+            start_cycle = cycle
+            while True:
+                a, d, pc, jumped = block.function(ram, a, d)
+                cycle += block.num_instructions
+                # As in the interpreter, only taken jumps stop, including jumps
+                # to the next instruction.
+                if jumped and pc in stop_addresses:
+                    if pc in halt_addresses:
+                        self.halted = True
+                        break
+                    pc = self._stop(pc, self.cycles + cycle - start_cycle)
+                block = blocks.get(pc)
+                if block is None or cycle + block.num_instructions > max_cycles:
+                    break
+            self.a, self.d, self.pc = a, d, pc
+            self.cycles += cycle - start_cycle
+            if self.halted:
+                break
+        return cycle
+
+
+RAM_VALUE = re.compile(r"RAM\[(\d+)\]$")
+
+
+def read_program(path: str) -> Sequence[int]:
+    # Machine code of a .hack or .hackb file, or of an .asm file assembled in
+    # memory, as the CPU emulator of the course loads both. A program that
+    # has not been built is built in memory from the sources next to it.
+    if not Path(path).exists():
+        return build_program(Path(path))
+    if Path(path).suffix == ".asm":
+        return assemble_program(parse_assembly_into_program(path))
+    return read_machine_code(path)
+
+
+def assemble_program(program: Program) -> array:
+    table = new_symbol_table()
+    add_labels(program, table)
+    return encode_into_machine_code(program, table)
+
+
+def build_program(path: Path) -> array:
+    # From the .asm file of the same name, whatever its case (mult.asm for
+    # Mult.hack), or from the .vm files of the directory, translated as a
+    # program with bootstrap code if one of them is Sys.vm and as the .vm
+    # file of the same name otherwise.
+    paths_asm = [p for p in path.parent.glob("*.asm") if p.stem.lower() == path.stem.lower()]
+    if path.suffix != ".asm" and paths_asm:
+        return read_program(str(paths_asm[0]))
+    paths_vm = sorted(path.parent.glob("*.vm"))
+    builder = ProgramBuilder()
+    if any(path_vm.stem == "Sys" for path_vm in paths_vm):
+        translate_directory(paths_vm, str(path), output=builder)
+    elif path.with_suffix(".vm").exists():
+        translate_file(str(path.with_suffix(".vm")), str(path), output=builder)
+    else:
+        raise ValueError("{} does not exist and has no source.".format(path))
+    return assemble_program(builder.program)
+
+
+class CPUScriptEngine:
+    # Engine of testscript.ScriptRunner for CPU emulator scripts (load,
+    # set RAM[i]/A/D/PC, ticktock), on the JIT emulator.
+    def __init__(self):
+        self.emulator = JITEmulator()
+
+    def run_command(self, name: str, args: List[str], directory: Path) -> None:
+        if not self.run_repeated(name, args, 1, directory):
+            raise ValueError("Unknown command {}.".format(name))
+
+    def run_repeated(self, name: str, args: List[str], count: int, directory: Path) -> bool:
+        if name == "ticktock":
+            self.emulator.run(count)
+        elif name == "load" and count == 1:
+            self.emulator.load(read_program(str(directory / args[0])))
+        elif name == "set" and count == 1:
+            self._set(args[0], parse_value(args[1]))
+        else:
+            return False
+        return True
+
+    def _set(self, name: str, value: int) -> None:
+        emulator = self.emulator
+        match = RAM_VALUE.match(name)
+        if match is not None:
+            emulator.ram[int(match.group(1))] = to_word(value)
+        elif name == "A":
+            emulator.a = to_word(value)
+        elif name == "D":
+            emulator.d = to_word(value)
+        elif name == "PC":
+            emulator.pc = value & 0x7FFF
+            emulator.halted = False
+        else:
+            raise ValueError("Unknown CPU emulator variable {}.".format(name))
+
+    def value(self, name: str) -> Union[int, str]:
+        emulator = self.emulator
+        match = RAM_VALUE.match(name)
+        if match is not None:
+            return emulator.ram[int(match.group(1))]
+        elif name == "A":
+            return emulator.a
+        elif name == "D":
+            return emulator.d
+        elif name == "PC":
+            return emulator.pc
+        elif name == "time":
+            return emulator.cycles
+        raise ValueError("Unknown CPU emulator variable {}.".format(name))
+
+    def flush(self) -> None:
+        pass
+
+
+def parse_assignments(assignments: Sequence[str]) -> Dict[int, int]:
+    # "address=value" pairs, as given on the command line.
+    values = {}
+    for assignment in assignments:
+        address, value = assignment.split("=")
+        values[int(address)] = int(value)
+    return values
+
+
+def main():
+    arg_parser = ArgumentParser()
+    arg_parser.add_argument("path", type=str, help="Path to a .hack or .hackb file")
+    arg_parser.add_argument("-c", "--cycles", type=int, default=1000000,
+        help="Maximum number of cycles to run")
+    arg_parser.add_argument("--set", type=str, nargs="*", default=[],
+        help="Initial RAM values as address=value")
+    arg_parser.add_argument("--show", type=str, default="0:16",
+        help="Range of RAM addresses printed at the end, as start:end")
+    arg_parser.add_argument("--jit", action="store_true",
+        help="Compile basic blocks to Python functions")
+    arg_parser.add_argument("--benchmark", action="store_true",
+        help="Run the program with both the interpreter and the JIT and compare their speed")
+    arg_parser.add_argument("--native", type=str, default=None, metavar="SMAP",
+        help="Run OS functions natively, at the function entries of this source map")
+    arg_parser.add_argument("--verify-native", action="store_true",
+        help="Check the values of native functions against the emulated ones")
+    arg_parser.add_argument("--frames", type=str, default=None, metavar="DIR",
+        help="Save the screen into this directory when it changes")
+    arg_parser.add_argument("--frame-interval", type=int, default=100000,
+        help="Number of cycles between screen frames")
+    arg_parser.add_argument("--frame-format", choices=("png", "pbm"), default="png",
+        help="Image format of the screen frames")
+    arg_parser.add_argument("--snapshot", type=str, default=None,
+        help="Start from the state saved in this snapshot")
+    arg_parser.add_argument("--save-snapshot", type=str, default=None,
+        help="Save the state at the end into this snapshot")
+    arg_parser.add_argument("--profile", type=str, default=None, metavar="SMAP",
+        help="Count the cycles of each VM function, with the labels of this source map")
+    arg_parser.add_argument("--profile-output", type=str, default=None,
+        help="With --profile, write the call stacks and their cycles in collapsed format")
+    args = arg_parser.parse_args()
+
+    engines = [CPUEmulator, JITEmulator] if args.benchmark else \
+        [JITEmulator if args.jit else CPUEmulator]
+    for engine in engines:
+        emulator = engine.from_file(args.path)
+        if args.snapshot:
+            emulator.restore_snapshot(args.snapshot)
+        if args.native:
+            emulator.register_natives(NATIVE_FUNCTIONS,
+                SourceMap.load(args.native).function_entries(), args.verify_native)
+        if args.profile:
+            emulator.register_profiler(FunctionProfiler.from_source_map(
+                SourceMap.load(args.profile)))
+        for address, value in parse_assignments(args.set).items():
+            emulator.ram[address] = to_word(value)
+        start = time.perf_counter()
+        if args.frames:
+            num_cycles_before = emulator.cycles
+            frames = record_frames(emulator, args.cycles, args.frame_interval, args.frames,
+                args.frame_format, emulator.screen)
+            cycles = emulator.cycles - num_cycles_before
+            print("{} frames saved in {}".format(len(frames), args.frames))
+        else:
+            cycles = emulator.run(args.cycles)
+        seconds = time.perf_counter() - start
+        print("{}: {} cycles in {:.3f} s ({:.2f} M/s){}".format(engine.__name__, cycles, seconds,
+            cycles / seconds / 1e6 if seconds else 0.0, ", halted" if emulator.halted else ""))
+        if args.save_snapshot:
+            emulator.save_snapshot(args.save_snapshot)
+        if emulator.profiler is not None:
+            emulator.profiler.finish(emulator.cycles)
+            print_profile(emulator.profiler.profiles())
+            if args.profile_output:
+                emulator.profiler.save_collapsed_stacks(args.profile_output)
+    first, last = (int(address) for address in args.show.split(":"))
+    for address in range(first, last):
+        print("RAM[{}] = {}".format(address, emulator.ram[address]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,720 @@
+import re
+import time
+from argparse import ArgumentParser
+from array import array
+from collections import deque, namedtuple
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from assemble import read_machine_code
+from testscript import ScriptResult, parse_value, run_script
+
+
+Pin = namedtuple("Pin", ("name", "width"))
+# pin_bits and signal_bits are (first, last) sub-bus bounds, or None.
+Connection = namedtuple("Connection", ("pin", "pin_bits", "signal", "signal_bits"))
+Part = namedtuple("Part", ("chip", "connections"))
+ChipDefinition = namedtuple("ChipDefinition", ("name", "inputs", "outputs", "parts", "builtin"))
+
+HDL_TOKEN = re.compile(r"\.\.|[A-Za-z_]\w*|\d+|[{}()\[\];,=:]")
+HDL_COMMENT = re.compile(r"//[^\n]*|/\*.*?\*/", re.DOTALL)
+
+
+class _Tokens:
+    def __init__(self, source: str):
+        self.tokens = HDL_TOKEN.findall(HDL_COMMENT.sub(" ", source))
+        self.position = 0
+
+    def peek(self) -> Optional[str]:
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def next(self) -> str:
+        token = self.peek()
+        if token is None:
+            raise ValueError("Unexpected end of HDL.")
+        self.position += 1
+        return token
+
+    def expect(self, expected: str) -> None:
+        token = self.next()
+        if token != expected:
+            raise ValueError("Expected {} in HDL, got {}.".format(expected, token))
+
+
+def _parse_sub_bus(tokens: _Tokens) -> Optional[Tuple[int, int]]:
+    if tokens.peek() != "[":
+        return None
+    tokens.next()
+    first = last = int(tokens.next())
+    if tokens.peek() == "..":
+        tokens.next()
+        last = int(tokens.next())
+    tokens.expect("]")
+    return first, last
+
+
+def _parse_pins(tokens: _Tokens) -> List[Pin]:
+    pins = []
+    while True:
+        name = tokens.next()
+        width = 1
+        if tokens.peek() == "[":
+            tokens.next()
+            width = int(tokens.next())
+            tokens.expect("]")
+        pins.append(Pin(name, width))
+        if tokens.next() == ";":
+            return pins
+
+
+def parse_hdl(source: str) -> ChipDefinition:
+    tokens = _Tokens(source)
+    tokens.expect("CHIP")
+    name = tokens.next()
+    tokens.expect("{")
+    inputs, outputs, parts, builtin = [], [], [], False
+    while True:
+        token = tokens.next()
+        if token == "}":
+            return ChipDefinition(name, inputs, outputs, parts, builtin)
+        elif token == "IN":
+            inputs = _parse_pins(tokens)
+        elif token == "OUT":
+            outputs = _parse_pins(tokens)
+        elif token in ("BUILTIN", "CLOCKED"):
+            builtin = True
+            while tokens.next() != ";":
+                pass
+        elif token == "PARTS":
+            tokens.expect(":")
+            while tokens.peek() != "}":
+                chip = tokens.next()
+                tokens.expect("(")
+                connections = []
+                while True:
+                    pin = tokens.next()
+                    pin_bits = _parse_sub_bus(tokens)
+                    tokens.expect("=")
+                    signal = tokens.next()
+                    connections.append(Connection(pin, pin_bits, signal, _parse_sub_bus(tokens)))
+                    if tokens.next() == ")":
+                        break
+                tokens.expect(";")
+                parts.append(Part(chip, connections))
+        else:
+            raise ValueError("Unexpected {} in HDL of {}.".format(token, name))
+
+
+# Builtin chips. Every wire holds a bit of many test vectors at once: bit j
+# of its value is the wire in vector j, and m has a bit set for each vector.
+# evaluate and clock_up generate Python lines from the expressions of the
+# input bits (bit 0 first) and the targets of the output bits, keyed by pin;
+# state is the index of the chip's first state slot or its memory. State
+# slots are read from s (what the outputs show) and written into p on the
+# rising edge of the clock; the falling edge copies p to s.
+BuiltinChip = namedtuple("BuiltinChip", ("name", "inputs", "outputs", "combinational",
+    "state_size", "memory", "evaluate", "clock_up"))
+
+
+def _bit_fields(inputs: Dict[str, List[str]], bit: int) -> Dict[str, str]:
+    # {pin} is the bit of a bus or the single bit of a pin, {pinN} bit N.
+    fields = {}
+    for name, bits in inputs.items():
+        fields[name] = bits[bit] if bit < len(bits) else bits[0]
+        for index, expression in enumerate(bits):
+            fields["{}{}".format(name, index)] = expression
+    return fields
+
+
+def _bitwise(**templates: str) -> Callable:
+    def evaluate(inputs, outputs, state):
+        return ["{} = {}".format(target, templates[name].format(**_bit_fields(inputs, bit)))
+            for name, targets in outputs.items() for bit, target in enumerate(targets)]
+    return evaluate
+
+
+def _mux_tree(num_inputs: int) -> str:
+    names, level = "abcdefgh"[:num_inputs], 0
+    terms = ["{{{}}}".format(name) for name in names]
+    while len(terms) > 1:
+        terms = ["({} & ~{{sel{level}}} | {} & {{sel{level}}})".format(
+            terms[k], terms[k + 1], level=level) for k in range(0, len(terms), 2)]
+        level += 1
+    return terms[0]
+
+
+def _dmux_templates(num_outputs: int) -> Dict[str, str]:
+    num_sel = num_outputs.bit_length() - 1
+    return dict((name, "{in} & " + " & ".join(
+        "{{sel{}}}".format(bit) if index >> bit & 1 else "~{{sel{}}}".format(bit)
+        for bit in range(num_sel)))
+        for index, name in enumerate("abcdefgh"[:num_outputs]))
+
+
+def _add16(inputs, outputs, state):
+    lines = ["c = 0"]
+    for a, b, out in zip(inputs["a"], inputs["b"], outputs["out"]):
+        lines += ["t = {} ^ {}".format(a, b), "{} = t ^ c".format(out),
+            "c = {} & {} | c & t".format(a, b)]
+    return lines
+
+
+def _inc16(inputs, outputs, state):
+    lines = ["c = m"]
+    for bit, out in zip(inputs["in"], outputs["out"]):
+        lines += ["{} = {} ^ c".format(out, bit), "c = {} & c".format(bit)]
+    return lines
+
+
+def _alu(inputs, outputs, state):
+    zx, nx, zy, ny, f, no = (inputs[name][0] for name in ("zx", "nx", "zy", "ny", "f", "no"))
+    lines = ["c = 0"]
+    for bit, (x, y, out) in enumerate(zip(inputs["x"], inputs["y"], outputs["out"])):
+        lines += ["x = {} & ~{} ^ {}".format(x, zx, nx), "y = {} & ~{} ^ {}".format(y, zy, ny),
+            "t = x ^ y", "u = t ^ c", "c = x & y | c & t",
+            "{} = (u & {} | x & y & ~{}) ^ {}".format(out, f, f, no)]
+    out = outputs["out"]
+    lines.append("{} = ~({}) & m".format(outputs["zr"][0], " | ".join(out)))
+    lines.append("{} = {}".format(outputs["ng"][0], out[15]))
+    return lines
+
+
+def _read_state(inputs, outputs, state):
+    return ["{} = s[{}]".format(target, state + bit) for bit, target in enumerate(outputs["out"])]
+
+
+def _dff_clock(inputs, state):
+    return ["p[{}] = {}".format(state, inputs["in"][0])]
+
+
+def _register_clock(inputs, state):
+    load = inputs["load"][0]
+    return ["p[{0}] = {1} & {2} | p[{0}] & ~{2}".format(state + bit, data, load)
+        for bit, data in enumerate(inputs["in"])]
+
+
+def _pc_clock(inputs, state):
+    load, inc, reset = inputs["load"][0], inputs["inc"][0], inputs["reset"][0]
+    lines = ["c = m"]
+    for bit in range(16):
+        lines += ["v{} = p[{}] ^ c".format(bit, state + bit), "c = p[{}] & c".format(state + bit)]
+    for bit, data in enumerate(inputs["in"]):
+        lines += ["v = v{} & {} | p[{}] & ~{}".format(bit, inc, state + bit, inc),
+            "v = {} & {} | v & ~{}".format(data, load, load),
+            "p[{}] = v & ~{}".format(state + bit, reset)]
+    return lines
+
+
+def _memory_read(inputs, outputs, state):
+    return ["{}, = r[{}].read(m{})".format(", ".join(outputs["out"]), state,
+        "".join(", " + bit for bit in inputs.get("address", ())))]
+
+
+def _memory_write(inputs, state):
+    return ["r[{}].write(m, {}, ({},), ({},))".format(state, inputs["load"][0],
+        ", ".join(inputs["in"]), ", ".join(inputs["address"]))]
+
+
+class Memory:
+    # Words of a RAM, ROM, screen or keyboard chip, for each test vector.
+    def __init__(self, size: int):
+        self.size = size
+        self.lanes = [array("H", bytes(2 * size))]
+
+    def _lane_words(self, lane: int) -> array:
+        while len(self.lanes) <= lane:
+            self.lanes.append(array("H", bytes(2 * self.size)))
+        return self.lanes[lane]
+
+    def read(self, m: int, *address: int) -> Tuple[int, ...]:
+        if m == 1:
+            value = self.lanes[0][sum(bit << index for index, bit in enumerate(address))]
+            return tuple(value >> bit & 1 for bit in range(16))
+        values = [self._lane_words(lane)[sum((bit >> lane & 1) << index
+            for index, bit in enumerate(address))] for lane in range(m.bit_length())]
+        return tuple(sum((value >> bit & 1) << lane for lane, value in enumerate(values))
+            for bit in range(16))
+
+    def write(self, m: int, load: int, data: Sequence[int], address: Sequence[int]) -> None:
+        for lane in range(load.bit_length()):
+            if load >> lane & 1:
+                self._lane_words(lane)[sum((bit >> lane & 1) << index
+                    for index, bit in enumerate(address))] = \
+                    sum((bit >> lane & 1) << index for index, bit in enumerate(data))
+
+    def load(self, words: Sequence[int]) -> None:
+        self.lanes[0][:len(words)] = array("H", words)
+
+
+class Keyboard(Memory):
+    def __init__(self, size: int):
+        super().__init__(1)
+
+    def read(self, m: int, *address: int) -> Tuple[int, ...]:
+        return tuple(m if self.lanes[0][0] >> bit & 1 else 0 for bit in range(16))
+
+
+def _builtin(name: str, inputs: str, outputs: str, evaluate: Callable,
+             combinational: Optional[Sequence[str]] = None, state_size: int = 0,
+             memory: Optional[Callable] = None, clock_up: Optional[Callable] = None):
+    # Pins as "a b[16]": names with their width if it is not 1.
+    def pins(text):
+        return tuple(Pin(pin.split("[")[0], int(pin.split("[")[1][:-1]) if "[" in pin else 1)
+            for pin in text.split())
+    input_pins = pins(inputs)
+    if combinational is None:
+        combinational = tuple(pin.name for pin in input_pins)
+    return name, BuiltinChip(name, input_pins, pins(outputs), tuple(combinational), state_size,
+        memory, evaluate, clock_up)
+
+
+def _memory_chip(name: str, address_width: int, size: int):
+    return _builtin(name, "in[16] load address[{}]".format(address_width), "out[16]",
+        _memory_read, ("address",), 0, lambda: Memory(size), _memory_write)
+
+
+BUILTIN_CHIPS = dict((
+    _builtin("Nand", "a b", "out", _bitwise(out="~({a} & {b}) & m")),
+    _builtin("Not", "in", "out", _bitwise(out="~{in} & m")),
+    _builtin("And", "a b", "out", _bitwise(out="{a} & {b}")),
+    _builtin("Or", "a b", "out", _bitwise(out="{a} | {b}")),
+    _builtin("Xor", "a b", "out", _bitwise(out="{a} ^ {b}")),
+    _builtin("Mux", "a b sel", "out", _bitwise(out="{a} & ~{sel} | {b} & {sel}")),
+    _builtin("DMux", "in sel", "a b", _bitwise(a="{in} & ~{sel}", b="{in} & {sel}")),
+    _builtin("Not16", "in[16]", "out[16]", _bitwise(out="~{in} & m")),
+    _builtin("And16", "a[16] b[16]", "out[16]", _bitwise(out="{a} & {b}")),
+    _builtin("Or16", "a[16] b[16]", "out[16]", _bitwise(out="{a} | {b}")),
+    _builtin("Mux16", "a[16] b[16] sel", "out[16]", _bitwise(out="{a} & ~{sel} | {b} & {sel}")),
+    _builtin("Or8Way", "in[8]", "out",
+        _bitwise(out=" | ".join("{{in{}}}".format(bit) for bit in range(8)))),
+    _builtin("Mux4Way16", "a[16] b[16] c[16] d[16] sel[2]", "out[16]",
+        _bitwise(out=_mux_tree(4))),
+    _builtin("Mux8Way16", "a[16] b[16] c[16] d[16] e[16] f[16] g[16] h[16] sel[3]", "out[16]",
+        _bitwise(out=_mux_tree(8))),
+    _builtin("DMux4Way", "in sel[2]", "a b c d", _bitwise(**_dmux_templates(4))),
+    _builtin("DMux8Way", "in sel[3]", "a b c d e f g h", _bitwise(**_dmux_templates(8))),
+    _builtin("HalfAdder", "a b", "sum carry", _bitwise(sum="{a} ^ {b}", carry="{a} & {b}")),
+    _builtin("FullAdder", "a b c", "sum carry",
+        _bitwise(sum="{a} ^ {b} ^ {c}", carry="{a} & {b} | {c} & ({a} ^ {b})")),
+    _builtin("Add16", "a[16] b[16]", "out[16]", _add16),
+    _builtin("Inc16", "in[16]", "out[16]", _inc16),
+    _builtin("ALU", "x[16] y[16] zx nx zy ny f no", "out[16] zr ng", _alu),
+    _builtin("DFF", "in", "out", _read_state, (), 1, None, _dff_clock),
+    _builtin("Bit", "in load", "out", _read_state, (), 1, None, _register_clock),
+    _builtin("Register", "in[16] load", "out[16]", _read_state, (), 16, None, _register_clock),
+    _builtin("ARegister", "in[16] load", "out[16]", _read_state, (), 16, None, _register_clock),
+    _builtin("DRegister", "in[16] load", "out[16]", _read_state, (), 16, None, _register_clock),
+    _builtin("PC", "in[16] load inc reset", "out[16]", _read_state, (), 16, None, _pc_clock),
+    _memory_chip("RAM8", 3, 8),
+    _memory_chip("RAM64", 6, 64),
+    _memory_chip("RAM512", 9, 512),
+    _memory_chip("RAM4K", 12, 4096),
+    _memory_chip("RAM16K", 14, 16384),
+    _memory_chip("Screen", 13, 8192),
+    _builtin("ROM32K", "address[15]", "out[16]", _memory_read, ("address",), 0,
+        lambda: Memory(32768)),
+    _builtin("Keyboard", "", "out[16]", _memory_read, (), 0, lambda: Keyboard(1)),
+))
+
+
+# A part of the flattened chip: a builtin chip with the wires of its pins.
+Node = namedtuple("Node", ("chip", "inputs", "outputs", "state"))
+FALSE_WIRE = 0
+TRUE_WIRE = 1
+
+
+class Flattener:
+    # Instantiates a chip and, recursively, its parts down to builtin chips.
+    # As in the course's simulator, a part is defined by the .hdl file of the
+    # same name in the directory of the top chip if there is one, and is
+    # builtin otherwise.
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.definitions = {}
+        self.num_wires = 2
+        self.aliases = {}
+        self.nodes = []
+        self.num_state = 0
+        self.memories = []
+
+    def definition(self, chip_name: str):
+        if chip_name not in self.definitions:
+            path_hdl = self.directory / "{}.hdl".format(chip_name)
+            definition = parse_hdl(path_hdl.read_text()) if path_hdl.exists() else None
+            if definition is None or definition.builtin:
+                if chip_name not in BUILTIN_CHIPS:
+                    raise ValueError("Chip {} not found.".format(chip_name))
+                definition = BUILTIN_CHIPS[chip_name]
+            self.definitions[chip_name] = definition
+        return self.definitions[chip_name]
+
+    def new_wires(self, width: int) -> List[int]:
+        self.num_wires += width
+        return list(range(self.num_wires - width, self.num_wires))
+
+    def wire(self, wire: int) -> int:
+        while wire in self.aliases:
+            wire = self.aliases[wire]
+        return wire
+
+    def instantiate(self, chip_name: str, inputs: Dict[str, List[int]]) \
+            -> Tuple[Dict[str, List[int]], Dict[str, List[int]]]:
+        # Returns the wires of the outputs of the chip and of all its pins.
+        definition = self.definition(chip_name)
+        if isinstance(definition, BuiltinChip):
+            outputs = dict((pin.name, self.new_wires(pin.width)) for pin in definition.outputs)
+            if definition.memory is not None:
+                state = len(self.memories)
+                self.memories.append(definition.memory())
+            else:
+                state = self.num_state
+                self.num_state += definition.state_size
+            self.nodes.append(Node(definition, inputs, outputs, state))
+            return outputs, dict(inputs, **outputs)
+
+        outputs = dict((pin.name, [None] * pin.width) for pin in definition.outputs)
+        scope = dict(inputs, **outputs)
+        # The outputs of all parts first, as parts may use the outputs of the
+        # parts after them.
+        part_outputs = []
+        for part in definition.parts:
+            sub_definition = self.definition(part.chip)
+            placeholders = dict((pin.name, self.new_wires(pin.width))
+                for pin in sub_definition.outputs)
+            for connection in part.connections:
+                if connection.pin in placeholders:
+                    wires = _sub_bus(placeholders[connection.pin], connection.pin_bits)
+                    self._bind_output(definition, scope, outputs, connection, wires)
+            part_outputs.append(placeholders)
+        for part, placeholders in zip(definition.parts, part_outputs):
+            sub_definition = self.definition(part.chip)
+            part_inputs = dict((pin.name, [FALSE_WIRE] * pin.width)
+                for pin in sub_definition.inputs)
+            for connection in part.connections:
+                if connection.pin in part_inputs:
+                    self._bind_input(definition, scope, part_inputs, connection)
+                elif connection.pin not in placeholders:
+                    raise ValueError("{} has no pin {}, in {}.".format(part.chip, connection.pin,
+                        definition.name))
+            actual, _ = self.instantiate(part.chip, part_inputs)
+            for name, wires in placeholders.items():
+                for placeholder, wire in zip(wires, actual[name]):
+                    self.aliases[placeholder] = wire
+        for wires in outputs.values():
+            wires[:] = [FALSE_WIRE if wire is None else wire for wire in wires]
+        return outputs, scope
+
+    @staticmethod
+    def _bind_output(definition, scope, outputs, connection, wires):
+        signal = connection.signal
+        if signal in outputs:
+            target = outputs[signal]
+            indices = range(len(target)) if connection.signal_bits is None else \
+                range(connection.signal_bits[0], connection.signal_bits[1] + 1)
+            if len(indices) != len(wires):
+                raise ValueError("Width of {} differs from its part pin, in {}.".format(
+                    signal, definition.name))
+            for index, wire in zip(indices, wires):
+                if target[index] is not None:
+                    raise ValueError("{} has several sources, in {}.".format(
+                        signal, definition.name))
+                target[index] = wire
+        elif signal in scope or signal in ("true", "false"):
+            raise ValueError("{} cannot be an output of a part, in {}.".format(
+                signal, definition.name))
+        elif connection.signal_bits is not None:
+            raise ValueError("Internal pin {} cannot have a sub bus, in {}.".format(
+                signal, definition.name))
+        else:
+            scope[signal] = wires
+
+    @staticmethod
+    def _bind_input(definition, scope, part_inputs, connection):
+        target = part_inputs[connection.pin]
+        indices = range(len(target)) if connection.pin_bits is None else \
+            range(connection.pin_bits[0], connection.pin_bits[1] + 1)
+        if connection.signal in ("true", "false"):
+            wires = [TRUE_WIRE if connection.signal == "true" else FALSE_WIRE] * len(indices)
+        elif connection.signal not in scope:
+            raise ValueError("{} is not defined, in {}.".format(connection.signal,
+                definition.name))
+        else:
+            wires = _sub_bus(scope[connection.signal], connection.signal_bits)
+            if any(wire is None for wire in wires):
+                raise ValueError("Output {} cannot be used as an input, in {}.".format(
+                    connection.signal, definition.name))
+        if len(wires) != len(indices):
+            raise ValueError("Width of {} differs from pin {}, in {}.".format(
+                connection.signal, connection.pin, definition.name))
+        for index, wire in zip(indices, wires):
+            target[index] = wire
+
+
+def _sub_bus(wires: List[int], bits: Optional[Tuple[int, int]]) -> List[int]:
+    return wires if bits is None else wires[bits[0]:bits[1] + 1]
+
+
+def levelise(nodes: List[Node]) -> List[Node]:
+    # Orders the nodes so that each comes after the nodes driving its
+    # combinational inputs. State and memory outputs need no inputs.
+    drivers = {}
+    for index, node in enumerate(nodes):
+        for wires in node.outputs.values():
+            for wire in wires:
+                drivers[wire] = index
+    dependents = [[] for _ in nodes]
+    num_dependencies = [0] * len(nodes)
+    for index, node in enumerate(nodes):
+        sources = set(drivers[wire] for pin in node.chip.combinational
+            for wire in node.inputs[pin] if wire in drivers)
+        num_dependencies[index] = len(sources)
+        for source in sources:
+            dependents[source].append(index)
+    ready = deque(index for index in range(len(nodes)) if not num_dependencies[index])
+    order = []
+    while ready:
+        index = ready.popleft()
+        order.append(nodes[index])
+        for dependent in dependents[index]:
+            num_dependencies[dependent] -= 1
+            if not num_dependencies[dependent]:
+                ready.append(dependent)
+    if len(order) != len(nodes):
+        raise ValueError("Combinational loop through {}.".format(", ".join(sorted(set(
+            nodes[index].chip.name for index in range(len(nodes)) if num_dependencies[index])))))
+    return order
+
+
+def _expression(wire: int) -> str:
+    if wire == FALSE_WIRE:
+        return "0"
+    elif wire == TRUE_WIRE:
+        return "m"
+    return "w[{}]".format(wire)
+
+
+def _compile(name: str, arguments: str, lines: List[str]) -> Callable:
+    source = "def {}({}):\n".format(name, arguments) + \
+        "".join("    {}\n".format(line) for line in lines or ["pass"])
+    namespace = {}
+    exec(compile(source, "<{}>".format(name), "exec"), namespace)
+    return namespace[name]
+
+
+class Chip:
+    # A chip flattened into builtin chips, levelised and compiled into two
+    # straight-line Python functions: evaluate() for the combinational logic
+    # and clock_up() for the rising edge of the clock. Each runs over all the
+    # test vectors at once.
+    def __init__(self, path_hdl: str):
+        path_hdl = Path(path_hdl)
+        flattener = Flattener(path_hdl.parent)
+        definition = flattener.definition(path_hdl.stem)
+        if isinstance(definition, BuiltinChip):
+            raise ValueError("{} is a builtin chip.".format(path_hdl.stem))
+        inputs = dict((pin.name, flattener.new_wires(pin.width)) for pin in definition.inputs)
+        _, scope = flattener.instantiate(definition.name, inputs)
+        self.name = definition.name
+        self.input_pins = dict((pin.name, pin.width) for pin in definition.inputs)
+        self.pins = dict((name, [flattener.wire(wire) for wire in wires])
+            for name, wires in scope.items())
+        self.nodes = levelise([Node(node.chip,
+            dict((pin, [flattener.wire(wire) for wire in wires])
+                for pin, wires in node.inputs.items()),
+            node.outputs, node.state) for node in flattener.nodes])
+        self.memories = flattener.memories
+        self.sequential = flattener.num_state > 0 or any(node.chip.clock_up is not None
+            for node in self.nodes)
+        lines, clock_lines = [], []
+        for node in self.nodes:
+            inputs = dict((pin, [_expression(wire) for wire in wires])
+                for pin, wires in node.inputs.items())
+            outputs = dict((pin, [_expression(wire) for wire in wires])
+                for pin, wires in node.outputs.items())
+            lines.extend(node.chip.evaluate(inputs, outputs, node.state))
+            if node.chip.clock_up is not None:
+                clock_lines.extend(node.chip.clock_up(inputs, node.state))
+        self._evaluate = _compile("evaluate", "w, s, r, m", lines)
+        self._clock_up = _compile("clock_up", "w, s, p, r, m", clock_lines)
+        self.num_gates = len(lines)
+        self.wires = [0] * flattener.num_wires
+        self.state = [0] * flattener.num_state
+        self.next_state = [0] * flattener.num_state
+        self.mask = 1
+
+    def set_lanes(self, num_lanes: int) -> None:
+        self.mask = (1 << num_lanes) - 1
+        self.wires[TRUE_WIRE] = self.mask
+
+    def evaluate(self) -> None:
+        self.wires[TRUE_WIRE] = self.mask
+        self._evaluate(self.wires, self.state, self.memories, self.mask)
+
+    def tick(self) -> None:
+        self.evaluate()
+        self._clock_up(self.wires, self.state, self.next_state, self.memories, self.mask)
+
+    def tock(self) -> None:
+        self.state[:] = self.next_state
+        self.evaluate()
+
+    def set_pin(self, name: str, values: Sequence[int]) -> None:
+        # The values of an input pin in each test vector.
+        for bit, wire in enumerate(self.pins[name]):
+            self.wires[wire] = sum((value >> bit & 1) << lane for lane, value in enumerate(values))
+
+    def pin(self, name: str, lane: int = 0) -> int:
+        wires = self.pins[name]
+        value = sum((self.wires[wire] >> lane & 1) << bit for bit, wire in enumerate(wires))
+        return _signed(value) if len(wires) == 16 else value
+
+    def part(self, chip_name: str) -> Node:
+        # The first builtin part of this name, as "ARegister" in ARegister[].
+        for node in self.nodes:
+            if node.chip.name == chip_name:
+                return node
+        raise ValueError("{} has no builtin part {}.".format(self.name, chip_name))
+
+    def part_value(self, chip_name: str, index: Optional[int]) -> int:
+        node = self.part(chip_name)
+        if node.chip.memory is not None:
+            return _signed(self.memories[node.state].lanes[0][index or 0])
+        return _signed(sum((self.next_state[node.state + bit] & 1) << bit
+            for bit in range(node.chip.state_size)))
+
+    def set_part_value(self, chip_name: str, index: Optional[int], value: int) -> None:
+        node = self.part(chip_name)
+        if node.chip.memory is not None:
+            self.memories[node.state].lanes[0][index or 0] = value & 0xFFFF
+            return
+        for bit in range(node.chip.state_size):
+            self.state[node.state + bit] = self.next_state[node.state + bit] = value >> bit & 1
+
+
+def _signed(value: int) -> int:
+    return value - 0x10000 if value & 0x8000 else value
+
+
+PART_VALUE = re.compile(r"(\w+)\[(\d*)\]$")
+
+
+class HardwareSimulator:
+    # Engine of testscript.ScriptRunner for chips. Scripts of chips without
+    # state run in batch: each eval records the inputs, and the outputs of
+    # all of them are computed in a single evaluation, one vector per bit.
+    def __init__(self):
+        self.chip = None
+
+    def load(self, path_hdl: str) -> None:
+        self.chip = Chip(path_hdl)
+        self.time = 0
+        self.rising = False
+        self.input_values = dict((name, 0) for name in self.chip.input_pins)
+        self.batch = not self.chip.sequential
+        self.snapshots = []
+        self.results = []
+        self.chip.set_lanes(1)
+
+    def run_command(self, name: str, args: List[str], directory: Path) -> None:
+        if name == "load":
+            self.load(str(directory / args[0]))
+        elif name == "set":
+            self._set(args[0], parse_value(args[1]))
+        elif name == "eval":
+            if self.batch:
+                self.snapshots.append(dict(self.input_values))
+            else:
+                self.chip.evaluate()
+        elif name == "tick":
+            self._serial()
+            self.chip.tick()
+            self.rising = True
+        elif name == "tock":
+            self._serial()
+            self.chip.tock()
+            self.rising = False
+            self.time += 1
+        elif len(args) == 2 and args[0] == "load":
+            # ROM32K load Max.hack
+            node = self.chip.part(name)
+            self.chip.memories[node.state].load(read_machine_code(str(directory / args[1])))
+        else:
+            raise ValueError("Unknown command {}.".format(name))
+
+    def _serial(self) -> None:
+        if self.batch:
+            raise ValueError("{} has no clocked parts.".format(self.chip.name))
+
+    def _set(self, name: str, value: int) -> None:
+        match = PART_VALUE.match(name)
+        if match is not None and name not in self.chip.pins:
+            self.chip.set_part_value(match.group(1), int(match.group(2) or 0), value)
+            return
+        if name not in self.input_values:
+            raise ValueError("{} is not an input of {}.".format(name, self.chip.name))
+        self.input_values[name] = value & ((1 << self.chip.input_pins[name]) - 1)
+        if not self.batch:
+            self.chip.set_pin(name, [self.input_values[name]])
+
+    def value(self, name: str):
+        if name == "time":
+            return "{}{}".format(self.time, "+" if self.rising else "")
+        match = PART_VALUE.match(name)
+        if match is not None and name not in self.chip.pins:
+            index = int(match.group(2)) if match.group(2) else None
+            return self.chip.part_value(match.group(1), index)
+        if name in self.input_values:
+            value = self.input_values[name]
+            return _signed(value) if self.chip.input_pins[name] == 16 else value
+        if name not in self.chip.pins:
+            raise ValueError("{} has no pin {}.".format(self.chip.name, name))
+        if not self.batch:
+            return self.chip.pin(name)
+        index = len(self.snapshots) - 1
+        return lambda: self._batch_value(name, index)
+
+    def flush(self) -> None:
+        # Evaluates the inputs recorded since the last flush.
+        if not self.batch or len(self.results) == len(self.snapshots):
+            return
+        snapshots = self.snapshots[len(self.results):]
+        chip = self.chip
+        chip.set_lanes(len(snapshots))
+        for name in self.input_values:
+            chip.set_pin(name, [snapshot[name] for snapshot in snapshots])
+        chip.evaluate()
+        wires = list(chip.wires)
+        self.results.extend((wires, lane) for lane in range(len(snapshots)))
+
+    def _batch_value(self, name: str, index: int) -> int:
+        if index < 0:
+            return 0
+        wires, lane = self.results[index]
+        self.chip.wires, saved = wires, self.chip.wires
+        value = self.chip.pin(name, lane)
+        self.chip.wires = saved
+        return value
+
+
+def run_hdl_script(path_tst: str, write_output: bool = False) -> ScriptResult:
+    return run_script(HardwareSimulator(), path_tst, write_output)
+
+
+def main():
+    arg_parser = ArgumentParser()
+    arg_parser.add_argument("paths", type=str, nargs="+", help="Paths to .tst files of chips")
+    arg_parser.add_argument("--write-output", action="store_true",
+        help="Write the output files named by the scripts")
+    args = arg_parser.parse_args()
+
+    num_failed = 0
+    for path_tst in args.paths:
+        start = time.perf_counter()
+        result = run_hdl_script(path_tst, args.write_output)
+        print("{} {} ({:.1f} ms){}".format("PASS" if result.passed else "FAIL", path_tst,
+            (time.perf_counter() - start) * 1000, "" if result.passed else ": " + result.message))
+        num_failed += not result.passed
+    return 1 if num_failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,625 @@
+import re
+import time
+from argparse import ArgumentParser
+from array import array
+from collections import namedtuple
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple, Union
+
+
+KEYWORD = 0
+SYMBOL = 1
+INTEGER_CONSTANT = 2
+STRING_CONSTANT = 3
+IDENTIFIER = 4
+TOKEN_TAGS = ("keyword", "symbol", "integerConstant", "stringConstant", "identifier")
+
+KEYWORDS = ("class", "constructor", "function", "method", "field", "static", "var", "int",
+    "char", "boolean", "void", "true", "false", "null", "this", "let", "do", "if", "else",
+    "while", "return")
+SYMBOLS = "{}()[].,;+-*/&|<>=~"
+# Keywords and symbols have the same string ids in every token stream, so the
+# parser compares ints.
+TOKEN_IDS = dict((text, token_id) for token_id, text in enumerate(KEYWORDS + tuple(SYMBOLS)))
+KEYWORD_IDS = frozenset(TOKEN_IDS[keyword] for keyword in KEYWORDS)
+MAX_INTEGER = 32767
+
+MASTER_PATTERN = re.compile(r"""
+    (?P<skip>\s+|//[^\n]*|/\*.*?\*/)
+  | (?P<integer>\d+)
+  | "(?P<string>[^"\n]*)"
+  | (?P<word>[A-Za-z_]\w*)
+  | (?P<unterminated>/\*)
+  | (?P<symbol>[{}()\[\].,;+\-*/&|<>=~])
+  | (?P<error>"|.)
+""", re.VERBOSE | re.DOTALL)
+
+
+class TokenStream:
+    # The tokens of a file in parallel arrays: kind code, value and offset
+    # in the source. The value of an integer constant is the integer; the
+    # value of any other token is the id of its text in strings, where
+    # every distinct text is stored once.
+    def __init__(self, source: str, path: str = "<source>"):
+        self.source = source
+        self.path = path
+        self.kinds = array("B")
+        self.values = array("I")
+        self.offsets = array("I")
+        self.strings = list(TOKEN_IDS)
+        self._string_ids = dict(TOKEN_IDS)
+        self._scan()
+
+    def _intern(self, text: str) -> int:
+        string_id = self._string_ids.get(text)
+        if string_id is None:
+            string_id = self._string_ids[text] = len(self.strings)
+            self.strings.append(text)
+        return string_id
+
+    def _scan(self) -> None:
+        kinds, values, offsets = self.kinds, self.values, self.offsets
+        intern, keyword_ids = self._intern, KEYWORD_IDS
+        for match in MASTER_PATTERN.finditer(self.source):
+            group = match.lastgroup
+            if group == "skip":
+                continue
+            if group == "word":
+                value = intern(match.group(group))
+                kind = KEYWORD if value in keyword_ids else IDENTIFIER
+            elif group == "symbol":
+                kind, value = SYMBOL, TOKEN_IDS[match.group(group)]
+            elif group == "integer":
+                kind, value = INTEGER_CONSTANT, int(match.group(group))
+                if value > MAX_INTEGER:
+                    self.error(match.start(), "Integer constant {} is too large".format(value))
+            elif group == "string":
+                kind, value = STRING_CONSTANT, intern(match.group(group))
+            elif group == "unterminated":
+                self.error(match.start(), "Unterminated comment")
+            else:
+                self.error(match.start(), "Unexpected {!r}".format(match.group(group)))
+            kinds.append(kind)
+            values.append(value)
+            offsets.append(match.start())
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def text(self, index: int) -> str:
+        if self.kinds[index] == INTEGER_CONSTANT:
+            return str(self.values[index])
+        return self.strings[self.values[index]]
+
+    def line(self, offset: int) -> int:
+        return self.source.count("\n", 0, offset) + 1
+
+    def error(self, offset: int, message: str) -> None:
+        raise ValueError("{}:{}: {}.".format(self.path, self.line(offset), message))
+
+
+def tokenize_file(path_jack: str) -> TokenStream:
+    with open(path_jack, "r") as fin:
+        return TokenStream(fin.read(), path_jack)
+
+
+# Abstract syntax tree. Types are names: a keyword (int, char, boolean,
+# void) or a class name.
+Class = namedtuple("Class", ("name", "class_vars", "subroutines"))
+ClassVarDec = namedtuple("ClassVarDec", ("kind", "type", "names"))
+Parameter = namedtuple("Parameter", ("type", "name"))
+SubroutineDec = namedtuple("SubroutineDec", ("kind", "return_type", "name", "parameters",
+    "local_vars", "statements"))
+VarDec = namedtuple("VarDec", ("type", "names"))
+LetStatement = namedtuple("LetStatement", ("name", "index", "value"))
+IfStatement = namedtuple("IfStatement", ("condition", "then_statements", "else_statements"))
+WhileStatement = namedtuple("WhileStatement", ("condition", "statements"))
+DoStatement = namedtuple("DoStatement", ("call",))
+ReturnStatement = namedtuple("ReturnStatement", ("value",))
+# Jack has no operator precedence: an expression is a term followed by
+# (operator, term) pairs, applied from left to right.
+Expression = namedtuple("Expression", ("term", "operations"))
+IntegerConstant = namedtuple("IntegerConstant", ("value",))
+StringConstant = namedtuple("StringConstant", ("value",))
+KeywordConstant = namedtuple("KeywordConstant", ("keyword",))
+VarTerm = namedtuple("VarTerm", ("name", "index"))
+# receiver is the class or variable before the dot, or None.
+SubroutineCall = namedtuple("SubroutineCall", ("receiver", "name", "args"))
+ParenthesizedTerm = namedtuple("ParenthesizedTerm", ("expression",))
+UnaryTerm = namedtuple("UnaryTerm", ("operator", "term"))
+
+Statement = Union[LetStatement, IfStatement, WhileStatement, DoStatement, ReturnStatement]
+Term = Union[IntegerConstant, StringConstant, KeywordConstant, VarTerm, SubroutineCall,
+    ParenthesizedTerm, UnaryTerm]
+
+OPERATORS = frozenset(TOKEN_IDS[operator] for operator in "+-*/&|<>=")
+UNARY_OPERATORS = frozenset(TOKEN_IDS[operator] for operator in "-~")
+KEYWORD_CONSTANTS = frozenset(TOKEN_IDS[keyword] for keyword in ("true", "false", "null", "this"))
+TYPE_KEYWORDS = frozenset(TOKEN_IDS[keyword] for keyword in ("int", "char", "boolean"))
+CLASS_VAR_KINDS = frozenset(TOKEN_IDS[keyword] for keyword in ("static", "field"))
+SUBROUTINE_KINDS = frozenset(TOKEN_IDS[keyword] for keyword in
+    ("constructor", "function", "method"))
+END = -1
+
+
+class Parser:
+    # Recursive descent over a TokenStream with one token of lookahead, and
+    # two for the terms starting with an identifier; it never backtracks.
+    def __init__(self, tokens: TokenStream):
+        self.tokens = tokens
+        self.kinds = tokens.kinds
+        self.values = tokens.values
+        self.strings = tokens.strings
+        self.position = 0
+
+    def _peek(self, ahead: int = 0) -> int:
+        # The id of a keyword or symbol token, END past the last token and
+        # -2 for other tokens.
+        position = self.position + ahead
+        if position >= len(self.kinds):
+            return END
+        return self.values[position] if self.kinds[position] <= SYMBOL else -2
+
+    def _error(self, expected: str) -> None:
+        tokens, position = self.tokens, self.position
+        if position >= len(tokens):
+            tokens.error(len(tokens.source), "Expected {}, got the end of the file".format(
+                expected))
+        tokens.error(tokens.offsets[position], "Expected {}, got {!r}".format(
+            expected, tokens.text(position)))
+
+    def _expect(self, text: str) -> None:
+        if self._peek() != TOKEN_IDS[text]:
+            self._error(repr(text))
+        self.position += 1
+
+    def _accept(self, text: str) -> bool:
+        if self._peek() == TOKEN_IDS[text]:
+            self.position += 1
+            return True
+        return False
+
+    def _identifier(self) -> str:
+        position = self.position
+        if position >= len(self.kinds) or self.kinds[position] != IDENTIFIER:
+            self._error("an identifier")
+        self.position += 1
+        return self.strings[self.values[position]]
+
+    def _type(self, allow_void: bool = False) -> str:
+        token_id = self._peek()
+        if token_id in TYPE_KEYWORDS or (allow_void and token_id == TOKEN_IDS["void"]):
+            self.position += 1
+            return self.strings[token_id]
+        return self._identifier()
+
+    def _names(self) -> Tuple[str, ...]:
+        # name (, name)* ;
+        names = [self._identifier()]
+        while self._accept(","):
+            names.append(self._identifier())
+        self._expect(";")
+        return tuple(names)
+
+    def parse_class(self) -> Class:
+        self._expect("class")
+        name = self._identifier()
+        self._expect("{")
+        class_vars, subroutines = [], []
+        while self._peek() in CLASS_VAR_KINDS:
+            kind = self.strings[self.values[self.position]]
+            self.position += 1
+            class_vars.append(ClassVarDec(kind, self._type(), self._names()))
+        while self._peek() in SUBROUTINE_KINDS:
+            subroutines.append(self._subroutine())
+        self._expect("}")
+        if self.position != len(self.kinds):
+            self._error("the end of the file")
+        return Class(name, class_vars, subroutines)
+
+    def _subroutine(self) -> SubroutineDec:
+        kind = self.strings[self.values[self.position]]
+        self.position += 1
+        return_type = self._type(allow_void=True)
+        name = self._identifier()
+        self._expect("(")
+        parameters = []
+        if self._peek() != TOKEN_IDS[")"]:
+            parameters.append(Parameter(self._type(), self._identifier()))
+            while self._accept(","):
+                parameters.append(Parameter(self._type(), self._identifier()))
+        self._expect(")")
+        self._expect("{")
+        local_vars = []
+        while self._accept("var"):
+            local_vars.append(VarDec(self._type(), self._names()))
+        statements = self._statements()
+        self._expect("}")
+        return SubroutineDec(kind, return_type, name, parameters, local_vars, statements)
+
+    def _statements(self) -> List[Statement]:
+        statements = []
+        while True:
+            token_id = self._peek()
+            if token_id == TOKEN_IDS["let"]:
+                self.position += 1
+                name = self._identifier()
+                index = None
+                if self._accept("["):
+                    index = self.parse_expression()
+                    self._expect("]")
+                self._expect("=")
+                statements.append(LetStatement(name, index, self.parse_expression()))
+                self._expect(";")
+            elif token_id == TOKEN_IDS["if"]:
+                self.position += 1
+                condition = self._condition()
+                then_statements = self._block()
+                else_statements = self._block() if self._accept("else") else None
+                statements.append(IfStatement(condition, then_statements, else_statements))
+            elif token_id == TOKEN_IDS["while"]:
+                self.position += 1
+                statements.append(WhileStatement(self._condition(), self._block()))
+            elif token_id == TOKEN_IDS["do"]:
+                self.position += 1
+                statements.append(DoStatement(self._subroutine_call(self._identifier())))
+                self._expect(";")
+            elif token_id == TOKEN_IDS["return"]:
+                self.position += 1
+                value = None if self._peek() == TOKEN_IDS[";"] else self.parse_expression()
+                statements.append(ReturnStatement(value))
+                self._expect(";")
+            else:
+                return statements
+
+    def _condition(self) -> Expression:
+        self._expect("(")
+        condition = self.parse_expression()
+        self._expect(")")
+        return condition
+
+    def _block(self) -> List[Statement]:
+        self._expect("{")
+        statements = self._statements()
+        self._expect("}")
+        return statements
+
+    def parse_expression(self) -> Expression:
+        term = self._term()
+        operations = []
+        while self._peek() in OPERATORS:
+            operator = self.strings[self.values[self.position]]
+            self.position += 1
+            operations.append((operator, self._term()))
+        return Expression(term, operations)
+
+    def _term(self) -> Term:
+        position = self.position
+        if position >= len(self.kinds):
+            self._error("a term")
+        kind, value = self.kinds[position], self.values[position]
+        if kind == INTEGER_CONSTANT:
+            self.position += 1
+            return IntegerConstant(value)
+        elif kind == STRING_CONSTANT:
+            self.position += 1
+            return StringConstant(self.strings[value])
+        elif kind == IDENTIFIER:
+            self.position += 1
+            name = self.strings[value]
+            next_id = self._peek()
+            if next_id == TOKEN_IDS["["]:
+                self.position += 1
+                index = self.parse_expression()
+                self._expect("]")
+                return VarTerm(name, index)
+            elif next_id == TOKEN_IDS["("] or next_id == TOKEN_IDS["."]:
+                return self._subroutine_call(name)
+            return VarTerm(name, None)
+        elif value in KEYWORD_CONSTANTS and kind == KEYWORD:
+            self.position += 1
+            return KeywordConstant(self.strings[value])
+        elif value == TOKEN_IDS["("] and kind == SYMBOL:
+            self.position += 1
+            expression = self.parse_expression()
+            self._expect(")")
+            return ParenthesizedTerm(expression)
+        elif value in UNARY_OPERATORS and kind == SYMBOL:
+            self.position += 1
+            return UnaryTerm(self.strings[value], self._term())
+        self._error("a term")
+
+    def _subroutine_call(self, name: str) -> SubroutineCall:
+        # After the first identifier: name(args) or receiver.name(args).
+        receiver = None
+        if self._accept("."):
+            receiver, name = name, self._identifier()
+        self._expect("(")
+        args = []
+        if self._peek() != TOKEN_IDS[")"]:
+            args.append(self.parse_expression())
+            while self._accept(","):
+                args.append(self.parse_expression())
+        self._expect(")")
+        return SubroutineCall(receiver, name, args)
+
+
+def parse_class(tokens: TokenStream) -> Class:
+    return Parser(tokens).parse_class()
+
+
+def parse_file(path_jack: str) -> Class:
+    return parse_class(tokenize_file(path_jack))
+
+
+XML_ESCAPES = str.maketrans({"<": "&lt;", ">": "&gt;", "&": "&amp;", '"': "&quot;"})
+
+
+def _xml_token(tag: str, text: str) -> str:
+    return "<{0}> {1} </{0}>".format(tag, text.translate(XML_ESCAPES))
+
+
+def tokens_xml(tokens: TokenStream) -> List[str]:
+    # The lines of the XxxT.xml files of project 10.
+    return ["<tokens>"] + [_xml_token(TOKEN_TAGS[tokens.kinds[index]], tokens.text(index))
+        for index in range(len(tokens))] + ["</tokens>"]
+
+
+class XMLWriter:
+    # The parse tree of project 10 (Xxx.xml), written from the AST: the
+    # tokens that the AST leaves out, such as separators, are implied by the
+    # grammar.
+    def __init__(self):
+        self.lines = []
+        self.depth = 0
+
+    def _open(self, tag: str) -> None:
+        self.lines.append("  " * self.depth + "<{}>".format(tag))
+        self.depth += 1
+
+    def _close(self, tag: str) -> None:
+        self.depth -= 1
+        self.lines.append("  " * self.depth + "</{}>".format(tag))
+
+    def _token(self, tag: str, text: str) -> None:
+        self.lines.append("  " * self.depth + _xml_token(tag, text))
+
+    def _keyword(self, text: str) -> None:
+        self._token("keyword", text)
+
+    def _symbol(self, text: str) -> None:
+        self._token("symbol", text)
+
+    def _identifier(self, text: str) -> None:
+        self._token("identifier", text)
+
+    def _type(self, name: str) -> None:
+        self._token("keyword" if name in TOKEN_IDS else "identifier", name)
+
+    def _names(self, names: Iterable[str]) -> None:
+        for index, name in enumerate(names):
+            if index:
+                self._symbol(",")
+            self._identifier(name)
+        self._symbol(";")
+
+    def write_class(self, jack_class: Class) -> List[str]:
+        self._open("class")
+        self._keyword("class")
+        self._identifier(jack_class.name)
+        self._symbol("{")
+        for class_var in jack_class.class_vars:
+            self._open("classVarDec")
+            self._keyword(class_var.kind)
+            self._type(class_var.type)
+            self._names(class_var.names)
+            self._close("classVarDec")
+        for subroutine in jack_class.subroutines:
+            self._subroutine(subroutine)
+        self._symbol("}")
+        self._close("class")
+        return self.lines
+
+    def _subroutine(self, subroutine: SubroutineDec) -> None:
+        self._open("subroutineDec")
+        self._keyword(subroutine.kind)
+        self._type(subroutine.return_type)
+        self._identifier(subroutine.name)
+        self._symbol("(")
+        self._open("parameterList")
+        for index, parameter in enumerate(subroutine.parameters):
+            if index:
+                self._symbol(",")
+            self._type(parameter.type)
+            self._identifier(parameter.name)
+        self._close("parameterList")
+        self._symbol(")")
+        self._open("subroutineBody")
+        self._symbol("{")
+        for var_dec in subroutine.local_vars:
+            self._open("varDec")
+            self._keyword("var")
+            self._type(var_dec.type)
+            self._names(var_dec.names)
+            self._close("varDec")
+        self._statements(subroutine.statements)
+        self._symbol("}")
+        self._close("subroutineBody")
+        self._close("subroutineDec")
+
+    def _statements(self, statements: List[Statement]) -> None:
+        self._open("statements")
+        for statement in statements:
+            if isinstance(statement, LetStatement):
+                self._open("letStatement")
+                self._keyword("let")
+                self._identifier(statement.name)
+                if statement.index is not None:
+                    self._symbol("[")
+                    self._expression(statement.index)
+                    self._symbol("]")
+                self._symbol("=")
+                self._expression(statement.value)
+                self._symbol(";")
+                self._close("letStatement")
+            elif isinstance(statement, IfStatement):
+                self._open("ifStatement")
+                self._keyword("if")
+                self._condition(statement.condition)
+                self._block(statement.then_statements)
+                if statement.else_statements is not None:
+                    self._keyword("else")
+                    self._block(statement.else_statements)
+                self._close("ifStatement")
+            elif isinstance(statement, WhileStatement):
+                self._open("whileStatement")
+                self._keyword("while")
+                self._condition(statement.condition)
+                self._block(statement.statements)
+                self._close("whileStatement")
+            elif isinstance(statement, DoStatement):
+                self._open("doStatement")
+                self._keyword("do")
+                self._subroutine_call(statement.call)
+                self._symbol(";")
+                self._close("doStatement")
+            else:
+                self._open("returnStatement")
+                self._keyword("return")
+                if statement.value is not None:
+                    self._expression(statement.value)
+                self._symbol(";")
+                self._close("returnStatement")
+        self._close("statements")
+
+    def _condition(self, condition: Expression) -> None:
+        self._symbol("(")
+        self._expression(condition)
+        self._symbol(")")
+
+    def _block(self, statements: List[Statement]) -> None:
+        self._symbol("{")
+        self._statements(statements)
+        self._symbol("}")
+
+    def _expression(self, expression: Expression) -> None:
+        self._open("expression")
+        self._term(expression.term)
+        for operator, term in expression.operations:
+            self._symbol(operator)
+            self._term(term)
+        self._close("expression")
+
+    def _term(self, term: Term) -> None:
+        self._open("term")
+        if isinstance(term, IntegerConstant):
+            self._token("integerConstant", str(term.value))
+        elif isinstance(term, StringConstant):
+            self._token("stringConstant", term.value)
+        elif isinstance(term, KeywordConstant):
+            self._keyword(term.keyword)
+        elif isinstance(term, VarTerm):
+            self._identifier(term.name)
+            if term.index is not None:
+                self._symbol("[")
+                self._expression(term.index)
+                self._symbol("]")
+        elif isinstance(term, SubroutineCall):
+            self._subroutine_call(term)
+        elif isinstance(term, ParenthesizedTerm):
+            self._condition(term.expression)
+        else:
+            self._symbol(term.operator)
+            self._term(term.term)
+        self._close("term")
+
+    def _subroutine_call(self, call: SubroutineCall) -> None:
+        if call.receiver is not None:
+            self._identifier(call.receiver)
+            self._symbol(".")
+        self._identifier(call.name)
+        self._symbol("(")
+        self._open("expressionList")
+        for index, arg in enumerate(call.args):
+            if index:
+                self._symbol(",")
+            self._expression(arg)
+        self._close("expressionList")
+        self._symbol(")")
+
+
+def class_xml(jack_class: Class) -> List[str]:
+    return XMLWriter().write_class(jack_class)
+
+
+def collect_jack_files(paths: Iterable[str]) -> List[str]:
+    sources = []
+    for path in paths:
+        if Path(path).is_dir():
+            sources.extend(sorted(str(p) for p in Path(path).rglob("*.jack")))
+        else:
+            sources.append(path)
+    return sources
+
+
+def analyze_file(path_jack: str, output_dir: Optional[str] = None) -> Class:
+    # With output_dir, writes Xxx.xml and XxxT.xml there.
+    tokens = tokenize_file(path_jack)
+    jack_class = parse_class(tokens)
+    if output_dir is not None:
+        stem = Path(output_dir) / Path(path_jack).stem
+        with open("{}T.xml".format(stem), "w") as fout:
+            fout.writelines(line + "\n" for line in tokens_xml(tokens))
+        with open("{}.xml".format(stem), "w") as fout:
+            fout.writelines(line + "\n" for line in class_xml(jack_class))
+    return jack_class
+
+
+def benchmark(sources: List[str], repeat: int) -> None:
+    texts = []
+    for path_jack in sources:
+        with open(path_jack, "r") as fin:
+            texts.append((path_jack, fin.read()))
+    num_bytes = sum(len(source) for _, source in texts)
+    best_tokenize = best_parse = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        streams = [TokenStream(source, path_jack) for path_jack, source in texts]
+        middle = time.perf_counter()
+        for tokens in streams:
+            parse_class(tokens)
+        end = time.perf_counter()
+        best_tokenize = min(best_tokenize, middle - start)
+        best_parse = min(best_parse, end - middle)
+    num_tokens = sum(len(tokens) for tokens in streams)
+    print("{} files, {} KiB, {} tokens".format(len(texts), num_bytes // 1024, num_tokens))
+    print("tokenize: {:.1f} ms ({:.2f} M tokens/s)".format(best_tokenize * 1000,
+        num_tokens / best_tokenize / 1e6))
+    print("parse:    {:.1f} ms ({:.2f} M tokens/s)".format(best_parse * 1000,
+        num_tokens / best_parse / 1e6))
+
+
+def main():
+    arg_parser = ArgumentParser()
+    arg_parser.add_argument("paths", type=str, nargs="+",
+        help="Jack files or directories searched for .jack files")
+    arg_parser.add_argument("-o", "--output-dir", type=str, default=None,
+        help="Write the Xxx.xml parse tree and XxxT.xml tokens of each file here")
+    arg_parser.add_argument("--benchmark", type=int, default=0, metavar="REPEAT",
+        help="Time the tokenizer and the parser, best of REPEAT runs")
+    args = arg_parser.parse_args()
+
+    sources = collect_jack_files(args.paths)
+    if args.benchmark:
+        benchmark(sources, args.benchmark)
+        return
+    if args.output_dir is not None:
+        Path(args.output_dir).mkdir(parents=True, exist_ok=True)
+    for path_jack in sources:
+        jack_class = analyze_file(path_jack, args.output_dir)
+        print("{}: class {}, {} subroutines".format(path_jack, jack_class.name,
+            len(jack_class.subroutines)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import time
+from argparse import ArgumentParser
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable, List, Optional
+from CPUEmulator import CPUScriptEngine
+from HardwareSimulator import HardwareSimulator
+from testscript import ScriptCommand, parse_script, run_script
+from VMEmulator import VMScriptEngine
+
+
+# Engines of the test scripts, by the suffix of the file they load. Scripts
+# of the VM emulator load a .vm file or the directory of the script.
+ENGINES = {
+    "hdl": HardwareSimulator,
+    "cpu": CPUScriptEngine,
+    "vm": VMScriptEngine,
+}
+ENGINE_SUFFIXES = {".hdl": "hdl", ".hack": "cpu", ".hackb": "cpu", ".asm": "cpu", ".vm": "vm"}
+
+TestResult = namedtuple("TestResult", ("path", "engine", "status", "message", "num_lines",
+    "seconds"))
+PASS = "PASS"
+FAIL = "FAIL"
+SKIP = "SKIP"
+
+
+def script_engine(path_tst: str) -> str:
+    for statement in parse_script(Path(path_tst).read_text()):
+        if isinstance(statement, ScriptCommand) and statement.name == "load":
+            if not statement.args:
+                return "vm"
+            suffix = Path(statement.args[0]).suffix
+            return ENGINE_SUFFIXES.get(suffix, "vm" if not suffix else None)
+    return None
+
+
+def discover_scripts(paths: Iterable[str]) -> List[str]:
+    scripts = []
+    for path in paths:
+        if Path(path).is_dir():
+            scripts.extend(sorted(str(p) for p in Path(path).rglob("*.tst")))
+        else:
+            scripts.append(path)
+    return scripts
+
+
+def run_test(path_tst: str, write_output: bool = False) -> TestResult:
+    start = time.perf_counter()
+    try:
+        engine = script_engine(path_tst)
+    except (OSError, ValueError) as error:
+        return TestResult(path_tst, None, FAIL, str(error), 0, time.perf_counter() - start)
+    if engine is None:
+        return TestResult(path_tst, None, FAIL, "No engine for the loaded file.", 0,
+            time.perf_counter() - start)
+    try:
+        result = run_script(ENGINES[engine](), path_tst, write_output)
+    except Exception as error:
+        # A missing file, or a program the assembler or translator rejects.
+        return TestResult(path_tst, engine, FAIL, "{}: {}".format(type(error).__name__, error),
+            0, time.perf_counter() - start)
+    status = SKIP if result.skipped else PASS if result.passed else FAIL
+    return TestResult(path_tst, engine, status, result.message, result.num_lines,
+        time.perf_counter() - start)
+
+
+def run_tests(scripts: List[str], jobs: Optional[int] = None,
+              write_output: bool = False) -> List[TestResult]:
+    if jobs == 1 or len(scripts) <= 1:
+        return [run_test(path_tst, write_output) for path_tst in scripts]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(run_test, path_tst, write_output) for path_tst in scripts]
+        return [future.result() for future in futures]
+
+
+def main():
+    arg_parser = ArgumentParser()
+    arg_parser.add_argument("paths", type=str, nargs="*", default=["../projects"],
+        help="Test scripts or directories searched for .tst files")
+    arg_parser.add_argument("-j", "--jobs", type=int, default=None,
+        help="Number of worker processes (default: number of CPUs)")
+    arg_parser.add_argument("--write-output", action="store_true",
+        help="Write the output files named by the scripts")
+    args = arg_parser.parse_args()
+
+    start = time.perf_counter()
+    results = run_tests(discover_scripts(args.paths), args.jobs, args.write_output)
+    for result in results:
+        print("{} {:>9.1f} ms  {:<3} {}{}".format(result.status, result.seconds * 1000,
+            result.engine or "-", result.path,
+            ": " + result.message if result.message else ""))
+    counts = dict((status, sum(result.status == status for result in results))
+        for status in (PASS, FAIL, SKIP))
+    print("{} passed, {} failed, {} skipped in {:.1f} s".format(counts[PASS], counts[FAIL],
+        counts[SKIP], time.perf_counter() - start))
+    return 1 if counts[FAIL] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,382 @@
+import re
+import time
+from argparse import ArgumentParser
+from array import array
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from CPUEmulator import RAM_SIZE
+from oshooks import NATIVE_FUNCTIONS, NativeFunction, call_native, check_native
+from testscript import parse_value
+from VMTranslator import Command, CommandType, INIT_FUNCTION, read_commands, to_word
+
+
+# The memory layout of the code generated by CodeWriter.
+POINTER_ADDRESSES = {"sp": 0, "local": 1, "argument": 2, "this": 3, "that": 4}
+SEGMENT_POINTERS = {"local": 1, "argument": 2, "this": 3, "that": 4}
+POINTER_BASE = 3
+TEMP_BASE = 5
+STATIC_BASE = 16
+STACK_BASE = 256
+
+# Opcodes of the resolved program. Each instruction is a tuple (opcode, x, y).
+PUSH_CONSTANT = 0       # x: value
+PUSH_INDIRECT = 1       # x: address of the segment pointer, y: index
+PUSH_DIRECT = 2         # x: address (temp, pointer, static)
+POP_INDIRECT = 3
+POP_DIRECT = 4
+ADD = 5
+SUB = 6
+NEG = 7
+EQ = 8
+GT = 9
+LT = 10
+AND = 11
+OR = 12
+NOT = 13
+GOTO = 14               # x: index of the target
+IF_GOTO = 15
+FUNCTION = 16           # x: number of locals
+CALL = 17               # x: index of the function, y: number of arguments
+RETURN = 18
+
+ARITHMETIC_OPCODES = {"add": ADD, "sub": SUB, "neg": NEG, "eq": EQ, "gt": GT, "lt": LT,
+    "and": AND, "or": OR, "not": NOT}
+
+Instruction = Tuple[int, int, int]
+
+
+class VMEmulator:
+    # Executes VM commands directly. The commands of all files are resolved
+    # once into integer instructions: segments to RAM addresses or pointer
+    # addresses, labels and functions to instruction indices. Labels are not
+    # instructions, as in the VM emulator of the course. The pointers, temp
+    # and the stack have the RAM layout of the translated program, so tests
+    # of the translator can be checked against them. Static variables are
+    # allocated from 16 in order of first use; the translated program may
+    # place them elsewhere, as its own variables share that area.
+    def __init__(self, files: Iterable[Tuple[str, Iterable[Command]]], bootstrap: bool = False):
+        self.ram = array("h", bytes(2 * RAM_SIZE))
+        self.steps = 0
+        self.halted = False
+        self.natives = {}
+        self.verify_natives = False
+        self.pending_checks = []
+        self.load(files)
+        self.reset(bootstrap)
+
+    @classmethod
+    def from_paths(cls, paths_vm: Sequence[Path], bootstrap: bool = False) -> "VMEmulator":
+        return cls(((Path(path_vm).stem, read_commands(str(path_vm))) for path_vm in paths_vm),
+            bootstrap)
+
+    def load(self, files: Iterable[Tuple[str, Iterable[Command]]]) -> None:
+        self.commands = []
+        self.static_addresses = {}
+        labels, functions = {}, {}
+        for file_name, commands in files:
+            function_name = None
+            for command in commands:
+                if command.ctype == CommandType.FUNCTION:
+                    function_name = command.arg1
+                    functions[function_name] = len(self.commands)
+                elif command.ctype == CommandType.LABEL:
+                    labels[(function_name or file_name, command.arg1)] = len(self.commands)
+                    continue
+                self.commands.append((file_name, function_name, command))
+        self.functions = functions
+        self.program = [self._resolve(file_name, function_name, command, labels)
+            for file_name, function_name, command in self.commands]
+        self.halt_indices = self._find_halt_loops()
+
+    def _resolve(self, file_name: str, function_name: str, command: Command,
+                 labels: Dict[Tuple[str, str], int]) -> Instruction:
+        ctype = command.ctype
+        if ctype == CommandType.PUSH or ctype == CommandType.POP:
+            segment, index = command.arg1, int(command.arg2)
+            if segment == "constant" and ctype == CommandType.POP:
+                raise ValueError("Constant cannot be popped.")
+            elif segment == "constant":
+                return PUSH_CONSTANT, to_word(index), 0
+            if segment in SEGMENT_POINTERS:
+                return (PUSH_INDIRECT if ctype == CommandType.PUSH else POP_INDIRECT,
+                    SEGMENT_POINTERS[segment], index)
+            if segment == "static":
+                key = (file_name, index)
+                address = self.static_addresses.setdefault(key,
+                    STATIC_BASE + len(self.static_addresses))
+            else:
+                address = self.segment_address(segment, index)
+            return PUSH_DIRECT if ctype == CommandType.PUSH else POP_DIRECT, address, 0
+        elif ctype == CommandType.ARITHMETIC:
+            return ARITHMETIC_OPCODES[command.arg1], 0, 0
+        elif ctype == CommandType.GOTO or ctype == CommandType.IF_GOTO:
+            target = labels.get((function_name or file_name, command.arg1))
+            if target is None:
+                raise ValueError("Unknown label {} in {}".format(command.arg1,
+                    function_name or file_name))
+            return GOTO if ctype == CommandType.GOTO else IF_GOTO, target, 0
+        elif ctype == CommandType.FUNCTION:
+            return FUNCTION, int(command.arg2), 0
+        elif ctype == CommandType.CALL:
+            if command.arg1 not in self.functions:
+                raise ValueError("Unknown function {}".format(command.arg1))
+            return CALL, self.functions[command.arg1], int(command.arg2)
+        elif ctype == CommandType.RETURN:
+            return RETURN, 0, 0
+        raise NotImplementedError("Commandtype {} is not implemented.".format(ctype))
+
+    def _find_halt_loops(self) -> frozenset:
+        # gotos to themselves: "label END goto END".
+        return frozenset(index for index, (opcode, target, _) in enumerate(self.program)
+            if opcode == GOTO and target == index)
+
+    def segment_address(self, segment: str, index: int, file_name: str = None) -> int:
+        # RAM address of a segment entry, through the current segment pointers.
+        # Statics belong to file_name, by default the file of the current
+        # command.
+        if segment in SEGMENT_POINTERS:
+            return self.ram[SEGMENT_POINTERS[segment]] + index
+        elif segment == "pointer":
+            return POINTER_BASE + index
+        elif segment == "temp":
+            return TEMP_BASE + index
+        elif segment == "static":
+            if file_name is None and self.pc < len(self.commands):
+                file_name = self.commands[self.pc][0]
+            if (file_name, index) not in self.static_addresses:
+                raise ValueError("No static {} in {}.".format(index, file_name))
+            return self.static_addresses[(file_name, index)]
+        raise ValueError("Invalid segment {}".format(segment))
+
+    def reset(self, bootstrap: bool = False) -> None:
+        # Execution starts at Sys.init if there is one and at the first command
+        # otherwise. With bootstrap, Sys.init is called as by the translated
+        # bootstrap code, with a frame whose return leaves the program.
+        self.pc = 0
+        self.halted = False
+        if INIT_FUNCTION in self.functions:
+            self.pc = self.functions[INIT_FUNCTION]
+            if bootstrap:
+                ram = self.ram
+                ram[0] = STACK_BASE
+                ram[STACK_BASE] = to_word(len(self.program))
+                ram[STACK_BASE + 1:STACK_BASE + 5] = ram[1:5]
+                ram[0] = STACK_BASE + 5
+                ram[1] = STACK_BASE + 5
+                ram[2] = STACK_BASE
+
+    def register_natives(self, natives: Dict[str, NativeFunction], verify: bool = False) -> None:
+        # Calls of the functions in natives run the native function instead,
+        # in no steps. With verify, the emulated function runs as well and its
+        # value is checked when it returns.
+        self.natives = dict((self.functions[name], (name, native))
+            for name, native in natives.items() if name in self.functions)
+        self.verify_natives = verify
+        self.pending_checks = []
+
+    def _call_native(self, index: int, num_args: int, sp: int) -> Optional[int]:
+        # The value of the native function, if it is not to be emulated.
+        name, native = self.natives[index]
+        args = list(self.ram[sp - num_args:sp])
+        value = call_native(name, native, args, self.ram, self.verify_natives)
+        if value is not None and self.verify_natives:
+            # Checked at the return of the frame the call sets up.
+            self.pending_checks.append((sp + 5, sp - num_args, name, args, value))
+            return None
+        return value
+
+    def _check_native(self) -> None:
+        _, arg, name, args, expected = self.pending_checks.pop()
+        check_native(name, args, expected, self.ram[arg])
+
+    def current_command(self) -> Command:
+        return self.commands[self.pc][2]
+
+    def run(self, max_steps: int, stop_at_halt: bool = True) -> int:
+        # Returns the number of commands executed, fewer than max_steps if the
+        # program reached a halt loop or ran past its last command.
+        program, ram, natives, checks = self.program, self.ram, self.natives, self.pending_checks
+        halt_indices = self.halt_indices if stop_at_halt else frozenset()
+        pc, sp = self.pc, ram[0]
+        step = 0
+        self.halted = False
+        try:
+            while step < max_steps:
+                opcode, x, y = program[pc]
+                step += 1
+                pc += 1
+                if opcode == PUSH_CONSTANT:
+                    ram[sp] = x
+                    sp += 1
+                elif opcode == PUSH_INDIRECT:
+                    ram[sp] = ram[ram[x] + y]
+                    sp += 1
+                elif opcode == PUSH_DIRECT:
+                    ram[sp] = ram[x]
+                    sp += 1
+                elif opcode == POP_INDIRECT:
+                    sp -= 1
+                    ram[ram[x] + y] = ram[sp]
+                elif opcode == POP_DIRECT:
+                    sp -= 1
+                    ram[x] = ram[sp]
+                elif opcode == ADD:
+                    sp -= 1
+                    ram[sp - 1] = ((ram[sp - 1] + ram[sp] + 0x8000) & 0xFFFF) - 0x8000
+                elif opcode == SUB:
+                    sp -= 1
+                    ram[sp - 1] = ((ram[sp - 1] - ram[sp] + 0x8000) & 0xFFFF) - 0x8000
+                elif opcode == NEG:
+                    ram[sp - 1] = ((0x8000 - ram[sp - 1]) & 0xFFFF) - 0x8000
+                elif opcode == EQ:
+                    sp -= 1
+                    ram[sp - 1] = -1 if ram[sp - 1] == ram[sp] else 0
+                elif opcode == GT:
+                    # As the translated program, which compares x - y with 0.
+                    sp -= 1
+                    ram[sp - 1] = -1 if to_word(ram[sp - 1] - ram[sp]) > 0 else 0
+                elif opcode == LT:
+                    sp -= 1
+                    ram[sp - 1] = -1 if to_word(ram[sp - 1] - ram[sp]) < 0 else 0
+                elif opcode == AND:
+                    sp -= 1
+                    ram[sp - 1] &= ram[sp]
+                elif opcode == OR:
+                    sp -= 1
+                    ram[sp - 1] |= ram[sp]
+                elif opcode == NOT:
+                    ram[sp - 1] = ~ram[sp - 1]
+                elif opcode == GOTO:
+                    if pc - 1 in halt_indices:
+                        pc = x
+                        self.halted = True
+                        break
+                    pc = x
+                elif opcode == IF_GOTO:
+                    sp -= 1
+                    if ram[sp]:
+                        pc = x
+                elif opcode == FUNCTION:
+                    for _ in range(x):
+                        ram[sp] = 0
+                        sp += 1
+                elif opcode == CALL:
+                    if x in natives:
+                        value = self._call_native(x, y, sp)
+                        if value is not None:
+                            sp -= y
+                            ram[sp] = value
+                            sp += 1
+                            continue
+                    ram[sp] = to_word(pc)
+                    ram[sp + 1:sp + 5] = ram[1:5]
+                    sp += 5
+                    ram[2] = sp - 5 - y
+                    ram[1] = sp
+                    pc = x
+                else:
+                    frame = ram[1]
+                    pc = ram[frame - 5] & 0xFFFF
+                    ram[ram[2]] = ram[sp - 1]
+                    sp = ram[2] + 1
+                    ram[1:5] = ram[frame - 4:frame]
+                    if checks and checks[-1][0] == frame:
+                        self._check_native()
+        except IndexError:
+            # Past the last command.
+            self.halted = True
+        finally:
+            self.pc = pc
+            ram[0] = sp
+            self.steps += step
+        return step
+
+    def step(self) -> int:
+        return self.run(1, stop_at_halt=False)
+
+
+SEGMENT_VALUE = re.compile(r"(\w+)\[(\d+)\]$")
+
+
+class VMScriptEngine:
+    # Engine of testscript.ScriptRunner for VM emulator scripts: load of a
+    # .vm file or of the .vm files of the script's directory, set of RAM[i],
+    # segment pointers (sp, local...) and segment entries (argument[1]...),
+    # vmstep.
+    def __init__(self):
+        self.emulator = None
+
+    def run_command(self, name: str, args: List[str], directory: Path) -> None:
+        if not self.run_repeated(name, args, 1, directory):
+            raise ValueError("Unknown command {}.".format(name))
+
+    def run_repeated(self, name: str, args: List[str], count: int, directory: Path) -> bool:
+        if name == "vmstep":
+            self._loaded().run(count)
+        elif name == "load" and count == 1:
+            path = directory / args[0] if args else directory
+            paths_vm = sorted(path.glob("*.vm")) if path.is_dir() else [path]
+            if not paths_vm:
+                raise ValueError("No .vm file in {}.".format(path))
+            self.emulator = VMEmulator.from_paths(paths_vm)
+        elif name == "set" and count == 1:
+            self._loaded().ram[self._address(args[0])] = to_word(parse_value(args[1]))
+        else:
+            return False
+        return True
+
+    def _loaded(self) -> VMEmulator:
+        if self.emulator is None:
+            raise ValueError("No program loaded.")
+        return self.emulator
+
+    def _address(self, name: str) -> int:
+        if name in POINTER_ADDRESSES:
+            return POINTER_ADDRESSES[name]
+        match = SEGMENT_VALUE.match(name)
+        if match is None:
+            raise ValueError("Unknown VM emulator variable {}.".format(name))
+        segment, index = match.group(1), int(match.group(2))
+        if segment == "RAM":
+            return index
+        return self._loaded().segment_address(segment, index)
+
+    def value(self, name: str) -> int:
+        return self._loaded().ram[self._address(name)]
+
+    def flush(self) -> None:
+        pass
+
+
+def main():
+    arg_parser = ArgumentParser()
+    arg_parser.add_argument("path", type=str, help="Path to a .vm file or a directory of .vm files")
+    arg_parser.add_argument("-s", "--steps", type=int, default=1000000,
+        help="Maximum number of VM commands to run")
+    arg_parser.add_argument("--bootstrap", action="store_true",
+        help="Call Sys.init as the translated bootstrap code does")
+    arg_parser.add_argument("--show", type=str, default="0:16",
+        help="Range of RAM addresses printed at the end, as start:end")
+    arg_parser.add_argument("--native", action="store_true",
+        help="Run OS functions natively")
+    arg_parser.add_argument("--verify-native", action="store_true",
+        help="Check the values of native functions against the emulated ones")
+    args = arg_parser.parse_args()
+
+    path = Path(args.path)
+    paths_vm = sorted(path.glob("*.vm")) if path.is_dir() else [path]
+    emulator = VMEmulator.from_paths(paths_vm, args.bootstrap)
+    if args.native or args.verify_native:
+        emulator.register_natives(NATIVE_FUNCTIONS, args.verify_native)
+    start = time.perf_counter()
+    steps = emulator.run(args.steps)
+    seconds = time.perf_counter() - start
+    print("{} commands in {:.3f} s ({:.2f} M/s){}".format(steps, seconds,
+        steps / seconds / 1e6 if seconds else 0.0, ", halted" if emulator.halted else ""))
+    first, last = (int(address) for address in args.show.split(":"))
+    for address in range(first, last):
+        print("RAM[{}] = {}".format(address, emulator.ram[address]))
+
+
+if __name__ == "__main__":
+    main()
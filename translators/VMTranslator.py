@@ -1,8 +1,17 @@
+import sys
+import assemble
+import sourcemap
 from pathlib import Path
 from argparse import ArgumentParser
-from collections import namedtuple, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from collections import namedtuple
 from enum import Enum
-from typing import Tuple, Optional
+from typing import Dict, Tuple, Optional, List, Iterable, Iterator, Set, Union
+from assemble import ProgramBuilder, add_labels, encode_into_machine_code, new_symbol_table, \
+    write_asm, write_hack, format_instruction, AInstruction, AInstructionSymbol, CInsturction, \
+    Label, Instruction
+from buildcache import BuildCache, source_version
+from sourcemap import SourceMap, source_map_path
 
 
 ARITHMETIC_OPERATIONS = {
@@ -28,6 +37,9 @@ class CommandType(Enum):
     FUNCTION = 6
     RETURN = 7
     CALL = 8
+    # push immediately followed by pop, fused by optimize_commands().
+    # arg1 is the push and arg2 the pop command.
+    MOVE = 9
 
 
 Command = namedtuple("Command", ("ctype", "arg1", "arg2"))
@@ -43,7 +55,7 @@ class Parser:
         # translate a line, erasing comments.
         # This is the core of the class.
         line = remove_entailing_commments(line)
-        blocks = line.split(" ")
+        blocks = line.split()
         instruction = blocks[0]
         if instruction in ARITHMETIC_OPERATIONS:
             command_type = CommandType.ARITHMETIC
@@ -52,7 +64,7 @@ class Parser:
         elif instruction in ("push", "pop"):
             command_type = CommandType.PUSH if instruction == "push" else CommandType.POP
             arg1, arg2 = blocks[1:3]
-            return Command(command_type, arg1, arg2)
+            return Command(command_type, sys.intern(arg1), arg2)
         elif instruction == "label":
             command_type = CommandType.LABEL
             arg1 = blocks[1]
@@ -80,27 +92,23 @@ class Parser:
             raise NotImplementedError("Commandtype {} is not implemented.".format(instruction))
 
     def __init__(self, path_vm: str):
-        with open(path_vm, "r") as fin:
-            self.num_lines = 0
-            for line in fin:
-                line = line.rstrip("\n")
-                self.num_lines += 1 if line and not line.startswith("//") else 0
-        self.fp = open(path_vm, "r")
+        # Compatibility interface over read_commands().
+        self.commands = list(read_commands(path_vm))
+        self.num_lines = len(self.commands)
         self.num_lines_read = 0
         self.command = None
 
+    def __iter__(self) -> Iterator[Command]:
+        return iter(self.commands)
+
     def has_more_commands(self) -> bool:
         return self.num_lines_read < self.num_lines
 
     def advance(self) -> None:
         if not self.has_more_commands():
             raise EOFError("File read.")
-        line = self.fp.readline().rstrip("\n")
+        self.command = self.commands[self.num_lines_read]
         self.num_lines_read += 1
-        # Move to the next instruction.
-        while (not line) or (line.startswith("//")):
-            line = self.fp.readline().rstrip("\n")
-        self.command = self._parse_command(line)
 
     @property
     def command_type(self) -> CommandType:
@@ -119,22 +127,165 @@ class Parser:
         return self.command
 
     def close(self) -> None:
-        self.fp.close()
+        pass
+
+
+def parse_commands(source: str) -> Iterator[Command]:
+    for line in source.splitlines():
+        if remove_entailing_commments(line).strip():
+            yield Parser._parse_command(line)
+
+
+def read_commands(path_vm: str) -> Iterator[Command]:
+    # Each file is read in a single call, then parsed lazily.
+    with open(path_vm, "r") as fin:
+        source = fin.read()
+    yield from parse_commands(source)
+
+
+def read_commands_from_files(paths_vm: Iterable[str]) -> Iterator[Tuple[str, Command]]:
+    # Commands of several files, chained, along with the name of their file.
+    for path_vm in paths_vm:
+        file_name = Path(path_vm).stem
+        for command in read_commands(str(path_vm)):
+            yield file_name, command
+
+
+def to_word(value: int) -> int:
+    # Wrap to a signed 16-bit value, as the Hack ALU does.
+    return (value + 0x8000) % 0x10000 - 0x8000
+
+
+FOLDABLE_OPERATIONS = {
+    "add": lambda x, y: x + y,
+    "sub": lambda x, y: x - y,
+    "and": lambda x, y: x & y,
+    "or": lambda x, y: x | y,
+    "eq": lambda x, y: -1 if x == y else 0,
+    # CodeWriter compares the sign of the wrapped x - y, which overflows for
+    # operands of opposite signs; folding must compute the same value.
+    "gt": lambda x, y: -1 if to_word(x - y) > 0 else 0,
+    "lt": lambda x, y: -1 if to_word(x - y) < 0 else 0,
+    "neg": lambda x: -x,
+    "not": lambda x: ~x,
+}
+
+
+def _is_constant(command: Command) -> bool:
+    return command.ctype == CommandType.PUSH and command.arg1 == "constant"
+
+
+def optimize_commands(commands: Iterable[Command]) -> Iterator[Command]:
+    # Rewrites windows of commands: arithmetic on pushed constants is folded
+    # into a single push, and a push immediately followed by a pop becomes a
+    # MOVE that never touches the stack. Pushes are held back until it is known
+    # whether the next command consumes them.
+    pending = []
+    for command in commands:
+        if command.ctype == CommandType.ARITHMETIC:
+            operation = FOLDABLE_OPERATIONS[command.arg1]
+            num_operands = operation.__code__.co_argcount
+            operands = pending[-num_operands:]
+            if len(operands) == num_operands and all(_is_constant(operand) for operand in operands):
+                del pending[-num_operands:]
+                value = to_word(operation(*(int(operand.arg2) for operand in operands)))
+                pending.append(Command(CommandType.PUSH, "constant", str(value)))
+                continue
+        elif command.ctype == CommandType.POP and pending:
+            yield from pending[:-1]
+            yield Command(CommandType.MOVE, pending[-1], command)
+            pending = []
+            continue
+        elif command.ctype == CommandType.PUSH:
+            if len(pending) == 2:
+                yield pending.pop(0)
+            pending.append(command)
+            continue
+        yield from pending
+        pending = []
+        yield command
+    yield from pending
+
+
+# Labels of the routines shared by all call sites in shared_runtime mode.
+RUNTIME_CALL = "RT$call"
+RUNTIME_RETURN = "RT$return"
+RUNTIME_COMPARISONS = {"eq": "RT$eq", "gt": "RT$gt", "lt": "RT$lt"}
+RUNTIME_END = "RT$end"
+# Function called by the bootstrap code, and its return address.
+INIT_FUNCTION = "Sys.init"
+INIT_RETURN = "RT$init$ret"
+
+
+# CodeWriter emits instructions, and comments as "// ..." strings.
+Translation = Union[str, Instruction]
+
+SEGMENT_BASES = {"local": "LCL", "argument": "ARG", "this": "THIS", "that": "THAT"}
+# D = x op y, with x in M and y in D.
+BINARY_OPERATIONS = {"add": CInsturction("D", "D+M", "null"),
+    "sub": CInsturction("D", "M-D", "null"), "and": CInsturction("D", "D&M", "null"),
+    "or": CInsturction("D", "D|M", "null")}
+COMPARISON_JUMPS = {"eq": CInsturction("null", "D", "JEQ"), "gt": CInsturction("null", "D", "JGT"),
+    "lt": CInsturction("null", "D", "JLT")}
+# Pushes D, in cache_tos mode.
+PUSH_D = [AInstructionSymbol("SP"), CInsturction("M", "M+1", "null"),
+    CInsturction("A", "M-1", "null"), CInsturction("M", "D", "null")]
 
 
 class CodeWriter:
-    def __init__(self, path_asm: str):
-        self.fp = open(path_asm, "w")
+    def __init__(self, path_asm: str, shared_runtime: bool = False, optimize: bool = False,
+        cache_tos: bool = False, output: Optional[ProgramBuilder] = None):
+        # With an output, the instructions are handed to the assembler in
+        # memory and path_asm only names the program.
+        self.output = output
+        self.fp = open(path_asm, "w") if output is None else None
         self.file_name = Path(path_asm).stem
         self.function_name = None
-        self.num_called = defaultdict(int)
+        # Call sites are numbered within the calling function, and comparisons
+        # within the file, so the labels of a file do not depend on the files
+        # translated before it.
+        self.num_calls = 0
         self.num_commands_written_so_far = 0
+        # In shared_runtime mode call, return, eq, gt and lt jump to a single
+        # copy of their code, emitted by close() after the program.
+        self.shared_runtime = shared_runtime
+        self.runtime_routines_used = set()
+        # Emit shorter sequences for MOVE commands and small constants.
+        self.optimize = optimize
+        # In cache_tos mode the top of the stack is kept in D between commands
+        # of a basic block instead of being stored and reloaded; tos_in_d tells
+        # whether it currently is. It is flushed to memory before labels, jumps,
+        # calls, functions and returns, so every jump target sees a plain stack.
+        self.cache_tos = cache_tos
+        self.tos_in_d = False
+
+    def write_translation(self, translations: List[Translation]) -> None:
+        # Appends code translated by another CodeWriter (see translate_unit).
+        self._writelines(translations)
 
     def _writelines(self, translations):
-        self.fp.writelines(translation + "\n" for translation in translations)
+        if self.output is not None:
+            self.output.append_translations(translations)
+        else:
+            self.fp.writelines((translation if isinstance(translation, str)
+                else format_instruction(translation)) + "\n" for translation in translations)
         self.num_commands_written_so_far += 1
 
     def write_command(self, command: Command) -> None:
+        if self.cache_tos:
+            if command.ctype == CommandType.ARITHMETIC:
+                self._write_cached_arithmetic(command)
+                return
+            elif command.ctype == CommandType.PUSH:
+                self._write_cached_push(command)
+                return
+            elif command.ctype == CommandType.POP:
+                self._write_cached_pop(command)
+                return
+            elif command.ctype == CommandType.IF_GOTO:
+                self._write_cached_if(command)
+                return
+            self.flush_tos()
         if command.ctype == CommandType.ARITHMETIC:
             self.write_arithmetic(command)
         elif command.ctype in (CommandType.PUSH, CommandType.POP):
@@ -151,58 +302,57 @@ class CodeWriter:
             self.write_function(command)
         elif command.ctype == CommandType.RETURN:
             self.write_return()
+        elif command.ctype == CommandType.MOVE:
+            self.write_move(command)
         else:
             raise ValueError()
 
     def write_init(self) -> None:
         translations = []
         translations.append("// init")
-        translations.append("@256")
-        translations.append("D=A")
-        translations.append("@SP")
-        translations.append("M=D")
+        translations.append(AInstruction(256))
+        translations.append(CInsturction("D", "A", "null"))
+        translations.append(AInstructionSymbol("SP"))
+        translations.append(CInsturction("M", "D", "null"))
         # push ret_addr
-        function_name = "Sys.init"
+        function_name = INIT_FUNCTION
         num_args = 0
-        # assuming that function_name starts with the ${filename}.
-        translations.append("@{}$ret.{}".format(function_name, self.num_called[function_name]))
-        translations.append("D=A")
-        translations.append("@SP")
-        translations.append("A=M")
-        translations.append("M=D")
-        translations.append("@SP")
-        translations.append("M=M+1")
+        translations.append(AInstructionSymbol(INIT_RETURN))
+        translations.append(CInsturction("D", "A", "null"))
+        translations.append(AInstructionSymbol("SP"))
+        translations.append(CInsturction("A", "M", "null"))
+        translations.append(CInsturction("M", "D", "null"))
+        translations.append(AInstructionSymbol("SP"))
+        translations.append(CInsturction("M", "M+1", "null"))
         # push LCL, ARG, THIS, THAT
         for mem in ("LCL", "ARG", "THIS", "THAT"):
-            translations.append("@{}".format(mem))
-            translations.append("D=M")
-            translations.append("@SP")
-            translations.append("A=M")
-            translations.append("M=D")
-            translations.append("@SP")
-            translations.append("M=M+1")
+            translations.append(AInstructionSymbol(mem))
+            translations.append(CInsturction("D", "M", "null"))
+            translations.append(AInstructionSymbol("SP"))
+            translations.append(CInsturction("A", "M", "null"))
+            translations.append(CInsturction("M", "D", "null"))
+            translations.append(AInstructionSymbol("SP"))
+            translations.append(CInsturction("M", "M+1", "null"))
         # ARG = SP - 5 - num_args
-        translations.append("@SP")
-        translations.append("D=M")
-        translations.append("@5")
-        translations.append("D=D-A")
-        translations.append("@{}".format(num_args))
-        translations.append("D=D-A")
-        translations.append("@ARG")
-        translations.append("M=D")
+        translations.append(AInstructionSymbol("SP"))
+        translations.append(CInsturction("D", "M", "null"))
+        translations.append(AInstruction(5))
+        translations.append(CInsturction("D", "D-A", "null"))
+        translations.append(AInstruction(num_args))
+        translations.append(CInsturction("D", "D-A", "null"))
+        translations.append(AInstructionSymbol("ARG"))
+        translations.append(CInsturction("M", "D", "null"))
         # LCL = SP
-        translations.append("@SP")
-        translations.append("D=M")
-        translations.append("@LCL")
-        translations.append("M=D")
+        translations.append(AInstructionSymbol("SP"))
+        translations.append(CInsturction("D", "M", "null"))
+        translations.append(AInstructionSymbol("LCL"))
+        translations.append(CInsturction("M", "D", "null"))
         # goto function_name
         # assuming that function_name starts with the ${filename}.
-        translations.append("@{}".format(function_name))
-        translations.append("0;JMP")
+        translations.append(AInstructionSymbol(function_name))
+        translations.append(CInsturction("null", "0", "JMP"))
         # label ret_addr
-        # assuming that function_name starts with the ${filename}.
-        translations.append("({}$ret.{})".format(function_name, self.num_called[function_name]))
-        self.num_called[function_name] += 1
+        translations.append(Label(INIT_RETURN))
         self._writelines(translations)
         # translations.append("@Sys.init")
         # translations.append("0;JMP")
@@ -210,53 +360,70 @@ class CodeWriter:
 
     def set_file_name(self, file_name: str) -> None:
         self.file_name = file_name
+        self.function_name = None
         self.num_commands_written_so_far = 0
+        self.num_calls = 0
+
+    def _return_label(self) -> str:
+        label = "{}$ret.{}".format(self.function_name or self.file_name, self.num_calls)
+        self.num_calls += 1
+        return label
 
     def write_arithmetic(self, command: Command) -> None:
         translations = ["// {}".format(command.arg1)]
         if command.arg1 in ("add", "sub", "and", "or"):
-            translations.append("@SP")
-            translations.append("M=M-1")
-            translations.append("A=M")
-            translations.append("D=M")
-            translations.append("@SP")
-            translations.append("A=M")
-            translations.append("A=A-1")
+            translations.append(AInstructionSymbol("SP"))
+            translations.append(CInsturction("M", "M-1", "null"))
+            translations.append(CInsturction("A", "M", "null"))
+            translations.append(CInsturction("D", "M", "null"))
+            translations.append(AInstructionSymbol("SP"))
+            translations.append(CInsturction("A", "M", "null"))
+            translations.append(CInsturction("A", "A-1", "null"))
             translations.append({
-                "add": "M=D+M", "sub": "M=M-D", "and": "M=D&M", "or": "M=D|M"
+                "add": CInsturction("M", "D+M", "null"), "sub": CInsturction("M", "M-D", "null"),
+                "and": CInsturction("M", "D&M", "null"), "or": CInsturction("M", "D|M", "null")
             }[command.arg1])
+        elif command.arg1 in ("eq", "gt", "lt") and self.shared_runtime:
+            # The routine returns to the address passed in D.
+            return_label = "{}$cmp.{}".format(self.file_name, self.num_commands_written_so_far)
+            translations.append(AInstructionSymbol(return_label))
+            translations.append(CInsturction("D", "A", "null"))
+            translations.append(AInstructionSymbol(RUNTIME_COMPARISONS[command.arg1]))
+            translations.append(CInsturction("null", "0", "JMP"))
+            translations.append(Label(return_label))
+            self.runtime_routines_used.add(command.arg1)
         elif command.arg1 in ("eq", "gt", "lt"):
-            translations.append("@SP")
-            translations.append("M=M-1")
-            translations.append("A=M")
-            translations.append("D=M")
-            translations.append("@SP")
-            translations.append("A=M")
-            translations.append("A=A-1")
-            translations.append("M=M-D")
-            translations.append("D=M")
-            translations.append("@{}.IF_TRUE_{}".format(self.file_name, self.num_commands_written_so_far))
-            translations.append({
-                "eq": "D;JEQ", "gt": "D;JGT", "lt": "D;JLT"
-            }[command.arg1])
-            translations.append("D=0")
-            translations.append("@STORE_{}".format(self.num_commands_written_so_far))
-            translations.append("0;JMP")
-            translations.append("({}.IF_TRUE_{})".format(self.file_name, self.num_commands_written_so_far))
-            translations.append("\tD=-1")
-            translations.append("@STORE_{}".format(self.num_commands_written_so_far))
-            translations.append("0;JMP")
-            translations.append("(STORE_{})".format(self.num_commands_written_so_far))
-            translations.append("\t@SP")
-            translations.append("\tA=M")
-            translations.append("\tA=A-1")
-            translations.append("\tM=D")
+            if_true = "{}.IF_TRUE_{}".format(self.file_name, self.num_commands_written_so_far)
+            store = "{}.STORE_{}".format(self.file_name, self.num_commands_written_so_far)
+            translations.append(AInstructionSymbol("SP"))
+            translations.append(CInsturction("M", "M-1", "null"))
+            translations.append(CInsturction("A", "M", "null"))
+            translations.append(CInsturction("D", "M", "null"))
+            translations.append(AInstructionSymbol("SP"))
+            translations.append(CInsturction("A", "M", "null"))
+            translations.append(CInsturction("A", "A-1", "null"))
+            translations.append(CInsturction("M", "M-D", "null"))
+            translations.append(CInsturction("D", "M", "null"))
+            translations.append(AInstructionSymbol(if_true))
+            translations.append(COMPARISON_JUMPS[command.arg1])
+            translations.append(CInsturction("D", "0", "null"))
+            translations.append(AInstructionSymbol(store))
+            translations.append(CInsturction("null", "0", "JMP"))
+            translations.append(Label(if_true))
+            translations.append(CInsturction("D", "-1", "null"))
+            translations.append(AInstructionSymbol(store))
+            translations.append(CInsturction("null", "0", "JMP"))
+            translations.append(Label(store))
+            translations.append(AInstructionSymbol("SP"))
+            translations.append(CInsturction("A", "M", "null"))
+            translations.append(CInsturction("A", "A-1", "null"))
+            translations.append(CInsturction("M", "D", "null"))
         else:  # "neg" or "not"
-            translations.append("@SP")
-            translations.append("A=M")
-            translations.append("A=A-1")
+            translations.append(AInstructionSymbol("SP"))
+            translations.append(CInsturction("A", "M", "null"))
+            translations.append(CInsturction("A", "A-1", "null"))
             translations.append({
-                "neg": "M=-M", "not": "M=!M"
+                "neg": CInsturction("M", "-M", "null"), "not": CInsturction("M", "!M", "null")
             }[command.arg1])
         self._writelines(translations)
 
@@ -264,236 +431,927 @@ class CodeWriter:
         translations = []
         if command.ctype == CommandType.PUSH:
             translations.append("// {} {} {}".format("push", command.arg1, command.arg2))
-            if command.arg1 == "constant":
-                translations.append("@{}".format(command.arg2))
-                translations.append("D=A")
+            if command.arg1 == "constant" and self.optimize and int(command.arg2) in (0, 1, -1):
+                translations.append(AInstructionSymbol("SP"))
+                translations.append(CInsturction("M", "M+1", "null"))
+                translations.append(CInsturction("A", "M-1", "null"))
+                translations.append(CInsturction("M", command.arg2, "null"))
+                self._writelines(translations)
+                return
+            elif command.arg1 == "constant":
+                translations.extend(self._load_constant(int(command.arg2)))
             elif command.arg1 in ("local", "argument", "this", "that"):
-                translations.append("@{}".format(command.arg2))
-                translations.append("D=A")
-                translations.append({
-                    "local": "@LCL", "argument": "@ARG", "this": "@THIS", "that": "@THAT"
-                }[command.arg1])
-                translations.append("A=D+M")
-                translations.append("D=M")
+                translations.append(AInstruction(int(command.arg2)))
+                translations.append(CInsturction("D", "A", "null"))
+                translations.append(AInstructionSymbol(SEGMENT_BASES[command.arg1]))
+                translations.append(CInsturction("A", "D+M", "null"))
+                translations.append(CInsturction("D", "M", "null"))
             elif command.arg1 == "temp":
                 addr = int(command.arg2) + 5
-                translations.append("@{}".format(addr))
-                translations.append("D=M")
+                translations.append(AInstruction(addr))
+                translations.append(CInsturction("D", "M", "null"))
             elif command.arg1 == "static":
-                translations.append("@{}.{}".format(self.file_name, command.arg2))
-                translations.append("D=M")
+                translations.append(AInstructionSymbol("{}.{}".format(self.file_name,
+                    command.arg2)))
+                translations.append(CInsturction("D", "M", "null"))
             else:  # pointer
-                translations.append("@3" if command.arg2 == "0" else "@4")
-                translations.append("D=M")
-            translations.append("@SP")
-            translations.append("A=M")
-            translations.append("M=D")
-            translations.append("@SP")
-            translations.append("M=M+1")
+                translations.append(AInstruction(3) if command.arg2 == "0" else AInstruction(4))
+                translations.append(CInsturction("D", "M", "null"))
+            translations.append(AInstructionSymbol("SP"))
+            translations.append(CInsturction("A", "M", "null"))
+            translations.append(CInsturction("M", "D", "null"))
+            translations.append(AInstructionSymbol("SP"))
+            translations.append(CInsturction("M", "M+1", "null"))
         else:  # pop
             translations.append("// {} {} {}".format("pop", command.arg1, command.arg2))
             if command.arg1 == "constant":
                 raise ValueError("Constant cannot be pushed.")
             elif command.arg1 in ("local", "argument", "this", "that"):
-                translations.append("@{}".format(command.arg2))
-                translations.append("D=A")
-                translations.append({
-                    "local": "@LCL", "argument": "@ARG", "this": "@THIS", "that": "@THAT"
-                }[command.arg1])
-                translations.append("A=D+M")
+                translations.append(AInstruction(int(command.arg2)))
+                translations.append(CInsturction("D", "A", "null"))
+                translations.append(AInstructionSymbol(SEGMENT_BASES[command.arg1]))
+                translations.append(CInsturction("A", "D+M", "null"))
             elif command.arg1 == "temp":
-                translations.append("@{}".format(int(command.arg2) + 5))
+                translations.append(AInstruction(int(command.arg2) + 5))
             elif command.arg1 == "static":
-                translations.append("@{}.{}".format(self.file_name, command.arg2))
+                translations.append(AInstructionSymbol("{}.{}".format(self.file_name,
+                    command.arg2)))
             else:  # pointer
-                translations.append("@3" if command.arg2 == "0" else "@4")
-            translations.append("D=A")
-            translations.append("@addr")
-            translations.append("M=D")
-            translations.append("@SP")
-            translations.append("M=M-1")
-            translations.append("A=M")
-            translations.append("D=M")
-            translations.append("@addr")
-            translations.append("A=M")
-            translations.append("M=D")
+                translations.append(AInstruction(3) if command.arg2 == "0" else AInstruction(4))
+            translations.append(CInsturction("D", "A", "null"))
+            translations.append(AInstructionSymbol("addr"))
+            translations.append(CInsturction("M", "D", "null"))
+            translations.append(AInstructionSymbol("SP"))
+            translations.append(CInsturction("M", "M-1", "null"))
+            translations.append(CInsturction("A", "M", "null"))
+            translations.append(CInsturction("D", "M", "null"))
+            translations.append(AInstructionSymbol("addr"))
+            translations.append(CInsturction("A", "M", "null"))
+            translations.append(CInsturction("M", "D", "null"))
         self._writelines(translations)
 
+    def _load_constant(self, value: int) -> List[Translation]:
+        # D = value, for any value representable in 16 bits.
+        if (self.optimize or self.cache_tos) and value in (0, 1, -1):
+            return [CInsturction("D", str(value), "null")]
+        elif 0 <= value <= 0x7FFF:
+            return [AInstruction(value), CInsturction("D", "A", "null")]
+        elif -0x7FFF <= value < 0:
+            return [AInstruction(-value), CInsturction("D", "-A", "null")]
+        elif value == -0x8000:
+            return [AInstruction(0x7FFF), CInsturction("D", "!A", "null")]
+        raise ValueError("Constant {} does not fit in 16 bits.".format(value))
+
+    def _direct_address(self, segment: str, index: int) -> Instruction:
+        if segment == "temp":
+            return AInstruction(index + 5)
+        elif segment == "static":
+            return AInstructionSymbol("{}.{}".format(self.file_name, index))
+        elif segment == "pointer":
+            return AInstruction(3) if index == 0 else AInstruction(4)
+        raise ValueError("Segment {} is not directly addressable.".format(segment))
+
+    @staticmethod
+    def _base_offset(base: str, index: int) -> List[Translation]:
+        # A = RAM[base] + index, for small indices.
+        translations = [AInstructionSymbol(base),
+            CInsturction("A", "M" if index == 0 else "M+1", "null")]
+        translations.extend(CInsturction("A", "A+1", "null") for _ in range(index - 1))
+        return translations
+
+    def _load_into_d(self, segment: str, index: int) -> List[Translation]:
+        if segment == "constant":
+            return self._load_constant(index)
+        elif segment in SEGMENT_BASES and index <= 1:
+            return self._base_offset(SEGMENT_BASES[segment], index) + [
+                CInsturction("D", "M", "null")]
+        elif segment in SEGMENT_BASES:
+            return [AInstruction(index), CInsturction("D", "A", "null"),
+                AInstructionSymbol(SEGMENT_BASES[segment]), CInsturction("A", "D+M", "null"),
+                CInsturction("D", "M", "null")]
+        return [self._direct_address(segment, index), CInsturction("D", "M", "null")]
+
+    def _store_d(self, segment: str, index: int) -> List[Translation]:
+        if segment == "constant":
+            raise ValueError("Constant cannot be popped.")
+        elif segment in SEGMENT_BASES and index <= 3:
+            return self._base_offset(SEGMENT_BASES[segment], index) + [
+                CInsturction("M", "D", "null")]
+        elif segment in SEGMENT_BASES:
+            # With R13 = value and D = value + address, A=D-M is the address
+            # and M=D-A the value again.
+            return [AInstructionSymbol("R13"), CInsturction("M", "D", "null"),
+                AInstructionSymbol(SEGMENT_BASES[segment]), CInsturction("D", "D+M", "null"),
+                AInstruction(index), CInsturction("D", "D+A", "null"), AInstructionSymbol("R13"),
+                CInsturction("A", "D-M", "null"), CInsturction("M", "D-A", "null")]
+        return [self._direct_address(segment, index), CInsturction("M", "D", "null")]
+
+    def write_move(self, command: Command) -> None:
+        push, pop = command.arg1, command.arg2
+        translations = ["// push {} {} / pop {} {}".format(push.arg1, push.arg2, pop.arg1, pop.arg2)]
+        translations.extend(self._load_into_d(push.arg1, int(push.arg2)))
+        translations.extend(self._store_d(pop.arg1, int(pop.arg2)))
+        self._writelines(translations)
+
+    def flush_tos(self) -> None:
+        if self.tos_in_d:
+            self.tos_in_d = False
+            self._writelines(["// flush"] + PUSH_D)
+
+    def _pop_into_d(self) -> List[Translation]:
+        if self.tos_in_d:
+            return []
+        return [AInstructionSymbol("SP"), CInsturction("AM", "M-1", "null"),
+            CInsturction("D", "M", "null")]
+
+    def _write_cached_arithmetic(self, command: Command) -> None:
+        operation = command.arg1
+        if operation in COMPARISON_JUMPS and self.shared_runtime:
+            self.flush_tos()
+            self.write_arithmetic(command)
+            return
+        translations = ["// {}".format(operation)]
+        translations.extend(self._pop_into_d())
+        if operation in BINARY_OPERATIONS:
+            translations.append(AInstructionSymbol("SP"))
+            translations.append(CInsturction("AM", "M-1", "null"))
+            translations.append(BINARY_OPERATIONS[operation])
+        elif operation in COMPARISON_JUMPS:
+            if_true = "{}.IF_TRUE_{}".format(self.file_name, self.num_commands_written_so_far)
+            if_end = "{}.IF_END_{}".format(self.file_name, self.num_commands_written_so_far)
+            translations.append(AInstructionSymbol("SP"))
+            translations.append(CInsturction("AM", "M-1", "null"))
+            translations.append(CInsturction("D", "M-D", "null"))
+            translations.append(AInstructionSymbol(if_true))
+            translations.append(COMPARISON_JUMPS[operation])
+            translations.append(CInsturction("D", "0", "null"))
+            translations.append(AInstructionSymbol(if_end))
+            translations.append(CInsturction("null", "0", "JMP"))
+            translations.append(Label(if_true))
+            translations.append(CInsturction("D", "-1", "null"))
+            translations.append(Label(if_end))
+        else:  # "neg" or "not"
+            translations.append(CInsturction("D", {"neg": "-D", "not": "!D"}[operation], "null"))
+        self.tos_in_d = True
+        self._writelines(translations)
+
+    def _write_cached_push(self, command: Command) -> None:
+        translations = ["// push {} {}".format(command.arg1, command.arg2)]
+        if self.tos_in_d:
+            translations.extend(PUSH_D)
+        translations.extend(self._load_into_d(command.arg1, int(command.arg2)))
+        self.tos_in_d = True
+        self._writelines(translations)
+
+    def _write_cached_pop(self, command: Command) -> None:
+        translations = ["// pop {} {}".format(command.arg1, command.arg2)]
+        translations.extend(self._pop_into_d())
+        translations.extend(self._store_d(command.arg1, int(command.arg2)))
+        self.tos_in_d = False
+        self._writelines(translations)
+
+    def _write_cached_if(self, command: Command) -> None:
+        label = self._scoped_label(command.arg1)
+        translations = ["// if-goto {}".format(label)]
+        translations.extend(self._pop_into_d())
+        translations.append(AInstructionSymbol(label))
+        translations.append(CInsturction("null", "D", "JNE"))
+        self.tos_in_d = False
+        self._writelines(translations)
+
+    def _scoped_label(self, label: str) -> str:
+        # assuming that function_name starts with the ${filename}.
+        if self.function_name:
+            return "{}${}".format(self.function_name, label)
+        return "{}${}".format(self.file_name, label)
+
     def write_label(self, command: Command) -> None:
         label = command.arg1
         translations = []
         translations.append("// label {}".format(label))
-        if self.function_name:
-            # {}.{}${}.format(file_name, function_name, label)
-            # assuming that function_name starts with the ${filename}.
-            translations.append("({}${})".format(self.function_name, label))
-        else:
-            translations.append("({}${})".format(self.file_name, label))
+        translations.append(Label(self._scoped_label(label)))
         self._writelines(translations)
 
     def write_goto(self, command: Command) -> None:
-        # assuming that function_name starts with the ${filename}.
-        label = "{}${}".format(self.function_name, command.arg1) if self.function_name \
-            else "{}${}".format(self.file_name, command.arg1)
+        label = self._scoped_label(command.arg1)
         translations = []
         translations.append("// goto {}".format(label))
-        translations.append("@{}".format(label))
-        translations.append("0;JMP")
+        translations.append(AInstructionSymbol(label))
+        translations.append(CInsturction("null", "0", "JMP"))
         self._writelines(translations)
 
     def write_if(self, command: Command) -> None:
-        # assuming that function_name starts with the ${filename}.
-        label = "{}${}".format(self.function_name, command.arg1) if self.function_name \
-            else "{}${}".format(self.file_name, command.arg1)
+        label = self._scoped_label(command.arg1)
         translations = []
         translations.append("// if-goto {}".format(label))
-        translations.append("@SP")
-        translations.append("M=M-1")
-        translations.append("A=M")
-        translations.append("D=M")
-        translations.append("@{}".format(label))
-        translations.append("D;JNE")
+        translations.append(AInstructionSymbol("SP"))
+        translations.append(CInsturction("M", "M-1", "null"))
+        translations.append(CInsturction("A", "M", "null"))
+        translations.append(CInsturction("D", "M", "null"))
+        translations.append(AInstructionSymbol(label))
+        translations.append(CInsturction("null", "D", "JNE"))
         self._writelines(translations)
 
     def write_function(self, command: Command) -> None:
         self.function_name, num_local_variables = command.arg1, int(command.arg2)
+        self.num_calls = 0
         translations = []
         translations.append("// function {} {}".format(command.arg1, command.arg2))
         # assuming that function_name starts with the ${filename}.
-        translations.append("({})".format(self.function_name))
+        translations.append(Label(self.function_name))
         # push 0 num_local_variables times
-        translations.append("@SP")
-        translations.append("A=M")
+        translations.append(AInstructionSymbol("SP"))
+        translations.append(CInsturction("A", "M", "null"))
         for _ in range(num_local_variables):
-            translations.append("M=0")
-            translations.append("A=A+1")
-        translations.append("@{}".format(num_local_variables))
-        translations.append("D=A")
-        translations.append("@SP")
-        translations.append("M=M+D")
+            translations.append(CInsturction("M", "0", "null"))
+            translations.append(CInsturction("A", "A+1", "null"))
+        translations.append(AInstruction(num_local_variables))
+        translations.append(CInsturction("D", "A", "null"))
+        translations.append(AInstructionSymbol("SP"))
+        translations.append(CInsturction("M", "D+M", "null"))
         self._writelines(translations)
 
     def write_call(self, command: Command) -> None:
         function_name, num_args = command.arg1, int(command.arg2)
+        if self.shared_runtime:
+            self._write_shared_call(function_name, num_args)
+            return
+        return_label = self._return_label()
         translations = []
         translations.append("// call {} {}".format(function_name, num_args))
         # push ret_addr
-        # assuming that function_name starts with the ${filename}.
-        translations.append("@{}$ret.{}".format(function_name, self.num_called[function_name]))
-        translations.append("D=A")
-        translations.append("@SP")
-        translations.append("A=M")
-        translations.append("M=D")
-        translations.append("@SP")
-        translations.append("M=M+1")
+        translations.append(AInstructionSymbol(return_label))
+        translations.append(CInsturction("D", "A", "null"))
+        translations.append(AInstructionSymbol("SP"))
+        translations.append(CInsturction("A", "M", "null"))
+        translations.append(CInsturction("M", "D", "null"))
+        translations.append(AInstructionSymbol("SP"))
+        translations.append(CInsturction("M", "M+1", "null"))
         # push LCL, ARG, THIS, THAT
         for mem in ("LCL", "ARG", "THIS", "THAT"):
-            translations.append("@{}".format(mem))
-            translations.append("D=M")
-            translations.append("@SP")
-            translations.append("A=M")
-            translations.append("M=D")
-            translations.append("@SP")
-            translations.append("M=M+1")
+            translations.append(AInstructionSymbol(mem))
+            translations.append(CInsturction("D", "M", "null"))
+            translations.append(AInstructionSymbol("SP"))
+            translations.append(CInsturction("A", "M", "null"))
+            translations.append(CInsturction("M", "D", "null"))
+            translations.append(AInstructionSymbol("SP"))
+            translations.append(CInsturction("M", "M+1", "null"))
         # ARG = SP - 5 - num_args
-        translations.append("@SP")
-        translations.append("D=M")
-        translations.append("@5")
-        translations.append("D=D-A")
-        translations.append("@{}".format(num_args))
-        translations.append("D=D-A")
-        translations.append("@ARG")
-        translations.append("M=D")
+        translations.append(AInstructionSymbol("SP"))
+        translations.append(CInsturction("D", "M", "null"))
+        translations.append(AInstruction(5))
+        translations.append(CInsturction("D", "D-A", "null"))
+        translations.append(AInstruction(num_args))
+        translations.append(CInsturction("D", "D-A", "null"))
+        translations.append(AInstructionSymbol("ARG"))
+        translations.append(CInsturction("M", "D", "null"))
         # LCL = SP
-        translations.append("@SP")
-        translations.append("D=M")
-        translations.append("@LCL")
-        translations.append("M=D")
+        translations.append(AInstructionSymbol("SP"))
+        translations.append(CInsturction("D", "M", "null"))
+        translations.append(AInstructionSymbol("LCL"))
+        translations.append(CInsturction("M", "D", "null"))
         # goto function_name
         # assuming that function_name starts with the ${filename}.
-        translations.append("@{}".format(function_name))
-        translations.append("0;JMP")
+        translations.append(AInstructionSymbol(function_name))
+        translations.append(CInsturction("null", "0", "JMP"))
         # label ret_addr
-        # assuming that function_name starts with the ${filename}.
-        translations.append("({}$ret.{})".format(function_name, self.num_called[function_name]))
-        self.num_called[function_name] += 1
+        translations.append(Label(return_label))
+        self._writelines(translations)
+
+    def _write_shared_call(self, function_name: str, num_args: int) -> None:
+        # The routine takes the return address in R13, the function in R14 and
+        # the number of arguments in D.
+        return_label = self._return_label()
+        translations = []
+        translations.append("// call {} {}".format(function_name, num_args))
+        translations.append(AInstructionSymbol(return_label))
+        translations.append(CInsturction("D", "A", "null"))
+        translations.append(AInstructionSymbol("R13"))
+        translations.append(CInsturction("M", "D", "null"))
+        translations.append(AInstructionSymbol(function_name))
+        translations.append(CInsturction("D", "A", "null"))
+        translations.append(AInstructionSymbol("R14"))
+        translations.append(CInsturction("M", "D", "null"))
+        translations.append(AInstruction(num_args))
+        translations.append(CInsturction("D", "A", "null"))
+        translations.append(AInstructionSymbol(RUNTIME_CALL))
+        translations.append(CInsturction("null", "0", "JMP"))
+        translations.append(Label(return_label))
+        self.runtime_routines_used.add("call")
         self._writelines(translations)
 
     def write_return(self) -> None:
+        if self.shared_runtime:
+            self.runtime_routines_used.add("return")
+            self._writelines(["// return", AInstructionSymbol(RUNTIME_RETURN),
+                CInsturction("null", "0", "JMP")])
+            return
+        self._writelines(["// return"] + self._return_translations())
+
+    def _return_translations(self) -> List[Translation]:
         translations = []
-        translations.append("// return")
         # end_frame = LCL
-        translations.append("@LCL")
-        translations.append("D=M")
-        translations.append("@end_frame")
-        translations.append("M=D")
+        translations.append(AInstructionSymbol("LCL"))
+        translations.append(CInsturction("D", "M", "null"))
+        translations.append(AInstructionSymbol("end_frame"))
+        translations.append(CInsturction("M", "D", "null"))
         # ret_addr = *(end_frame - 5)
-        translations.append("@5")
-        translations.append("A=D-A")
-        translations.append("D=M")
-        translations.append("@ret_addr")
-        translations.append("M=D")
+        translations.append(AInstruction(5))
+        translations.append(CInsturction("A", "D-A", "null"))
+        translations.append(CInsturction("D", "M", "null"))
+        translations.append(AInstructionSymbol("ret_addr"))
+        translations.append(CInsturction("M", "D", "null"))
         # *ARG = pop()
-        translations.append("@SP")
-        translations.append("A=M")
-        translations.append("A=A-1")
-        translations.append("D=M")
-        translations.append("@ARG")
-        translations.append("A=M")
-        translations.append("M=D")
+        translations.append(AInstructionSymbol("SP"))
+        translations.append(CInsturction("A", "M", "null"))
+        translations.append(CInsturction("A", "A-1", "null"))
+        translations.append(CInsturction("D", "M", "null"))
+        translations.append(AInstructionSymbol("ARG"))
+        translations.append(CInsturction("A", "M", "null"))
+        translations.append(CInsturction("M", "D", "null"))
         # SP = ARG + 1
-        translations.append("@ARG")
-        translations.append("D=M")
-        translations.append("@SP")
-        translations.append("M=D+1")
+        translations.append(AInstructionSymbol("ARG"))
+        translations.append(CInsturction("D", "M", "null"))
+        translations.append(AInstructionSymbol("SP"))
+        translations.append(CInsturction("M", "D+1", "null"))
         # restore THAT, THIS, ARG, LCL to the caller's state
         for dist, addr in enumerate(("THAT", "THIS", "ARG", "LCL"), start=1):
-            translations.append("@end_frame")
-            translations.append("D=M")
-            translations.append("@{}".format(dist))
-            translations.append("A=D-A")
-            translations.append("D=M")
-            translations.append("@{}".format(addr))
-            translations.append("M=D")
+            translations.append(AInstructionSymbol("end_frame"))
+            translations.append(CInsturction("D", "M", "null"))
+            translations.append(AInstruction(dist))
+            translations.append(CInsturction("A", "D-A", "null"))
+            translations.append(CInsturction("D", "M", "null"))
+            translations.append(AInstructionSymbol(addr))
+            translations.append(CInsturction("M", "D", "null"))
         # goto ret_addr
-        translations.append("@ret_addr")
-        translations.append("A=M")
-        translations.append("0;JMP")
+        translations.append(AInstructionSymbol("ret_addr"))
+        translations.append(CInsturction("A", "M", "null"))
+        translations.append(CInsturction("null", "0", "JMP"))
+        return translations
+
+    def _call_routine_translations(self) -> List[Translation]:
+        translations = []
+        translations.append(Label(RUNTIME_CALL))
+        translations.append(AInstructionSymbol("R15"))
+        translations.append(CInsturction("M", "D", "null"))
+        # push ret_addr, LCL, ARG, THIS, THAT
+        for mem in ("R13", "LCL", "ARG", "THIS", "THAT"):
+            translations.append(AInstructionSymbol(mem))
+            translations.append(CInsturction("D", "M", "null"))
+            translations.append(AInstructionSymbol("SP"))
+            translations.append(CInsturction("AM", "M+1", "null"))
+            translations.append(CInsturction("A", "A-1", "null"))
+            translations.append(CInsturction("M", "D", "null"))
+        # ARG = SP - 5 - num_args
+        translations.append(AInstructionSymbol("SP"))
+        translations.append(CInsturction("D", "M", "null"))
+        translations.append(AInstruction(5))
+        translations.append(CInsturction("D", "D-A", "null"))
+        translations.append(AInstructionSymbol("R15"))
+        translations.append(CInsturction("D", "D-M", "null"))
+        translations.append(AInstructionSymbol("ARG"))
+        translations.append(CInsturction("M", "D", "null"))
+        # LCL = SP
+        translations.append(AInstructionSymbol("SP"))
+        translations.append(CInsturction("D", "M", "null"))
+        translations.append(AInstructionSymbol("LCL"))
+        translations.append(CInsturction("M", "D", "null"))
+        # goto function_name
+        translations.append(AInstructionSymbol("R14"))
+        translations.append(CInsturction("A", "M", "null"))
+        translations.append(CInsturction("null", "0", "JMP"))
+        return translations
+
+    def _comparison_routine_translations(self, operation: str) -> List[Translation]:
+        routine = RUNTIME_COMPARISONS[operation]
+        translations = []
+        translations.append(Label(routine))
+        translations.append(AInstructionSymbol("R13"))
+        translations.append(CInsturction("M", "D", "null"))
+        # x - y, with the result -1 (true) unless the jump below is not taken.
+        translations.append(AInstructionSymbol("SP"))
+        translations.append(CInsturction("AM", "M-1", "null"))
+        translations.append(CInsturction("D", "M", "null"))
+        translations.append(CInsturction("A", "A-1", "null"))
+        translations.append(CInsturction("D", "M-D", "null"))
+        translations.append(CInsturction("M", "-1", "null"))
+        translations.append(AInstructionSymbol("{}.true".format(routine)))
+        translations.append(COMPARISON_JUMPS[operation])
+        translations.append(AInstructionSymbol("SP"))
+        translations.append(CInsturction("A", "M-1", "null"))
+        translations.append(CInsturction("M", "0", "null"))
+        translations.append(Label("{}.true".format(routine)))
+        translations.append(AInstructionSymbol("R13"))
+        translations.append(CInsturction("A", "M", "null"))
+        translations.append(CInsturction("null", "0", "JMP"))
+        return translations
+
+    def write_runtime(self) -> None:
+        if not self.runtime_routines_used:
+            return
+        # Programs which run off their end must not fall into the routines.
+        translations = ["// runtime"]
+        translations.append(Label(RUNTIME_END))
+        translations.append(AInstructionSymbol(RUNTIME_END))
+        translations.append(CInsturction("null", "0", "JMP"))
+        if "call" in self.runtime_routines_used:
+            translations.extend(self._call_routine_translations())
+        if "return" in self.runtime_routines_used:
+            translations.append(Label(RUNTIME_RETURN))
+            translations.extend(self._return_translations())
+        for operation in sorted(RUNTIME_COMPARISONS):
+            if operation in self.runtime_routines_used:
+                translations.extend(self._comparison_routine_translations(operation))
         self._writelines(translations)
 
     def close(self) -> None:
-        self.fp.close()
+        self.flush_tos()
+        self.write_runtime()
+        if self.fp is not None:
+            self.fp.close()
+
+
+# The --hack output also depends on the assembler, and source maps on sourcemap.
+VM_TRANSLATOR_VERSION = source_version(__file__, assemble.__file__, sourcemap.__file__)
+
+
+FunctionInfo = namedtuple("FunctionInfo", ("file_name", "num_commands", "callees"))
+DeadFunctionReport = namedtuple("DeadFunctionReport",
+    ("num_functions", "removed_functions", "num_commands_removed", "num_instructions_removed"))
+
+
+def filter_functions(commands: Iterable[Command], functions: Set[str]) -> Iterator[Command]:
+    # Keeps the bodies of the given functions, and any command before the first
+    # function of the file.
+    keep = True
+    for command in commands:
+        if command.ctype == CommandType.FUNCTION:
+            keep = command.arg1 in functions
+        if keep:
+            yield command
+
+
+def read_functions(paths_vm: Iterable[Path]) -> Dict[str, FunctionInfo]:
+    functions = {}
+    for path_vm in paths_vm:
+        function_name, num_commands, callees = None, 0, set()
+        for command in read_commands(str(path_vm)):
+            if command.ctype == CommandType.FUNCTION:
+                if function_name is not None:
+                    functions[function_name] = FunctionInfo(path_vm.stem, num_commands, callees)
+                function_name, num_commands, callees = command.arg1, 0, set()
+            elif command.ctype == CommandType.CALL:
+                callees.add(command.arg1)
+            num_commands += 1
+        if function_name is not None:
+            functions[function_name] = FunctionInfo(path_vm.stem, num_commands, callees)
+    return functions
+
+
+def reachable_functions(functions: Dict[str, FunctionInfo],
+    roots: Iterable[str] = (INIT_FUNCTION,)) -> Set[str]:
+    reachable = set()
+    stack = [root for root in roots if root in functions]
+    while stack:
+        function_name = stack.pop()
+        if function_name in reachable:
+            continue
+        reachable.add(function_name)
+        stack.extend(callee for callee in functions[function_name].callees if callee in functions)
+    return reachable
+
+
+def _count_instructions(translations: Iterable[Translation]) -> int:
+    return sum(not isinstance(translation, (str, Label)) for translation in translations)
+
+
+def eliminate_dead_functions(paths_vm: List[Path],
+    inline: Optional[Dict[str, List[Command]]] = None, **options) \
+    -> Tuple[Set[str], DeadFunctionReport]:
+    # Functions the bootstrap code can reach through call commands; every VM
+    # call names its callee, so nothing else can ever run. The instructions
+    # removed are counted by translating the dead functions on their own,
+    # less the commands before the first function, which are kept.
+    functions = read_functions(paths_vm)
+    if inline:
+        # Inlined functions are no longer called from anywhere.
+        functions = {function_name: info._replace(callees=info.callees - set(inline))
+            for function_name, info in functions.items()}
+    if INIT_FUNCTION not in functions:
+        return set(functions), DeadFunctionReport(len(functions), [], 0, 0)
+    reachable = reachable_functions(functions)
+    removed = set(functions) - reachable
+    num_instructions_removed = 0
+    for path_vm in paths_vm:
+        if any(functions[function_name].file_name == path_vm.stem for function_name in removed):
+            translations, _ = translate_unit(str(path_vm), removed, **options)
+            header, _ = translate_unit(str(path_vm), set(), **options)
+            num_instructions_removed += _count_instructions(translations) - \
+                _count_instructions(header)
+    return reachable, DeadFunctionReport(len(functions), sorted(removed),
+        sum(functions[function_name].num_commands for function_name in removed),
+        num_instructions_removed)
+
+
+def print_dead_function_report(report: DeadFunctionReport) -> None:
+    print("dead functions: {} of {} removed, {} VM commands, {} instructions".format(
+        len(report.removed_functions), report.num_functions, report.num_commands_removed,
+        report.num_instructions_removed))
+    for function_name in report.removed_functions:
+        print("  {}".format(function_name))
+
+
+InlineReport = namedtuple("InlineReport",
+    ("num_sites", "num_commands_added", "cycles_saved_per_call", "rom_before", "rom_after"))
+
+DEFAULT_INLINE_SIZE = 8
+DEFAULT_INLINE_BUDGET = 500
+
+
+def _stack_effect(command: Command) -> int:
+    if command.ctype == CommandType.PUSH:
+        return 1
+    elif command.ctype in (CommandType.POP, CommandType.IF_GOTO):
+        return -1
+    elif command.ctype == CommandType.ARITHMETIC and command.arg1 not in ("neg", "not"):
+        return -1
+    return 0
+
+
+def _has_balanced_stack(body: List[Command]) -> bool:
+    # The stack of an inlined body sits right on top of the caller's, so it may
+    # never go below its start, must have the same depth whenever a label is
+    # reached and must hold exactly the return value at every return.
+    depth, label_depths, reachable = 0, {}, True
+    for command in body[1:]:
+        if command.ctype == CommandType.LABEL:
+            label_depth = label_depths.get(command.arg1)
+            if not reachable and label_depth is None:
+                return False
+            elif not reachable:
+                depth = label_depth
+            elif label_depth is not None and label_depth != depth:
+                return False
+            label_depths[command.arg1] = depth
+            reachable = True
+            continue
+        elif not reachable:
+            continue
+        elif command.ctype == CommandType.RETURN:
+            if depth != 1:
+                return False
+            reachable = False
+            continue
+        depth += _stack_effect(command)
+        if depth < 0:
+            return False
+        if command.ctype in (CommandType.GOTO, CommandType.IF_GOTO):
+            if label_depths.setdefault(command.arg1, depth) != depth:
+                return False
+            reachable = command.ctype == CommandType.IF_GOTO
+    return not reachable
+
+
+def _segment_size(body: List[Command], segment: str) -> int:
+    return max((int(command.arg2) + 1 for command in body
+        if command.ctype in (CommandType.PUSH, CommandType.POP) and command.arg1 == segment),
+        default=0)
+
+
+def _inline_prologue(num_args: int, num_locals: int, static_base: int) -> List[Command]:
+    commands = [Command(CommandType.POP, "static", str(static_base + idx))
+        for idx in reversed(range(num_args))]
+    for idx in range(num_locals):
+        commands.append(Command(CommandType.PUSH, "constant", "0"))
+        commands.append(Command(CommandType.POP, "static", str(static_base + num_args + idx)))
+    return commands
+
+
+def inline_body(body: List[Command], num_args: int, static_base: int, prefix: str) \
+    -> List[Command]:
+    # The body of a leaf function, to be placed where it is called: arguments
+    # and locals live in scratch statics of the calling file from static_base
+    # on, labels are prefixed and returns jump to the end.
+    segments = {"argument": static_base, "local": static_base + num_args}
+    end_label = "{}.end".format(prefix)
+    commands = _inline_prologue(num_args, int(body[0].arg2), static_base)
+    jumps_to_end = False
+    for idx in range(1, len(body)):
+        command = body[idx]
+        if command.ctype in (CommandType.LABEL, CommandType.GOTO, CommandType.IF_GOTO):
+            commands.append(Command(command.ctype, "{}.{}".format(prefix, command.arg1), None))
+        elif command.ctype == CommandType.RETURN and idx < len(body) - 1:
+            commands.append(Command(CommandType.GOTO, end_label, None))
+            jumps_to_end = True
+        elif command.ctype == CommandType.RETURN:
+            pass
+        elif command.ctype in (CommandType.PUSH, CommandType.POP) and command.arg1 in segments:
+            commands.append(Command(command.ctype, "static",
+                str(segments[command.arg1] + int(command.arg2))))
+        else:
+            commands.append(command)
+    if jumps_to_end:
+        commands.append(Command(CommandType.LABEL, end_label, None))
+    return commands
+
+
+def read_function_bodies(paths_vm: Iterable[Path]) \
+    -> Tuple[Dict[str, Tuple[str, List[Command]]], Dict[str, List[Tuple[str, int]]]]:
+    # Commands of every function with the file defining it, and the calling
+    # file and number of arguments of every call site.
+    bodies, call_sites = {}, {}
+    for path_vm in paths_vm:
+        body = None
+        for command in read_commands(str(path_vm)):
+            if command.ctype == CommandType.FUNCTION:
+                body = bodies[command.arg1] = (path_vm.stem, [command])
+            elif body is not None:
+                body[1].append(command)
+            if command.ctype == CommandType.CALL:
+                call_sites.setdefault(command.arg1, []).append((path_vm.stem, int(command.arg2)))
+    return bodies, call_sites
+
+
+def _can_inline(function_name: str, file_name: str, body: List[Command],
+    call_sites: List[Tuple[str, int]], max_size: int) -> bool:
+    if function_name == INIT_FUNCTION or len(body) - 1 > max_size:
+        return False
+    for command in body[1:]:
+        if command.ctype in (CommandType.CALL, CommandType.FUNCTION):
+            return False
+        elif command.ctype not in (CommandType.PUSH, CommandType.POP):
+            continue
+        # The caller's THIS and THAT would not be restored.
+        elif command.ctype == CommandType.POP and command.arg1 == "pointer":
+            return False
+        # Statics belong to the file the code is translated in.
+        elif command.arg1 == "static" and any(caller != file_name for caller, _ in call_sites):
+            return False
+    num_args = _segment_size(body, "argument")
+    return all(site_num_args >= num_args for _, site_num_args in call_sites) \
+        and _has_balanced_stack(body)
+
+
+def _inline_growth(body: List[Command], call_sites: List[Tuple[str, int]]) -> int:
+    # Each inlined body replaces a single call command.
+    return sum(len(inline_body(body, num_args, 0, "")) - 1 for _, num_args in call_sites)
+
+
+def plan_inlining(paths_vm: List[Path], max_size: int = DEFAULT_INLINE_SIZE,
+    budget: int = DEFAULT_INLINE_BUDGET) -> Dict[str, List[Command]]:
+    # Leaf functions of at most max_size commands are inlined at all their call
+    # sites, cheapest first, as long as the program grows by at most budget
+    # VM commands in total.
+    bodies, call_sites = read_function_bodies(paths_vm)
+    candidates = []
+    for function_name, (file_name, body) in bodies.items():
+        sites = call_sites.get(function_name)
+        if sites and _can_inline(function_name, file_name, body, sites, max_size):
+            candidates.append((_inline_growth(body, sites), function_name))
+    plan, num_commands_added = {}, 0
+    for growth, function_name in sorted(candidates):
+        if num_commands_added + growth <= budget:
+            plan[function_name] = bodies[function_name][1]
+            num_commands_added += growth
+    return plan
+
+
+def inline_calls(commands: List[Command], plan: Dict[str, List[Command]]) -> Iterator[Command]:
+    # Scratch statics are allocated after the ones the file already uses.
+    static_base = max([_segment_size(commands, "static")] +
+        [_segment_size(body, "static") for body in plan.values()])
+    num_inlined = 0
+    for command in commands:
+        if command.ctype == CommandType.CALL and command.arg1 in plan:
+            yield from inline_body(plan[command.arg1], int(command.arg2), static_base,
+                "{}.{}".format(command.arg1, num_inlined))
+            num_inlined += 1
+        else:
+            yield command
+
+
+def _translate_commands(commands: Iterable[Command], **options) -> List[Translation]:
+    buffer = LineBuffer()
+    code_writer = CodeWriter("Inline", output=buffer, **options)
+    for command in commands:
+        code_writer.write_command(command)
+    code_writer.flush_tos()
+    return buffer.lines
+
+
+def inline_report(paths_vm: List[Path], plan: Dict[str, List[Command]],
+    functions: Optional[Set[str]] = None, **options) -> InlineReport:
+    # ROM size with and without inlining, and the instructions every executed
+    # call saves: the call, function entry and return sequences are straight
+    # line code, replaced by the inlined prologue. With a shared runtime the
+    # saving is larger than reported, as the routines are not counted.
+    _, call_sites = read_function_bodies(paths_vm)
+    sequence_options = dict(options, shared_runtime=False)
+    num_sites, num_commands_added, cycles_saved_per_call = {}, 0, {}
+    for function_name, body in plan.items():
+        sites = call_sites[function_name]
+        num_sites[function_name] = len(sites)
+        num_commands_added += _inline_growth(body, sites)
+        num_args = _segment_size(body, "argument")
+        call = [Command(CommandType.CALL, function_name, str(num_args)), body[0],
+            Command(CommandType.RETURN, None, None)]
+        prologue = _inline_prologue(num_args, int(body[0].arg2), 0)
+        cycles_saved_per_call[function_name] = \
+            _count_instructions(_translate_commands(call, **sequence_options)) - \
+            _count_instructions(_translate_commands(prologue, **sequence_options))
+    # Without inlining, the inlined functions would still be called.
+    functions_before = None if functions is None else functions | set(plan)
+    rom_before = rom_after = 0
+    for path_vm in paths_vm:
+        rom_before += _count_instructions(
+            translate_unit(str(path_vm), functions_before, **options)[0])
+        rom_after += _count_instructions(
+            translate_unit(str(path_vm), functions, plan, **options)[0])
+    return InlineReport(num_sites, num_commands_added, cycles_saved_per_call, rom_before,
+        rom_after)
+
+
+def print_inline_report(report: InlineReport) -> None:
+    print("inline: {} call sites of {} functions, {} VM commands added, "
+        "ROM {} -> {} instructions".format(sum(report.num_sites.values()), len(report.num_sites),
+        report.num_commands_added, report.rom_before, report.rom_after))
+    for function_name, num_sites in sorted(report.num_sites.items()):
+        print("  {}: {} sites, ~{} cycles saved per call".format(
+            function_name, num_sites, report.cycles_saved_per_call[function_name]))
+
+
+def _read_commands(path_vm: str, optimize: bool = False, functions: Optional[Set[str]] = None,
+    inline: Optional[Dict[str, List[Command]]] = None, **options) -> Iterator[Command]:
+    commands = read_commands(path_vm)
+    if functions is not None:
+        commands = filter_functions(commands, functions)
+    if inline:
+        commands = inline_calls(list(commands), inline)
+    return optimize_commands(commands) if optimize else commands
+
+
+def translate_file(path_vm: str, path_asm: str, **options) -> None:
+    code_writer = CodeWriter(path_asm, **options)
+    for command in _read_commands(path_vm, **options):
+        code_writer.write_command(command)
+    code_writer.close()
+
+
+class LineBuffer:
+    # CodeWriter output keeping the translation of a file in memory.
+    def __init__(self):
+        self.lines = []
+
+    def append_translations(self, translations: Iterable[Translation]) -> None:
+        self.lines.extend(translations)
+
+
+def translate_unit(path_vm: str, functions: Optional[Set[str]] = None,
+    inline: Optional[Dict[str, List[Command]]] = None,
+    **options) -> Tuple[List[Translation], Set[str]]:
+    # Translates one file of a directory on its own, or only the given
+    # functions of it; returns its code and the runtime routines it calls.
+    buffer = LineBuffer()
+    code_writer = CodeWriter(path_vm, output=buffer, **options)
+    for command in _read_commands(path_vm, functions=functions, inline=inline, **options):
+        code_writer.write_command(command)
+    code_writer.flush_tos()
+    return buffer.lines, code_writer.runtime_routines_used
+
+
+def translate_directory(paths_vm: List[Path], path_asm: str, jobs: Optional[int] = 1,
+    output: Optional[ProgramBuilder] = None, functions: Optional[Set[str]] = None,
+    inline: Optional[Dict[str, List[Command]]] = None, **options) -> None:
+    # Files are translated independently, in a process pool unless jobs is 1,
+    # and merged in the order of paths_vm, so the output does not depend on
+    # the number of workers.
+    code_writer = CodeWriter(path_asm, output=output, **options)
+    code_writer.write_init()
+    if jobs == 1 or len(paths_vm) <= 1:
+        units = [translate_unit(str(path_vm), functions, inline, **options)
+            for path_vm in paths_vm]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(translate_unit, str(path_vm), functions, inline, **options)
+                for path_vm in paths_vm]
+            units = [future.result() for future in futures]
+    for translations, runtime_routines_used in units:
+        code_writer.write_translation(translations)
+        code_writer.runtime_routines_used |= runtime_routines_used
+    code_writer.close()
+
+
+def build_hack(paths_vm: List[Path], path_hack: str, bootstrap: bool,
+    path_asm: Optional[str] = None, emit_source_map: bool = False, jobs: Optional[int] = 1,
+    functions: Optional[Set[str]] = None, inline: Optional[Dict[str, List[Command]]] = None,
+    **options) -> int:
+    # Translates straight to machine code: CodeWriter feeds the assembler in
+    # memory and the assembly is only written out if path_asm is given.
+    builder = ProgramBuilder()
+    if bootstrap:
+        translate_directory(paths_vm, path_hack, jobs, builder, functions, inline, **options)
+    else:
+        translate_file(str(paths_vm[0]), path_hack, output=builder, **options)
+    program = builder.program
+    if path_asm is not None:
+        write_asm(path_asm, program)
+    table = new_symbol_table()
+    add_labels(program, table)
+    source_map = SourceMap() if emit_source_map else None
+    machine_code = encode_into_machine_code(program, table, source_map)
+    write_hack(path_hack, machine_code)
+    if source_map is not None:
+        source_map.save(source_map_path(path_hack))
+    return len(machine_code)
+
+
+def print_cache_stats(cache: BuildCache) -> None:
+    print("cache: {} hits, {} misses".format(cache.hits, cache.misses))
 
 
 def main():
     arg_parser = ArgumentParser()
     arg_parser.add_argument("path", type=str, help="Path to a source vm file or directory")
+    arg_parser.add_argument("--cache", type=str, default=None,
+        help="Directory of the build cache; unchanged sources are served from it")
+    arg_parser.add_argument("--cache-size", type=int, default=64,
+        help="Maximum size of the build cache in MiB")
+    arg_parser.add_argument("-j", "--jobs", type=int, default=1,
+        help="Number of worker processes translating the files of a directory")
+    arg_parser.add_argument("--shared-runtime", action="store_true",
+        help="Call one shared copy of the call, return and comparison code")
+    arg_parser.add_argument("-O", "--optimize", action="store_true",
+        help="Fold constants and fuse push/pop pairs before translation")
+    arg_parser.add_argument("--cache-tos", action="store_true",
+        help="Keep the top of the stack in D between commands")
+    arg_parser.add_argument("--eliminate-dead-functions", action="store_true",
+        help="In directory mode, drop the functions Sys.init can never call")
+    arg_parser.add_argument("--inline", action="store_true",
+        help="In directory mode, inline small leaf functions at their call sites")
+    arg_parser.add_argument("--inline-size", type=int, default=DEFAULT_INLINE_SIZE,
+        help="Largest function inlined, in VM commands")
+    arg_parser.add_argument("--inline-budget", type=int, default=DEFAULT_INLINE_BUDGET,
+        help="Number of VM commands inlining may add to the program")
+    arg_parser.add_argument("--hack", action="store_true",
+        help="Write machine code (.hack) directly instead of assembly")
+    arg_parser.add_argument("--dump-asm", action="store_true",
+        help="With --hack, also write the generated assembly")
+    arg_parser.add_argument("-m", "--source-map", action="store_true",
+        help="With --hack, also write a .smap for the machine code")
     args = arg_parser.parse_args()
+    options = {"shared_runtime": args.shared_runtime, "optimize": args.optimize,
+        "cache_tos": args.cache_tos}
+
+    if (args.dump_asm or args.source_map) and not args.hack:
+        arg_parser.error("--dump-asm and --source-map require --hack")
 
     path = Path(args.path).resolve()
     if path.is_file():
-        parser = Parser(args.path)
+        paths_vm = [path]
         dest = args.path.replace(".vm", ".asm")
-        code_writer = CodeWriter(dest)
-        while parser.has_more_commands():
-            parser.advance()
-            code_writer.write_command(parser.current_command)
-        code_writer.close()
     else:
         assert(path.is_dir())
+        paths_vm = sorted(file_path for file_path in path.iterdir() if file_path.suffix == ".vm")
         dest = str(path / (path.stem + ".asm"))
-        code_writer = CodeWriter(dest)
-        code_writer.write_init()
-        for file_path in path.iterdir():
-            if file_path.suffix != ".vm":
-                continue
-            file_name = file_path.stem
-            code_writer.set_file_name(file_name)
-            parser = Parser(str(file_path))
-            while parser.has_more_commands():
-                parser.advance()
-                code_writer.write_command(parser.current_command)
-        code_writer.close()
+    path_asm = dest
+    if args.hack:
+        dest = str(Path(dest).with_suffix(".hack"))
+
+    # Only the main output is cached.
+    if args.cache and not (args.dump_asm or args.source_map):
+        cache = BuildCache(args.cache, args.cache_size * 1024 * 1024)
+        inputs = [(file_path.name, file_path.read_bytes()) for file_path in paths_vm]
+        key = cache.make_key("VMTranslator", VM_TRANSLATOR_VERSION,
+            (path.is_dir(), Path(dest).name, sorted(options.items()),
+            args.eliminate_dead_functions,
+            (args.inline_size, args.inline_budget) if args.inline else None), inputs)
+        translation = cache.get(key)
+        if translation is not None:
+            Path(dest).write_bytes(translation)
+            print_cache_stats(cache)
+            return
+
+    functions, inline = None, None
+    if args.inline and path.is_dir():
+        inline = plan_inlining(paths_vm, args.inline_size, args.inline_budget)
+    if args.eliminate_dead_functions and path.is_dir():
+        functions, report = eliminate_dead_functions(paths_vm, inline, **options)
+        print_dead_function_report(report)
+    if inline is not None:
+        print_inline_report(inline_report(paths_vm, inline, functions, **options))
+
+    if args.hack:
+        build_hack(paths_vm, dest, path.is_dir(), path_asm if args.dump_asm else None,
+            args.source_map, args.jobs, functions, inline, **options)
+    elif path.is_file():
+        translate_file(args.path, dest, **options)
+    else:
+        translate_directory(paths_vm, dest, args.jobs, functions=functions, inline=inline,
+            **options)
+
+    if args.cache and not (args.dump_asm or args.source_map):
+        cache.put(key, Path(dest).read_bytes())
+        print_cache_stats(cache)
 
 
 if __name__ == "__main__":
@@ -1,8 +1,17 @@
 import logging
-from collections import namedtuple
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from collections import namedtuple, defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from argparse import ArgumentParser
-from typing import List, Union, Dict
+from typing import List, Union, Dict, Optional, Iterable, Iterator, Sequence, Tuple
+from buildcache import BuildCache, source_version
+from sourcemap import SourceMap, source_map_path, vm_file_of, parse_vm_comment
 
 
 comp_table = {
@@ -73,88 +82,662 @@ for i in range(16):
 AInstruction = namedtuple("AInstruction", ("value"))
 AInstructionSymbol = namedtuple("AInstructionSymbol", ("name"))
 CInsturction = namedtuple("CInstruction", ("dest", "comp", "jump"))
+# pickle, and so the process pools, find classes by their name.
+CInstruction = CInsturction
 Label = namedtuple("Label", ("name"))
 Instruction = Union[AInstruction, AInstructionSymbol, CInsturction, Label]
 
+# Every valid C-instruction, pre-encoded.
+c_instruction_table = {
+    CInsturction(dest, comp, jump): int("111" + comp_code + dest_code + jump_code, 2)
+    for comp, comp_code in comp_table.items()
+    for dest, dest_code in dest_table.items()
+    for jump, jump_code in jump_table.items()
+}
+
+# Instruction kinds of the array-backed representation.
+A_INSTRUCTION = 0
+A_INSTRUCTION_SYMBOL = 1
+C_INSTRUCTION = 2
+LABEL = 3
+
+
+class Program:
+    # Struct-of-arrays representation of an assembly program: one kind code and
+    # one operand per instruction. The operand is the value of an A-instruction,
+    # an interned symbol id for symbolic A-instructions and labels, or an id into
+    # the distinct C-instructions of the program. The source line of every
+    # instruction and the whole-line comments are kept for source maps.
+    def __init__(self):
+        self.kinds = array("B")
+        self.operands = array("I")
+        self.lines = array("I")
+        self.comments = []
+        self.symbols = []
+        self.symbol_ids = {}
+        self.c_instructions = []
+        self.c_instruction_ids = {}
+
+    @classmethod
+    def from_instructions(cls, list_instructions: Iterable[Instruction]) -> "Program":
+        program = cls()
+        for instruction in list_instructions:
+            program.append(instruction)
+        return program
+
+    def _intern_symbol(self, name: str) -> int:
+        symbol_id = self.symbol_ids.get(name)
+        if symbol_id is None:
+            symbol_id = self.symbol_ids[name] = len(self.symbols)
+            self.symbols.append(name)
+        return symbol_id
+
+    def _intern_c_instruction(self, instruction: CInsturction) -> int:
+        c_instruction_id = self.c_instruction_ids.get(instruction)
+        if c_instruction_id is None:
+            c_instruction_id = self.c_instruction_ids[instruction] = len(self.c_instructions)
+            self.c_instructions.append(instruction)
+        return c_instruction_id
+
+    def append(self, instruction: Instruction, line: int = 0) -> None:
+        self.lines.append(line)
+        if isinstance(instruction, AInstruction):
+            self.kinds.append(A_INSTRUCTION)
+            self.operands.append(instruction.value)
+        elif isinstance(instruction, AInstructionSymbol):
+            self.kinds.append(A_INSTRUCTION_SYMBOL)
+            self.operands.append(self._intern_symbol(instruction.name))
+        elif isinstance(instruction, CInsturction):
+            self.kinds.append(C_INSTRUCTION)
+            self.operands.append(self._intern_c_instruction(instruction))
+        else:
+            self.kinds.append(LABEL)
+            self.operands.append(self._intern_symbol(instruction.name))
+
+    def add_comment(self, comment: str) -> None:
+        # The comment precedes the next instruction appended.
+        self.comments.append((len(self.kinds), comment))
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def __getitem__(self, idx: int) -> Instruction:
+        # namedtuple view of a single instruction.
+        kind, operand = self.kinds[idx], self.operands[idx]
+        if kind == A_INSTRUCTION:
+            return AInstruction(operand)
+        elif kind == A_INSTRUCTION_SYMBOL:
+            return AInstructionSymbol(self.symbols[operand])
+        elif kind == C_INSTRUCTION:
+            return self.c_instructions[operand]
+        return Label(self.symbols[operand])
+
+    def __iter__(self) -> Iterator[Instruction]:
+        return (self[idx] for idx in range(len(self)))
+
+
+# Largest constant of an A-instruction, whose first bit is 0.
+MAX_A_VALUE = 0x7FFF
+
+
+def _line_error(path_source: str, line_number: int, error: ValueError) -> ValueError:
+    return ValueError("{}:{}: {}".format(path_source, line_number, error))
+
+
+def parse_line(line: str) -> Optional[Instruction]:
+    # Clean the line, removing white spaces and comments.
+    line = "".join(line.split("//")[0].split())
+    # If line is empty or a comment, ignore it.
+    if not line:
+        return None
+    if line.startswith("@") and line[1:].isnumeric():
+        value = int(line[1:])
+        if value > MAX_A_VALUE:
+            raise ValueError("A-instruction {} does not fit in 15 bits.".format(line))
+        return AInstruction(value)
+    elif line.startswith("@"):
+        return AInstructionSymbol(line[1:])
+    elif line.startswith("("):
+        return Label(line[1:-1])
+    if "=" in line:
+        dest, line = line.split("=")
+    else:
+        dest = "null"
+    if ";" in line:
+        comp, jump = line.split(";")
+    else:
+        comp = line
+        jump = "null"
+    return CInsturction(dest, comp, jump)
+
+
+class ProgramBuilder:
+    # Collects the instructions generated in memory (by CodeWriter) into a
+    # Program; no assembly text is written or parsed. Comments are "// ..."
+    # strings. Line numbers are those of the same program written with
+    # write_asm().
+    def __init__(self):
+        self.program = Program()
+        self.num_lines = 0
+
+    def append_translations(self, translations: Iterable[Union[str, Instruction]]) -> None:
+        program = self.program
+        for translation in translations:
+            self.num_lines += 1
+            if isinstance(translation, str):
+                program.add_comment(translation)
+            else:
+                program.append(translation, self.num_lines)
+
+
+def parse_assembly_into_program(path_source: str) -> Program:
+    program = Program()
+    with open(path_source, "r") as fin:
+        for line_number, line in enumerate(fin, start=1):
+            try:
+                instruction = parse_line(line)
+            except ValueError as error:
+                raise _line_error(path_source, line_number, error) from None
+            if instruction is not None:
+                program.append(instruction, line_number)
+            elif line.lstrip().startswith("//"):
+                program.add_comment(line.strip())
+    return program
+
 
 def parse_assembly_with_emptylines_and_comments_removal(path_source: str) \
     -> List[Instruction]:
-    list_instructions = []
-    with open(path_source, "r") as fin:
-        for line in fin:
-            line = line.rstrip("\n")
-            # If line is empty or a comment, ignore it.
-            if not line or line.startswith("//"):
-                continue
-            # Clean the line, removing white spaces and comments.
-            line = "".join(c for c in line.split("//")[0] if c != " ")
-            if line.startswith("@") and line[1:].isnumeric():
-                list_instructions.append(AInstruction(int(line[1:])))
-            elif line.startswith("@"):
-                list_instructions.append(AInstructionSymbol(line[1:]))
-            elif line.startswith("("):
-                list_instructions.append(Label(line[1:-1]))
-            else:
-                if "=" in line:
-                    dest, line = line.split("=")
-                else:
-                    dest = "null"
-                if ";" in line:
-                    comp, jump = line.split(";")
-                else:
-                    comp = line
-                    jump = "null"
-                list_instructions.append(CInsturction(dest, comp, jump))
-    return list_instructions
-
-
-def add_labels(list_instructions: List[Instruction], symbol_table: Dict[str, int]) -> None:
+    return list(parse_assembly_into_program(path_source))
+
+
+def _as_program(list_instructions: Union[List[Instruction], Program]) -> Program:
+    if isinstance(list_instructions, Program):
+        return list_instructions
+    return Program.from_instructions(list_instructions)
+
+
+def add_labels(list_instructions: Union[List[Instruction], Program],
+    symbol_table: Dict[str, int]) -> None:
+    program = _as_program(list_instructions)
     cur_instruction_idx = 0
-    for instruction in list_instructions:
-        if isinstance(instruction, Label):
-            symbol_table[instruction.name] = cur_instruction_idx
+    for kind, operand in zip(program.kinds, program.operands):
+        if kind == LABEL:
+            symbol_table[program.symbols[operand]] = cur_instruction_idx
         else:
             cur_instruction_idx += 1
 
 
-def translate_into_machine_code(list_instructions: List[Instruction],
-    symbol_table: Dict[str, int]) -> List[str]:
-    binary_representation = lambda x: bin(x)[2:].zfill(16)
-    machine_code = []
+def fill_source_map(program: Program, source_map: SourceMap) -> None:
+    comments = iter(program.comments)
+    comment = next(comments, None)
+    vm_function = None
     cur_instruction_idx = 0
+    for idx, (kind, operand, line) in enumerate(zip(program.kinds, program.operands, program.lines)):
+        while comment is not None and comment[0] <= idx:
+            parsed = parse_vm_comment(comment[1])
+            comment = next(comments, None)
+            if parsed is None:
+                # Comments of hand-written assembly.
+                continue
+            vm_command, function_name = parsed
+            vm_function = function_name or vm_function
+            source_map.add_range(cur_instruction_idx, vm_command, vm_function, vm_file_of(vm_function))
+        if kind == LABEL:
+            source_map.add_label(program.symbols[operand], cur_instruction_idx)
+        else:
+            source_map.add_address(line)
+            cur_instruction_idx += 1
+
+
+def encode_into_machine_code(list_instructions: Union[List[Instruction], Program],
+    symbol_table: Dict[str, int], source_map: Optional[SourceMap] = None) -> array:
+    program = _as_program(list_instructions)
+    if source_map is not None:
+        fill_source_map(program, source_map)
+    c_codes = [c_instruction_table[instruction] for instruction in program.c_instructions]
+    # Symbols are resolved once per distinct name, not once per reference.
+    symbol_values = [None] * len(program.symbols)
+    machine_code = array("H")
     cur_variable_idx = 16
-    for instruction in list_instructions:
-        if isinstance(instruction, AInstruction):
-            translation = binary_representation(instruction.value)
-            machine_code.append(translation)
-        elif isinstance(instruction, CInsturction):
-            translation = "111" + comp_table[instruction.comp] \
-                + dest_table[instruction.dest] + jump_table[instruction.jump]
-            machine_code.append(translation)
-        elif isinstance(instruction, AInstructionSymbol) and instruction.name in symbol_table:
-            translation = binary_representation(symbol_table[instruction.name])
-            machine_code.append(translation)
-        elif isinstance(instruction, AInstructionSymbol):
-            symbol_table[instruction.name] = cur_variable_idx
-            cur_variable_idx += 1
-            translation = binary_representation(symbol_table[instruction.name])
-            machine_code.append(translation)
-        cur_instruction_idx += 1 if not isinstance(instruction, Label) else 0
+    for kind, operand in zip(program.kinds, program.operands):
+        if kind == C_INSTRUCTION:
+            machine_code.append(c_codes[operand])
+        elif kind == A_INSTRUCTION:
+            machine_code.append(operand)
+        elif kind == A_INSTRUCTION_SYMBOL:
+            value = symbol_values[operand]
+            if value is None:
+                name = program.symbols[operand]
+                if name not in symbol_table:
+                    symbol_table[name] = cur_variable_idx
+                    cur_variable_idx += 1
+                value = symbol_values[operand] = symbol_table[name]
+            machine_code.append(value)
+    return machine_code
+
+
+def translate_into_machine_code(list_instructions: Union[List[Instruction], Program],
+    symbol_table: Dict[str, int], source_map: Optional[SourceMap] = None) -> List[str]:
+    return [format(code, "016b")
+        for code in encode_into_machine_code(list_instructions, symbol_table, source_map)]
+
+
+PeepholeReport = namedtuple("PeepholeReport", ("num_before", "num_after", "num_removed"))
+
+
+def format_instruction(instruction: Instruction) -> str:
+    if isinstance(instruction, AInstruction):
+        return "@{}".format(instruction.value)
+    elif isinstance(instruction, AInstructionSymbol):
+        return "@{}".format(instruction.name)
+    elif isinstance(instruction, Label):
+        return "({})".format(instruction.name)
+    translation = instruction.comp
+    if instruction.dest != "null":
+        translation = instruction.dest + "=" + translation
+    if instruction.jump != "null":
+        translation += ";" + instruction.jump
+    return translation
+
+
+def write_asm(path_dest: str, list_instructions: Iterable[Instruction]) -> None:
+    # The comments of a Program are written before the instruction they precede.
+    comments = list_instructions.comments if isinstance(list_instructions, Program) else []
+    comment_idx = 0
+    with open(path_dest, "w") as fout:
+        for idx, instruction in enumerate(list_instructions):
+            while comment_idx < len(comments) and comments[comment_idx][0] <= idx:
+                fout.write(comments[comment_idx][1] + "\n")
+                comment_idx += 1
+            fout.write(format_instruction(instruction) + "\n")
+        for _, comment in comments[comment_idx:]:
+            fout.write(comment + "\n")
+
+
+def _count_rom_instructions(list_instructions: Iterable[Instruction]) -> int:
+    return sum(not isinstance(instruction, Label) for instruction in list_instructions)
+
+
+def _is_a_instruction(instruction: Instruction) -> bool:
+    return isinstance(instruction, (AInstruction, AInstructionSymbol))
+
+
+def _remove_increment_decrement(list_instructions: List[Instruction],
+    num_removed: Dict[str, int]) -> List[Instruction]:
+    # @X, M=M+1, @X, M=M-1 (or the other way around) leaves memory unchanged and
+    # A == X, exactly like a lone @X.
+    increment = CInsturction("M", "M+1", "null")
+    decrement = CInsturction("M", "M-1", "null")
+    optimized = []
+    idx = 0
+    while idx < len(list_instructions):
+        instruction = list_instructions[idx]
+        if idx + 3 < len(list_instructions) and list_instructions[idx + 2] == instruction \
+            and _is_a_instruction(instruction) and {list_instructions[idx + 1],
+            list_instructions[idx + 3]} == {increment, decrement}:
+            num_removed["increment-decrement"] += 3
+            idx += 3
+            list_instructions[idx] = instruction
+            continue
+        optimized.append(instruction)
+        idx += 1
+    return optimized
+
+
+def _peephole_pass(list_instructions: List[Instruction],
+    num_removed: Dict[str, int]) -> List[Instruction]:
+    referenced = {instruction.name for instruction in list_instructions
+        if isinstance(instruction, AInstructionSymbol)}
+    reload = CInsturction("A", "M", "null")
+    optimized = []
+    # What is known about the registers before the current instruction: the
+    # A-instruction whose operand is in A, the A-instruction whose operand is
+    # the address A was loaded from, and whether D equals RAM[A]. Nothing is
+    # known after a label, as it can be reached from anywhere.
+    a_operand = a_pointer = None
+    d_is_m = False
+    idx = 0
+    while idx < len(list_instructions):
+        instruction = list_instructions[idx]
+        idx += 1
+        if isinstance(instruction, Label):
+            optimized.append(instruction)
+            a_operand = a_pointer = None
+            d_is_m = False
+            continue
+        following = idx
+        while following < len(list_instructions) and isinstance(list_instructions[following], Label):
+            following += 1
+        if _is_a_instruction(instruction):
+            if instruction == a_operand:
+                num_removed["redundant-load"] += 1
+            elif instruction == a_pointer and idx < len(list_instructions) \
+                and list_instructions[idx] == reload:
+                num_removed["redundant-reload"] += 2
+                idx += 1
+            elif following < len(list_instructions) and _is_a_instruction(list_instructions[following]):
+                # A is overwritten before it is used.
+                num_removed["dead-load"] += 1
+            else:
+                optimized.append(instruction)
+                a_operand, a_pointer, d_is_m = instruction, None, False
+            continue
+
+        dest, comp, jump = instruction
+        if jump == "null" and d_is_m and (dest, comp) in (("D", "M"), ("M", "D")):
+            num_removed["redundant-move"] += 1
+            continue
+        if dest == "null" and jump != "null" and isinstance(a_operand, AInstructionSymbol) \
+            and Label(a_operand.name) in list_instructions[idx:following]:
+            num_removed["jump-to-next"] += 1
+            continue
+        optimized.append(instruction)
+        if "A" in dest:
+            a_pointer = a_operand if (dest, comp) == ("A", "M") else None
+            a_operand = None
+            d_is_m = False
+        elif "M" in dest:
+            a_pointer = None
+            d_is_m = "D" in dest or comp == "D"
+        elif "D" in dest:
+            d_is_m = comp == "M"
+        if jump == "JMP":
+            # Everything up to the next label that can be jumped to is unreachable.
+            while idx < len(list_instructions) and not (isinstance(list_instructions[idx], Label)
+                and list_instructions[idx].name in referenced):
+                if not isinstance(list_instructions[idx], Label):
+                    num_removed["unreachable"] += 1
+                idx += 1
+    return optimized
+
+
+def _label_numeric_jump_targets(list_instructions: List[Instruction]) -> List[Instruction]:
+    # Removing instructions moves code around, so jumps to literal ROM
+    # addresses (@95, 0;JMP) are rewritten to jump to labels placed at their
+    # targets. Code addresses are otherwise assumed to be referred to only
+    # through labels. Targets past the end of the program have no instruction
+    # to label and are left as they are.
+    num_instructions = _count_rom_instructions(list_instructions)
+    targets = set()
+    for instruction, following in zip(list_instructions, list_instructions[1:]):
+        if isinstance(instruction, AInstruction) and isinstance(following, CInsturction) \
+            and following.jump != "null" and instruction.value < num_instructions:
+            targets.add(instruction.value)
+    if not targets:
+        return list_instructions
+    labelled = []
+    cur_instruction_idx = 0
+    for instruction, following in zip(list_instructions, list_instructions[1:] + [None]):
+        if isinstance(instruction, Label):
+            labelled.append(instruction)
+            continue
+        if cur_instruction_idx in targets:
+            labelled.append(Label("ROM${}".format(cur_instruction_idx)))
+        if isinstance(instruction, AInstruction) and instruction.value in targets \
+            and isinstance(following, CInsturction) and following.jump != "null":
+            instruction = AInstructionSymbol("ROM${}".format(instruction.value))
+        labelled.append(instruction)
+        cur_instruction_idx += 1
+    return labelled
+
+
+def optimize_peephole(list_instructions: Iterable[Instruction]) \
+    -> Tuple[List[Instruction], PeepholeReport]:
+    list_instructions = _label_numeric_jump_targets(list(list_instructions))
+    num_before = _count_rom_instructions(list_instructions)
+    num_removed = defaultdict(int)
+    while True:
+        size = len(list_instructions)
+        list_instructions = _remove_increment_decrement(list_instructions, num_removed)
+        list_instructions = _peephole_pass(list_instructions, num_removed)
+        if len(list_instructions) == size:
+            break
+    return list_instructions, PeepholeReport(num_before,
+        _count_rom_instructions(list_instructions), dict(num_removed))
+
+
+def write_hack(path_dest: str, machine_code: Iterable[int]) -> None:
+    with open(path_dest, "w") as fout:
+        fout.writelines(format(code, "016b") + "\n" for code in machine_code)
+
+
+def read_hack(path_source: str) -> array:
+    with open(path_source, "r") as fin:
+        return array("H", (int(line, 2) for line in fin if line.strip()))
+
+
+def write_hackb(path_dest: str, machine_code: Iterable[int]) -> None:
+    # The packed format is a headerless sequence of little-endian uint16 words.
+    machine_code = array("H", machine_code)
+    if sys.byteorder == "big":
+        machine_code.byteswap()
+    with open(path_dest, "wb") as fout:
+        machine_code.tofile(fout)
+
+
+def read_hackb(path_source: str) -> array:
+    machine_code = array("H")
+    with open(path_source, "rb") as fin:
+        machine_code.frombytes(fin.read())
+    if sys.byteorder == "big":
+        machine_code.byteswap()
     return machine_code
 
 
+def map_hackb(path_source: str) -> Sequence[int]:
+    # Zero-copy, read-only view of a packed ROM image.
+    if sys.byteorder == "big" or os.path.getsize(path_source) == 0:
+        return read_hackb(path_source)
+    with open(path_source, "rb") as fin:
+        buffer = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(buffer).cast("H")
+
+
+def read_machine_code(path_source: str) -> Sequence[int]:
+    if path_source.endswith(".hackb"):
+        return map_hackb(path_source)
+    return read_hack(path_source)
+
+
+def assemble_streaming(path_source: str, path_dest: str, symbol_table: Dict[str, int],
+    packed: bool = False) -> int:
+    # Read, encode and write in a single pass. Every record in the output has the
+    # same width, so a forward reference is written as a placeholder and patched
+    # in place once the symbol is known. The placeholders of each unresolved
+    # symbol form a chain threaded through the output itself (each one holds the
+    # address of the previous reference + 1, 0 ending the chain), so only the
+    # head of every chain has to be kept in memory.
+    if packed:
+        record = struct.Struct("<H")
+        encode = record.pack
+        decode = lambda x: record.unpack(x)[0]
+        record_size = record.size
+    else:
+        encode = lambda x: (format(x, "016b") + "\n").encode()
+        decode = lambda x: int(x[:16], 2)
+        record_size = 17
+    max_value = 0xFFFF
+    unresolved = {}
+    cur_instruction_idx = 0
+    with open(path_source, "r") as fin, open(path_dest, "wb+") as fout:
+        for line_number, line in enumerate(fin, start=1):
+            try:
+                instruction = parse_line(line)
+            except ValueError as error:
+                raise _line_error(path_source, line_number, error) from None
+            if instruction is None:
+                continue
+            if isinstance(instruction, Label):
+                symbol_table[instruction.name] = cur_instruction_idx
+                continue
+            if isinstance(instruction, AInstruction):
+                value = instruction.value
+            elif isinstance(instruction, CInsturction):
+                value = c_instruction_table[instruction]
+            elif instruction.name in symbol_table:
+                value = symbol_table[instruction.name]
+            else:
+                value = unresolved.get(instruction.name, 0)
+                unresolved[instruction.name] = cur_instruction_idx + 1
+            if value > max_value or cur_instruction_idx >= max_value:
+                raise ValueError("Instruction {} does not fit in 16 bits: {}".format(
+                    cur_instruction_idx, line.strip()))
+            fout.write(encode(value))
+            cur_instruction_idx += 1
+
+        # Symbols which never turned out to be labels are variables, allocated
+        # in the order of their first reference.
+        cur_variable_idx = 16
+        for name, link in unresolved.items():
+            if name not in symbol_table:
+                symbol_table[name] = cur_variable_idx
+                cur_variable_idx += 1
+            translation = encode(symbol_table[name])
+            while link:
+                fout.seek((link - 1) * record_size)
+                next_link = decode(fout.read(record_size))
+                fout.seek((link - 1) * record_size)
+                fout.write(translation)
+                link = next_link
+    return cur_instruction_idx
+
+
+AssemblyResult = namedtuple("AssemblyResult",
+    ("source", "dest", "num_instructions", "seconds", "cached", "report"))
+
+ASSEMBLER_VERSION = source_version(__file__)
+
+
+def new_symbol_table() -> Dict[str, int]:
+    # Each assembled program gets its own copy of the predefined symbols.
+    return dict(symbol_table)
+
+
+def assemble_file(path_source: str, path_dest: Optional[str] = None, packed: bool = False,
+    stream: bool = False, cache: Optional[BuildCache] = None,
+    optimize: bool = False, emit_source_map: bool = False) -> AssemblyResult:
+    start = time.perf_counter()
+    if path_dest is None:
+        path_dest = str(Path(path_source).with_suffix(".hackb" if packed else ".hack"))
+    record_size = 2 if packed else 17
+    if emit_source_map:
+        # Only machine code is cached.
+        cache = None
+    if cache is not None:
+        with open(path_source, "rb") as fin:
+            key = cache.make_key("assemble", ASSEMBLER_VERSION, (packed, optimize),
+                [("source", fin.read())])
+        machine_code = cache.get(key)
+        if machine_code is not None:
+            with open(path_dest, "wb") as fout:
+                fout.write(machine_code)
+            return AssemblyResult(path_source, path_dest, len(machine_code) // record_size,
+                time.perf_counter() - start, True, None)
+    table = new_symbol_table()
+    report = None
+    if stream:
+        num_instructions = assemble_streaming(path_source, path_dest, table, packed)
+    else:
+        program = parse_assembly_into_program(path_source)
+        if optimize:
+            list_instructions, report = optimize_peephole(program)
+            program = Program.from_instructions(list_instructions)
+        add_labels(program, table)
+        source_map = SourceMap() if emit_source_map else None
+        machine_code = encode_into_machine_code(program, table, source_map)
+        if packed:
+            write_hackb(path_dest, machine_code)
+        else:
+            write_hack(path_dest, machine_code)
+        if source_map is not None:
+            source_map.save(source_map_path(path_dest))
+        num_instructions = len(machine_code)
+    if cache is not None:
+        with open(path_dest, "rb") as fin:
+            cache.put(key, fin.read())
+    return AssemblyResult(path_source, path_dest, num_instructions, time.perf_counter() - start,
+        False, report)
+
+
+def print_peephole_report(report: PeepholeReport) -> None:
+    print("peephole: {} -> {} instructions".format(report.num_before, report.num_after))
+    for rule, num_removed in sorted(report.num_removed.items()):
+        print("  {}: {} removed".format(rule, num_removed))
+
+
+def collect_sources(paths: Iterable[str]) -> List[str]:
+    sources = []
+    for path in paths:
+        if Path(path).is_dir():
+            sources.extend(sorted(str(p) for p in Path(path).rglob("*.asm")))
+        else:
+            sources.append(path)
+    return sources
+
+
+def assemble_batch(sources: List[str], jobs: Optional[int] = None, packed: bool = False,
+    stream: bool = False, cache: Optional[BuildCache] = None, optimize: bool = False,
+    emit_source_map: bool = False) -> List[AssemblyResult]:
+    if jobs == 1 or len(sources) <= 1:
+        return [assemble_file(source, None, packed, stream, cache, optimize, emit_source_map)
+            for source in sources]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(assemble_file, source, None, packed, stream, cache, optimize,
+            emit_source_map)
+            for source in sources]
+        return [future.result() for future in futures]
+
+
 def main():
     parser = ArgumentParser()
-    parser.add_argument("source", type=str)
+    parser.add_argument("sources", type=str, nargs="+", help="Source asm files or directories")
     parser.add_argument("-d", "--dest", type=str, default=None)
+    parser.add_argument("-s", "--stream", action="store_true",
+        help="Assemble in a single pass, without holding the program in memory")
+    parser.add_argument("-f", "--format", choices=("hack", "hackb"), default="hack",
+        help="Textual .hack or packed little-endian uint16 .hackb output")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+        help="Number of worker processes in batch mode (default: number of CPUs)")
+    parser.add_argument("--cache", type=str, default=None,
+        help="Directory of the build cache; unchanged sources are served from it")
+    parser.add_argument("--cache-size", type=int, default=64,
+        help="Maximum size of the build cache in MiB")
+    parser.add_argument("-O", "--optimize", action="store_true",
+        help="Run the peephole optimizer before encoding")
+    parser.add_argument("-m", "--source-map", action="store_true",
+        help="Also write a .smap mapping ROM addresses to asm lines and VM commands")
     args = parser.parse_args()
 
-    list_instructions = parse_assembly_with_emptylines_and_comments_removal(args.source)
-    add_labels(list_instructions, symbol_table)
-    machine_code = translate_into_machine_code(list_instructions, symbol_table)
-    path_to_save = args.dest if args.dest else args.source.replace(".asm", ".hack")
-    with open(path_to_save, "w") as fout:
-        fout.writelines([code + "\n" for code in machine_code])
+    if args.stream and (args.optimize or args.source_map):
+        parser.error("--optimize and --source-map cannot be used with --stream")
+    if args.optimize and args.source_map:
+        parser.error("--source-map cannot be used with --optimize")
+    packed = args.format == "hackb"
+    cache = BuildCache(args.cache, args.cache_size * 1024 * 1024) if args.cache else None
+    sources = collect_sources(args.sources)
+    if len(sources) == 1 and not Path(args.sources[0]).is_dir():
+        result = assemble_file(sources[0], args.dest, packed, args.stream, cache, args.optimize,
+            args.source_map)
+        if result.report is not None:
+            print_peephole_report(result.report)
+        return
+    if args.dest:
+        parser.error("--dest can only be used with a single source file")
+    start = time.perf_counter()
+    results = assemble_batch(sources, args.jobs, packed, args.stream, cache, args.optimize,
+        args.source_map)
+    for result in results:
+        print("{}: {} instructions in {:.1f} ms{}{}".format(
+            result.source, result.num_instructions, result.seconds * 1000,
+            " (cached)" if result.cached else "",
+            " ({} removed by peephole)".format(result.report.num_before - result.report.num_after)
+            if result.report is not None else ""))
+    print("{} files, {} instructions in {:.1f} ms".format(
+        len(results), sum(result.num_instructions for result in results),
+        (time.perf_counter() - start) * 1000))
+    if cache is not None:
+        num_hits = sum(result.cached for result in results)
+        print("cache: {} hits, {} misses".format(num_hits, len(results) - num_hits))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,103 @@
+import hashlib
+import os
+from collections import namedtuple
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import Iterable, Optional, Tuple
+
+
+CacheStats = namedtuple("CacheStats", ("hits", "misses", "evictions", "entries", "size"))
+# Suffix of the files being written by put, which are not entries yet.
+TEMP_SUFFIX = ".tmp"
+
+
+def source_version(*paths: str) -> str:
+    # Translators are versioned by the hash of their own source, so any change
+    # to the code invalidates the entries it produced.
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as fin:
+            digest.update(fin.read())
+    return digest.hexdigest()[:16]
+
+
+class BuildCache:
+    # On-disk cache of translator outputs, addressed by the hash of the inputs,
+    # the translator version and its options. Entries are plain files whose
+    # modification time records their last use; the least recently used ones
+    # are evicted once the cache grows past max_bytes.
+    def __init__(self, cache_dir: str, max_bytes: int = 64 * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(tool: str, version: str, options: Tuple,
+        inputs: Iterable[Tuple[str, bytes]]) -> str:
+        digest = hashlib.sha256()
+        digest.update(repr((tool, version, options)).encode())
+        for name, contents in inputs:
+            digest.update(repr((name, len(contents))).encode())
+            digest.update(contents)
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / key
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(str(path), "rb") as fin:
+                contents = fin.read()
+            os.utime(str(path))
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return contents
+
+    def put(self, key: str, contents: bytes) -> None:
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        # Write to a temporary file first so that concurrent readers never see
+        # a partially written entry.
+        with NamedTemporaryFile(dir=str(path.parent), suffix=TEMP_SUFFIX,
+                                delete=False) as fout:
+            fout.write(contents)
+        os.replace(fout.name, str(path))
+        self.evict()
+
+    def _entries(self):
+        entries = []
+        for path in self.cache_dir.glob("*/*"):
+            # Files of puts in flight, possibly in other processes, must not
+            # be evicted before they are renamed.
+            if path.suffix == TEMP_SUFFIX:
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        return entries
+
+    def evict(self) -> None:
+        entries = self._entries()
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                continue
+            size -= entry_size
+            self.evictions += 1
+
+    def stats(self) -> CacheStats:
+        entries = self._entries()
+        return CacheStats(self.hits, self.misses, self.evictions, len(entries),
+            sum(entry_size for _, entry_size, _ in entries))
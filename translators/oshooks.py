@@ -0,0 +1,91 @@
+from array import array
+from math import isqrt
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from VMTranslator import to_word
+
+
+# A native implementation of a VM function takes its arguments and the RAM
+# and returns the value of the function, or None to let the emulated
+# function run instead (for inputs where the OS would call Sys.error).
+NativeFunction = Callable[[List[int], array], Optional[int]]
+
+
+def math_multiply(args: List[int], ram: array) -> Optional[int]:
+    return to_word(args[0] * args[1])
+
+
+def math_divide(args: List[int], ram: array) -> Optional[int]:
+    x, y = args
+    if y == 0 or x == -0x8000 or y == -0x8000:
+        return None
+    quotient = abs(x) // abs(y)
+    return quotient if (x < 0) == (y < 0) else -quotient
+
+
+def math_sqrt(args: List[int], ram: array) -> Optional[int]:
+    return isqrt(args[0]) if args[0] >= 0 else None
+
+
+def math_abs(args: List[int], ram: array) -> Optional[int]:
+    return abs(args[0]) if args[0] != -0x8000 else None
+
+
+def math_min(args: List[int], ram: array) -> Optional[int]:
+    return min(args)
+
+
+def math_max(args: List[int], ram: array) -> Optional[int]:
+    return max(args)
+
+
+def memory_peek(args: List[int], ram: array) -> Optional[int]:
+    return ram[args[0]] if args[0] >= 0 else None
+
+
+def memory_poke(args: List[int], ram: array) -> Optional[int]:
+    if args[0] < 0:
+        return None
+    ram[args[0]] = args[1]
+    return 0
+
+
+# Functions of the projects/12 OS whose result only depends on their
+# arguments and the RAM they are given. Memory.alloc and the Screen
+# functions depend on the state kept by their OS implementation (free list,
+# color), which is not part of their interface, so they have no default.
+NATIVE_FUNCTIONS = {
+    "Math.multiply": math_multiply,
+    "Math.divide": math_divide,
+    "Math.sqrt": math_sqrt,
+    "Math.abs": math_abs,
+    "Math.min": math_min,
+    "Math.max": math_max,
+    "Memory.peek": memory_peek,
+    "Memory.poke": memory_poke,
+}
+
+
+def native_entries(function_entries: Iterable[Tuple[int, str]],
+                   natives: Dict[str, NativeFunction]) -> Dict[int, Tuple[str, NativeFunction]]:
+    # Entry address -> (name, native function), from the (address, name)
+    # pairs of SourceMap.function_entries() or of a symbol table.
+    return dict((address, (name, natives[name]))
+        for address, name in function_entries if name in natives)
+
+
+def call_native(name: str, native: NativeFunction, args: List[int], ram: array,
+                verify: bool) -> Optional[int]:
+    # With verify, the native function runs on a copy of the RAM, as the
+    # emulated function is going to run anyway and its result is compared
+    # with the returned value by check_native().
+    value = native(args, array("h", ram) if verify else ram)
+    if value is not None and not -0x8000 <= value <= 0x7FFF:
+        raise ValueError("Native {} returned {}, which does not fit in 16 bits.".format(
+            name, value))
+    return value
+
+
+def check_native(name: str, args: List[int], expected: int, value: int) -> None:
+    if value != expected:
+        raise ValueError("Native {}{} returned {}, the emulated function {}.".format(
+            name, tuple(args), expected, value))
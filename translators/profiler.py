@@ -0,0 +1,95 @@
+from array import array
+from collections import namedtuple
+from typing import Dict, Iterable, List, Tuple
+from sourcemap import SourceMap
+
+
+FunctionProfile = namedtuple("FunctionProfile", ("name", "calls", "inclusive", "exclusive"))
+# Cycles run outside of any known function, as the bootstrap code.
+NO_FUNCTION = "(no function)"
+
+
+def return_addresses(labels: Dict[str, int]) -> List[int]:
+    # Addresses of the "Caller$ret.N" labels written by CodeWriter.write_call.
+    return [address for name, address in labels.items() if "$ret." in name]
+
+
+class FunctionProfiler:
+    # Attributes the cycles of a translated VM program to its functions. The
+    # emulator reports the jumps landing on function entries and return
+    # addresses; the profiler keeps a shadow call stack, and the cycles run
+    # between two such jumps go to the stack of the first one. The stack
+    # entries remember the return address of their frame (at LCL - 5 when
+    # the function is entered), so a return pops all the frames above the
+    # one it returns from.
+    def __init__(self, function_entries: Iterable[Tuple[int, str]],
+                 return_addresses: Iterable[int]):
+        self.functions = dict(function_entries)
+        self.return_addresses = frozenset(return_addresses)
+        self.addresses = frozenset(self.functions) | self.return_addresses
+        self.reset()
+
+    @classmethod
+    def from_source_map(cls, source_map: SourceMap) -> "FunctionProfiler":
+        return cls(source_map.function_entries(), return_addresses(source_map.labels()))
+
+    def reset(self, cycle: int = 0) -> None:
+        # Call stacks (tuples of function names) and the cycles run in them.
+        self.stack = []
+        self.stack_cycles = {}
+        self.calls = {}
+        self.last_cycle = cycle
+
+    def _count(self, cycle: int) -> None:
+        key = self.stack[-1][0] if self.stack else (NO_FUNCTION,)
+        self.stack_cycles[key] = self.stack_cycles.get(key, 0) + cycle - self.last_cycle
+        self.last_cycle = cycle
+
+    def jump(self, pc: int, cycle: int, ram: array) -> None:
+        # cycle counts the jump itself, which belongs to the code before it.
+        if pc in self.return_addresses:
+            for depth in range(len(self.stack) - 1, -1, -1):
+                if self.stack[depth][1] == pc:
+                    self._count(cycle)
+                    del self.stack[depth:]
+                    return
+        if pc in self.functions:
+            self._count(cycle)
+            name = self.functions[pc]
+            key = (self.stack[-1][0] if self.stack else ()) + (name,)
+            self.stack.append((key, ram[ram[1] - 5] & 0x7FFF))
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def finish(self, cycle: int) -> None:
+        # Counts the cycles run since the last jump.
+        self._count(cycle)
+
+    def profiles(self) -> List[FunctionProfile]:
+        # Sorted by exclusive cycles. A function is counted once in the
+        # inclusive cycles of a stack it appears several times in.
+        inclusive, exclusive = {}, {}
+        for key, cycles in self.stack_cycles.items():
+            exclusive[key[-1]] = exclusive.get(key[-1], 0) + cycles
+            for name in set(key):
+                inclusive[name] = inclusive.get(name, 0) + cycles
+        return sorted((FunctionProfile(name, self.calls.get(name, 0), inclusive[name],
+            exclusive.get(name, 0)) for name in inclusive),
+            key=lambda profile: (-profile.exclusive, profile.name))
+
+    def collapsed_stacks(self) -> List[str]:
+        # "Sys.init;Main.main;Math.divide 1234" lines, as read by flamegraph.pl.
+        return sorted("{} {}".format(";".join(key), cycles)
+            for key, cycles in self.stack_cycles.items() if cycles)
+
+    def save_collapsed_stacks(self, path: str) -> None:
+        with open(path, "w") as fout:
+            fout.writelines(line + "\n" for line in self.collapsed_stacks())
+
+
+def print_profile(profiles: List[FunctionProfile], limit: int = 20) -> None:
+    total = sum(profile.exclusive for profile in profiles) or 1
+    print("{:<40} {:>8} {:>12} {:>12} {:>7}".format("function", "calls", "inclusive",
+        "exclusive", "excl %"))
+    for profile in profiles[:limit]:
+        print("{:<40} {:>8} {:>12} {:>12} {:>6.1f}%".format(profile.name, profile.calls,
+            profile.inclusive, profile.exclusive, 100 * profile.exclusive / total))
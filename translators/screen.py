@@ -0,0 +1,128 @@
+import os
+import struct
+import sys
+import zlib
+from array import array
+from pathlib import Path
+from typing import List, Optional
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+SCREEN = 0x4000
+SCREEN_WIDTH = 512
+SCREEN_HEIGHT = 256
+ROW_WORDS = SCREEN_WIDTH // 16
+ROW_BYTES = 2 * ROW_WORDS
+
+# Pixel c of a row is bit c % 16 of word c // 16, the least significant bit
+# first. In little-endian memory the bytes of a row are therefore in pixel
+# order with the bits of each byte reversed, which translating them through
+# REVERSED_BITS does: that gives PBM rows (black = 1), and inverting those
+# 1-bit grayscale PNG rows (black = 0).
+REVERSED_BITS = bytes(int("{:08b}".format(byte)[::-1], 2) for byte in range(256))
+INVERTED_BITS = bytes(0xFF ^ byte for byte in range(256))
+
+
+class Screen:
+    # The screen memory map as a view over the RAM of an emulator, without
+    # copying it. update() finds the rows changed since the last update and
+    # converts only those, so frames can be taken while a program runs.
+    def __init__(self, ram: array):
+        self.words = memoryview(ram)[SCREEN:SCREEN + SCREEN_HEIGHT * ROW_WORDS]
+        self.snapshot = bytes(SCREEN_HEIGHT * ROW_BYTES)
+        self.pbm_rows = [bytes(ROW_BYTES)] * SCREEN_HEIGHT
+        self.num_updates = 0
+
+    def _row_bytes(self) -> bytes:
+        # Bytes of the screen words, little-endian.
+        if sys.byteorder == "little":
+            return self.words.tobytes()
+        words = array("h", self.words)
+        words.byteswap()
+        return words.tobytes()
+
+    def _dirty_rows(self, current: bytes) -> List[int]:
+        if current == self.snapshot:
+            return []
+        return [row for row in range(SCREEN_HEIGHT)
+            if current[row * ROW_BYTES:(row + 1) * ROW_BYTES] !=
+            self.snapshot[row * ROW_BYTES:(row + 1) * ROW_BYTES]]
+
+    def dirty_rows(self) -> List[int]:
+        # Rows changed since the last update().
+        return self._dirty_rows(self._row_bytes())
+
+    def update(self) -> List[int]:
+        # Converts the changed rows and returns them.
+        current = self._row_bytes()
+        rows = self._dirty_rows(current)
+        if not rows:
+            return rows
+        for row in rows:
+            self.pbm_rows[row] = current[row * ROW_BYTES:(row + 1) * ROW_BYTES].translate(
+                REVERSED_BITS)
+        self.snapshot = current
+        self.num_updates += 1
+        return rows
+
+    def pixel(self, row: int, column: int) -> bool:
+        return bool(self.words[row * ROW_WORDS + column // 16] >> (column % 16) & 1)
+
+    def bitmap(self):
+        # The screen as SCREEN_HEIGHT rows of SCREEN_WIDTH pixels (1 = black):
+        # a uint8 NumPy array unpacked in one step if NumPy is installed,
+        # else a list of bytes objects.
+        if numpy is not None:
+            words = numpy.frombuffer(self._row_bytes(), dtype=numpy.uint8)
+            return numpy.unpackbits(words, bitorder="little").reshape(
+                SCREEN_HEIGHT, SCREEN_WIDTH)
+        self.update()
+        return [bytes((byte >> (7 - bit)) & 1 for byte in row for bit in range(8))
+            for row in self.pbm_rows]
+
+    def to_pbm(self) -> bytes:
+        self.update()
+        header = "P4\n{} {}\n".format(SCREEN_WIDTH, SCREEN_HEIGHT).encode()
+        return header + b"".join(self.pbm_rows)
+
+    def to_png(self) -> bytes:
+        self.update()
+        scanlines = b"".join(b"\0" + row.translate(INVERTED_BITS) for row in self.pbm_rows)
+        return b"".join((b"\x89PNG\r\n\x1a\n",
+            png_chunk(b"IHDR", struct.pack(">IIBBBBB", SCREEN_WIDTH, SCREEN_HEIGHT, 1, 0, 0, 0, 0)),
+            png_chunk(b"IDAT", zlib.compress(scanlines)),
+            png_chunk(b"IEND", b"")))
+
+    def save(self, path: str) -> None:
+        # PNG or PBM, by the extension of path.
+        data = self.to_png() if Path(path).suffix == ".png" else self.to_pbm()
+        with open(path, "wb") as fout:
+            fout.write(data)
+
+
+def png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + chunk_type + data + \
+        struct.pack(">I", zlib.crc32(chunk_type + data))
+
+
+def record_frames(emulator, max_cycles: int, interval: int, directory: str,
+                  image_format: str = "png", screen: Optional[Screen] = None) -> List[str]:
+    # Runs the emulator for up to max_cycles and saves the screen every
+    # interval cycles if it has changed, as a .png or .pbm file. The CPU loop
+    # runs undisturbed between frames. Returns the paths of the frames.
+    screen = screen or Screen(emulator.ram)
+    os.makedirs(directory, exist_ok=True)
+    paths, cycle = [], 0
+    while cycle < max_cycles:
+        cycle += emulator.run(min(interval, max_cycles - cycle))
+        if screen.update():
+            path = str(Path(directory) / "frame{:06d}.{}".format(len(paths), image_format))
+            screen.save(path)
+            paths.append(path)
+        if emulator.halted:
+            break
+    return paths
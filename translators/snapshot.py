@@ -0,0 +1,95 @@
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from collections import namedtuple
+from pathlib import Path
+from typing import Callable, Sequence, Union
+
+
+# Binary layout, all little-endian:
+#   header: magic, version, A, D, PC, cycles, CRC-32 of the ROM, padding
+#   RAM:    RAM_SIZE int16 words, at HEADER_SIZE so they are aligned
+MAGIC = b"HSNP"
+VERSION = 1
+HEADER = struct.Struct("<4sHhhHQI")
+HEADER_SIZE = 64
+SNAPSHOT_SUFFIX = ".hsnap"
+
+Snapshot = namedtuple("Snapshot", ("a", "d", "pc", "cycles", "rom_crc", "ram"))
+Ram = Union[array, memoryview]
+
+
+def rom_crc(rom: Sequence[int]) -> int:
+    # Identifies the program a snapshot was taken from.
+    return zlib.crc32(array("H", rom).tobytes())
+
+
+def write_snapshot(path: str, a: int, d: int, pc: int, cycles: int, rom: Sequence[int],
+                   ram: Ram) -> None:
+    words = array("h", ram)
+    if sys.byteorder == "big":
+        words.byteswap()
+    with open(path, "wb") as fout:
+        fout.write(HEADER.pack(MAGIC, VERSION, a, d, pc, cycles, rom_crc(rom)).ljust(
+            HEADER_SIZE, b"\0"))
+        fout.write(words.tobytes())
+
+
+def map_snapshot(path: str, ram_size: int) -> Snapshot:
+    # The RAM of the snapshot is a private copy-on-write mapping of the file:
+    # nothing is read or copied up front, only the pages the program writes
+    # are copied, by the OS, and the file itself never changes.
+    with open(path, "rb") as fin:
+        # An empty file cannot be mapped, and a short one has no header.
+        if os.fstat(fin.fileno()).st_size < HEADER_SIZE:
+            raise ValueError("{} is too short to be a snapshot.".format(path))
+        data = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_COPY)
+    magic, version, a, d, pc, cycles, crc = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("{} is not a snapshot of version {}.".format(path, VERSION))
+    if len(data) != HEADER_SIZE + 2 * ram_size:
+        raise ValueError("{} does not hold {} words of RAM.".format(path, ram_size))
+    if sys.byteorder == "big":
+        ram = array("h", data[HEADER_SIZE:])
+        ram.byteswap()
+    else:
+        ram = memoryview(data)[HEADER_SIZE:].cast("h")
+    return Snapshot(a, d, pc, cycles, crc, ram)
+
+
+class SnapshotStore:
+    # Named snapshots in a directory, so the tests of a program can all start
+    # after its warm-up (Sys.init, the init functions of the OS...) instead of
+    # each running it again. A snapshot of another program is taken again.
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def path(self, name: str) -> Path:
+        return self.directory / (name + SNAPSHOT_SUFFIX)
+
+    def save(self, name: str, emulator) -> None:
+        emulator.save_snapshot(str(self.path(name)))
+
+    def restore(self, name: str, emulator) -> bool:
+        # False if there is no snapshot of this name for the emulator's program.
+        path = self.path(name)
+        if not path.exists():
+            return False
+        try:
+            emulator.restore_snapshot(str(path))
+        except ValueError:
+            return False
+        return True
+
+    def start(self, name: str, emulator, warm_up: Callable[[object], None]) -> bool:
+        # Restores the named snapshot, or runs warm_up(emulator) and saves it.
+        # Returns whether the snapshot was restored.
+        if self.restore(name, emulator):
+            return True
+        warm_up(emulator)
+        self.save(name, emulator)
+        return False
@@ -0,0 +1,188 @@
+import mmap
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+from typing import Dict, List, Optional, Tuple
+
+
+SourceLocation = namedtuple("SourceLocation",
+    ("address", "asm_line", "vm_file", "vm_command", "vm_function"))
+
+# Binary layout, all little-endian:
+#   header:  magic, version, number of ROM addresses, ranges, labels and strings
+#   columns: asm line per ROM address,
+#            start address, command, function and file of every VM command range,
+#            address and name of every label (sorted by address),
+#            offsets of the strings (one more than their number)
+#   strings: utf-8 data
+# Every column is an array of uint32, names are ids into the string table and
+# NO_STRING marks a missing function or file.
+MAGIC = b"HSMP"
+VERSION = 1
+HEADER = struct.Struct("<4sHHIIII")
+NO_STRING = 0xFFFFFFFF
+COLUMNS = ("asm_lines", "range_starts", "range_commands", "range_functions", "range_files",
+    "label_addresses", "label_names", "string_offsets")
+
+
+class SourceMap:
+    # Maps ROM addresses back to the assembly line and the VM command (using the
+    # "// push constant 7" style comments written by CodeWriter) they came from.
+    # A saved map is loaded lazily: the columns are views over a memory mapping
+    # of the file and strings are only decoded when a query needs them.
+    def __init__(self):
+        self.asm_lines = array("I")
+        self.range_starts = array("I")
+        self.range_commands = array("I")
+        self.range_functions = array("I")
+        self.range_files = array("I")
+        self.label_addresses = array("I")
+        self.label_names = array("I")
+        self.string_offsets = array("I", [0])
+        self._string_data = bytearray()
+        self._string_ids = {}
+        self._strings = {}
+        self._labels = None
+
+    def _intern(self, string: Optional[str]) -> int:
+        if string is None:
+            return NO_STRING
+        string_id = self._string_ids.get(string)
+        if string_id is None:
+            string_id = self._string_ids[string] = len(self.string_offsets) - 1
+            self._string_data += string.encode()
+            self.string_offsets.append(len(self._string_data))
+        return string_id
+
+    def _string(self, string_id: int) -> Optional[str]:
+        if string_id == NO_STRING:
+            return None
+        string = self._strings.get(string_id)
+        if string is None:
+            start, end = self.string_offsets[string_id], self.string_offsets[string_id + 1]
+            string = self._strings[string_id] = bytes(self._string_data[start:end]).decode()
+        return string
+
+    def add_address(self, asm_line: int) -> None:
+        self.asm_lines.append(asm_line)
+
+    def add_range(self, address: int, vm_command: str, vm_function: Optional[str],
+        vm_file: Optional[str]) -> None:
+        # Commands that produced no instructions are superseded by the next one.
+        if self.range_starts and self.range_starts[-1] == address:
+            for column in (self.range_starts, self.range_commands, self.range_functions,
+                self.range_files):
+                column.pop()
+        self.range_starts.append(address)
+        self.range_commands.append(self._intern(vm_command))
+        self.range_functions.append(self._intern(vm_function))
+        self.range_files.append(self._intern(vm_file))
+
+    def add_label(self, name: str, address: int) -> None:
+        self.label_addresses.append(address)
+        self.label_names.append(self._intern(name))
+
+    def __len__(self) -> int:
+        return len(self.asm_lines)
+
+    def asm_line(self, address: int) -> int:
+        return self.asm_lines[address]
+
+    def lookup(self, address: int) -> SourceLocation:
+        asm_line = self.asm_lines[address]
+        idx = bisect_right(self.range_starts, address) - 1
+        if idx < 0:
+            return SourceLocation(address, asm_line, None, None, None)
+        return SourceLocation(address, asm_line, self._string(self.range_files[idx]),
+            self._string(self.range_commands[idx]), self._string(self.range_functions[idx]))
+
+    def labels(self) -> Dict[str, int]:
+        if self._labels is None:
+            self._labels = {self._string(name): address
+                for name, address in zip(self.label_names, self.label_addresses)}
+        return self._labels
+
+    def labels_at(self, address: int) -> List[str]:
+        start = bisect_right(self.label_addresses, address - 1)
+        end = bisect_right(self.label_addresses, address)
+        return [self._string(self.label_names[idx]) for idx in range(start, end)]
+
+    def function_entries(self) -> List[Tuple[int, str]]:
+        # ROM address of the first instruction of every VM function.
+        entries = []
+        for start, command in zip(self.range_starts, self.range_commands):
+            command = self._string(command)
+            if command.startswith("function "):
+                entries.append((start, command.split()[1]))
+        return entries
+
+    def save(self, path: str) -> None:
+        columns = [getattr(self, name) for name in COLUMNS]
+        with open(path, "wb") as fout:
+            fout.write(HEADER.pack(MAGIC, VERSION, 0, len(self.asm_lines), len(self.range_starts),
+                len(self.label_addresses), len(self.string_offsets) - 1))
+            for column in columns:
+                if sys.byteorder == "big":
+                    column = array("I", column)
+                    column.byteswap()
+                fout.write(column.tobytes())
+            fout.write(self._string_data)
+
+    @classmethod
+    def load(cls, path: str) -> "SourceMap":
+        with open(path, "rb") as fin:
+            buffer = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, num_addresses, num_ranges, num_labels, num_strings = \
+            HEADER.unpack_from(buffer)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{} is not a version {} source map.".format(path, VERSION))
+        sizes = (num_addresses, num_ranges, num_ranges, num_ranges, num_ranges, num_labels,
+            num_labels, num_strings + 1)
+        source_map = cls()
+        view = memoryview(buffer)
+        offset = HEADER.size
+        for name, size in zip(COLUMNS, sizes):
+            column = view[offset:offset + 4 * size]
+            if sys.byteorder == "big":
+                column = array("I", column.tobytes())
+                column.byteswap()
+            else:
+                column = column.cast("I")
+            setattr(source_map, name, column)
+            offset += 4 * size
+        source_map._string_data = view[offset:]
+        return source_map
+
+
+def source_map_path(path_dest: str) -> str:
+    return path_dest.rsplit(".", 1)[0] + ".smap"
+
+
+def vm_file_of(vm_function: Optional[str]) -> Optional[str]:
+    # Function names start with the name of the file they are defined in.
+    if vm_function is None or "." not in vm_function:
+        return None
+    return vm_function.split(".")[0] + ".vm"
+
+
+# Number of words of the comments CodeWriter writes before each translation,
+# by their first word. A fused "push a b / pop c d" has seven.
+VM_COMMENT_WORDS = dict([(command, (3, 7)) for command in ("push", "pop")]
+    + [(command, (1,)) for command in ("add", "sub", "neg", "eq", "gt", "lt", "and", "or",
+    "not", "return", "init", "flush", "runtime")]
+    + [(command, (2,)) for command in ("label", "goto", "if-goto")]
+    + [(command, (3,)) for command in ("function", "call")])
+
+
+def parse_vm_comment(comment: str) -> Optional[Tuple[str, Optional[str]]]:
+    # Returns the VM command of a CodeWriter comment and, for function
+    # commands, the name of the function it starts; None for other comments.
+    vm_command = " ".join(comment.lstrip("/").split())
+    blocks = vm_command.split(" ")
+    if len(blocks) not in VM_COMMENT_WORDS.get(blocks[0], ()):
+        return None
+    if blocks[0] == "function":
+        return vm_command, blocks[1]
+    return vm_command, None
@@ -0,0 +1,136 @@
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from CPUEmulator import CPUEmulator, JITEmulator, COMP_FUNCTIONS, SCREEN, alu_function, \
+    compile_block, predecode, to_word
+from assemble import assemble_file
+from profiler import FunctionProfiler
+from VMTranslator import translate_directory
+
+
+class TestALU(unittest.TestCase):
+    def test_comp_functions(self):
+        values = (0, 1, -1, 2, 17, -32768, 32767, 12345, -4321)
+        for control, comp in COMP_FUNCTIONS.items():
+            alu = alu_function(control)
+            for x in values:
+                for y in values:
+                    self.assertEqual(comp(x, y), alu(x, y), (bin(control), x, y))
+
+    def test_to_word(self):
+        self.assertEqual(to_word(32768), -32768)
+        self.assertEqual(to_word(-32769), 32767)
+        self.assertEqual(to_word(65535), -1)
+
+
+class TestComputer(unittest.TestCase):
+    def test_add(self):
+        emulator = CPUEmulator.from_file("../projects/05/Add.hack")
+        emulator.run(6, stop_at_halt=False)
+        self.assertEqual(emulator.ram[0], 5)
+        self.assertEqual(emulator.pc, 6)
+
+    def test_max(self):
+        emulator = CPUEmulator.from_file("../projects/05/Max.hack")
+        emulator.ram[0], emulator.ram[1] = 3, 5
+        self.assertEqual(emulator.run(14, stop_at_halt=False), 14)
+        self.assertEqual((emulator.a, emulator.d, emulator.pc, emulator.ram[2]), (14, 5, 14, 5))
+        emulator.reset()
+        emulator.ram[0], emulator.ram[1] = 23456, 12345
+        emulator.run(10, stop_at_halt=False)
+        self.assertEqual((emulator.a, emulator.d, emulator.pc, emulator.ram[2]),
+            (2, 23456, 14, 23456))
+
+    def test_rect(self):
+        emulator = CPUEmulator.from_file("../projects/05/Rect.hack")
+        emulator.ram[0] = 4
+        emulator.run(63, stop_at_halt=False)
+        self.assertEqual((emulator.a, emulator.d, emulator.pc), (23, 0, 24))
+        self.assertEqual([emulator.ram[SCREEN + 32 * row] for row in range(5)], [-1, -1, -1, -1, 0])
+
+    def test_halt(self):
+        emulator = CPUEmulator.from_file("../projects/05/Max.hack")
+        emulator.ram[0], emulator.ram[1] = 3, 5
+        self.assertEqual(emulator.run(1000), 14)
+        self.assertTrue(emulator.halted)
+        self.assertEqual(emulator.pc, 14)
+
+
+class TestPrograms(unittest.TestCase):
+    def test_packed_machine_code(self):
+        with TemporaryDirectory() as temp_dir:
+            dest = str(Path(temp_dir) / "Max.hackb")
+            assemble_file("../projects/06/max/Max.asm", dest, packed=True)
+            emulator = CPUEmulator.from_file(dest)
+        emulator.ram[0], emulator.ram[1] = -7, -3
+        emulator.run(1000)
+        self.assertTrue(emulator.halted)
+        self.assertEqual(emulator.ram[2], -3)
+
+    def test_vm_program(self):
+        with TemporaryDirectory() as temp_dir:
+            paths_vm = sorted(Path("../projects/08/FunctionCalls/FibonacciElement").glob("*.vm"))
+            path_asm = str(Path(temp_dir) / "FibonacciElement.asm")
+            translate_directory(paths_vm, path_asm)
+            assemble_file(path_asm)
+            emulator = CPUEmulator.from_file(str(Path(temp_dir) / "FibonacciElement.hack"))
+        # FibonacciElement.tst runs 6000 cycles; the program halts before that.
+        emulator.run(6000)
+        self.assertTrue(emulator.halted)
+        self.assertEqual((emulator.ram[0], emulator.ram[261]), (262, 3))
+
+
+class TestJIT(unittest.TestCase):
+    def assert_same_state(self, interpreter, jit):
+        self.assertEqual((interpreter.a, interpreter.d, interpreter.pc, interpreter.cycles,
+            interpreter.halted), (jit.a, jit.d, jit.pc, jit.cycles, jit.halted))
+        self.assertEqual(interpreter.ram, jit.ram)
+
+    def test_compile_block(self):
+        # @5 D=A @3 D=D+A @0 M=D: the whole computation is known at compile time.
+        code = predecode([5, 0xEC10, 3, 0xE090, 0, 0xE308])
+        block = compile_block(code, 0)
+        self.assertEqual(block.num_instructions, 6)
+        self.assertIn("ram[0] = 8", block.source)
+        self.assertNotIn("+", block.source)
+
+    def test_rect(self):
+        for threshold in (1, 2):
+            interpreter = CPUEmulator.from_file("../projects/05/Rect.hack")
+            jit = JITEmulator.from_file("../projects/05/Rect.hack")
+            jit.compile_threshold = threshold
+            interpreter.ram[0] = jit.ram[0] = 50
+            # Uneven budgets end in the middle of blocks.
+            for max_cycles in (1, 5, 63, 100, 1000):
+                self.assertEqual(interpreter.run(max_cycles), jit.run(max_cycles))
+                self.assert_same_state(interpreter, jit)
+
+    def test_jump_to_next_instruction(self):
+        # @2 0;JMP @0 0;JMP: the jump to 2 is taken, so each one stops there.
+        rom = [2, 0xEA87, 0, 0xEA87]
+        emulators = (CPUEmulator(rom), JITEmulator(rom))
+        emulators[1].compile_threshold = 1
+        for emulator in emulators:
+            emulator.register_profiler(FunctionProfiler([(2, "Main.loop")], []))
+            emulator.run(100)
+        self.assertEqual(emulators[0].profiler.calls, {"Main.loop": 25})
+        self.assertEqual(emulators[0].profiler.calls, emulators[1].profiler.calls)
+        self.assert_same_state(*emulators)
+
+    def test_vm_program(self):
+        with TemporaryDirectory() as temp_dir:
+            paths_vm = sorted(Path("../projects/08/FunctionCalls/FibonacciElement").glob("*.vm"))
+            path_asm = str(Path(temp_dir) / "FibonacciElement.asm")
+            translate_directory(paths_vm, path_asm)
+            assemble_file(path_asm)
+            path_hack = str(Path(temp_dir) / "FibonacciElement.hack")
+            interpreter = CPUEmulator.from_file(path_hack)
+            jit = JITEmulator.from_file(path_hack)
+        # Returns jump to computed addresses.
+        self.assertEqual(interpreter.run(6000), jit.run(6000))
+        self.assertTrue(jit.halted)
+        self.assert_same_state(interpreter, jit)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from HardwareSimulator import Chip, HardwareSimulator, parse_hdl, run_hdl_script
+from testscript import run_script
+
+
+CHIP_SCRIPTS = sorted(str(path) for directory in ("01", "02", "03/a", "03/b")
+    for path in Path("../projects", directory).glob("*.tst")) + [
+    "../projects/05/CPU.tst",
+    "../projects/05/ComputerAdd.tst",
+    "../projects/05/ComputerMax.tst",
+    "../projects/05/ComputerRect.tst",
+]
+
+
+class TestParser(unittest.TestCase):
+    def test_parse_hdl(self):
+        definition = parse_hdl("""
+// comment
+CHIP Or8Way {
+    IN in[8];
+    OUT out;
+    PARTS:
+    /* two parts */
+    Or(a=in[0], b=in[1], out=or01);
+    Or4(a=or01, b[0..2]=in[2..4], b[3]=true, out=out);
+}""")
+        self.assertEqual(definition.name, "Or8Way")
+        self.assertEqual(definition.inputs, [("in", 8)])
+        self.assertEqual(definition.outputs, [("out", 1)])
+        self.assertEqual(definition.parts[1].chip, "Or4")
+        self.assertEqual(definition.parts[1].connections[1], ("b", (0, 2), "in", (2, 4)))
+        self.assertEqual(definition.parts[1].connections[2], ("b", (3, 3), "true", None))
+        self.assertFalse(definition.builtin)
+        self.assertTrue(parse_hdl("CHIP DFF { IN in; OUT out; BUILTIN DFF; CLOCKED in; }").builtin)
+
+
+class TestHardwareSimulator(unittest.TestCase):
+    def test_scripts(self):
+        for path_tst in CHIP_SCRIPTS:
+            with self.subTest(path_tst):
+                result = run_hdl_script(path_tst)
+                self.assertTrue(result.passed, result.message)
+
+    def test_interactive_script(self):
+        # Memory.tst waits for keys to be pressed on the keyboard.
+        result = run_hdl_script("../projects/05/Memory.tst")
+        self.assertFalse(result.passed)
+        self.assertIn("waits for input", result.message)
+
+    def test_flattening(self):
+        # Project 02 chips are made of the project 01 chips in their directory,
+        # themselves made of Nand.
+        chip = Chip("../projects/02/Add16.hdl")
+        self.assertEqual(set(node.chip.name for node in chip.nodes), {"Nand"})
+        self.assertFalse(chip.sequential)
+        # CPU uses the builtin registers and ALU.
+        chip = Chip("../projects/05/CPU.hdl")
+        names = set(node.chip.name for node in chip.nodes)
+        self.assertTrue({"ALU", "ARegister", "DRegister", "PC"} <= names)
+        self.assertTrue(chip.sequential)
+
+    def test_vectors(self):
+        # Each bit of a wire is a separate test vector.
+        chip = Chip("../projects/02/Add16.hdl")
+        vectors = [(1, 2), (-1, 1), (12345, -20000), (0x7FFF, 1)]
+        chip.set_lanes(len(vectors))
+        chip.set_pin("a", [a & 0xFFFF for a, _ in vectors])
+        chip.set_pin("b", [b & 0xFFFF for _, b in vectors])
+        chip.evaluate()
+        self.assertEqual([chip.pin("out", lane) for lane in range(len(vectors))],
+            [3, 0, -7655, -0x8000])
+
+    def test_batch(self):
+        # Outputs of a chip without clock are computed after the script, for
+        # all its eval commands at once.
+        simulator = HardwareSimulator()
+        result = run_script(simulator, "../projects/01/Mux8Way16.tst")
+        self.assertTrue(result.passed, result.message)
+        self.assertTrue(simulator.batch)
+        self.assertEqual(len(simulator.results), len(simulator.snapshots))
+
+    def test_errors(self):
+        with TemporaryDirectory() as directory:
+            path_hdl = Path(directory) / "Loop.hdl"
+            path_hdl.write_text("CHIP Loop { IN a; OUT out; PARTS: "
+                "And(a=a, b=x, out=y); Not(in=y, out=x, out=out); }")
+            with self.assertRaisesRegex(ValueError, "Combinational loop"):
+                Chip(str(path_hdl))
+            path_hdl.write_text("CHIP Loop { IN a; OUT out; PARTS: Foo(a=a, out=out); }")
+            with self.assertRaisesRegex(ValueError, "Foo not found"):
+                Chip(str(path_hdl))
+            path_hdl.write_text("CHIP Loop { IN a; OUT out; PARTS: Not(in=b, out=out); }")
+            with self.assertRaisesRegex(ValueError, "b is not defined"):
+                Chip(str(path_hdl))
+
+
+if __name__ == "__main__":
+    unittest.main()
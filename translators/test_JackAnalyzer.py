@@ -0,0 +1,68 @@
+import unittest
+from pathlib import Path
+from JackAnalyzer import (IDENTIFIER, INTEGER_CONSTANT, KEYWORD, STRING_CONSTANT, SYMBOL,
+    TOKEN_IDS, Expression, IntegerConstant, SubroutineCall, TokenStream, UnaryTerm, VarTerm,
+    class_xml, collect_jack_files, parse_class, tokenize_file, tokens_xml)
+
+
+class TestTokenStream(unittest.TestCase):
+    def test_tokens(self):
+        tokens = TokenStream('/** doc */ let x = "a b"; // c\n do Foo.bar(32767, x);')
+        self.assertEqual(list(tokens.kinds), [KEYWORD, IDENTIFIER, SYMBOL, STRING_CONSTANT,
+            SYMBOL, KEYWORD, IDENTIFIER, SYMBOL, IDENTIFIER, SYMBOL, INTEGER_CONSTANT, SYMBOL,
+            IDENTIFIER, SYMBOL, SYMBOL])
+        self.assertEqual([tokens.text(index) for index in range(len(tokens))],
+            ["let", "x", "=", "a b", ";", "do", "Foo", ".", "bar", "(", "32767", ",", "x",
+            ")", ";"])
+        self.assertEqual(tokens.values[0], TOKEN_IDS["let"])
+        self.assertEqual(tokens.values[1], tokens.values[12])
+        self.assertEqual(tokens.offsets[1], 15)
+
+    def test_errors(self):
+        for source, message in (("let x = 32768;", "too large"), ('let s = "abc\n";', "'\"'"),
+                                ("let x = 1; /* never closed", ":1: Unterminated comment"),
+                                ("let x = #;", "'#'")):
+            with self.assertRaises(ValueError) as context:
+                TokenStream(source)
+            self.assertIn(message, str(context.exception))
+        for source, message in (("class A {\n  field int;\n}", ":2: Expected an identifier"),
+                                ("class A {", "end of the file")):
+            tokens = TokenStream(source)
+            with self.assertRaises(ValueError) as context:
+                parse_class(tokens)
+            self.assertIn(message, str(context.exception))
+
+    def test_expression(self):
+        jack_class = parse_class(TokenStream(
+            "class A { function int f() { return -a[i] + g(1, 2); } }"))
+        value = jack_class.subroutines[0].statements[0].value
+        index = Expression(VarTerm("i", None), [])
+        self.assertEqual(value, Expression(UnaryTerm("-", VarTerm("a", index)), [("+",
+            SubroutineCall(None, "g", [Expression(IntegerConstant(1), []),
+            Expression(IntegerConstant(2), [])]))]))
+
+
+class TestJackAnalyzer(unittest.TestCase):
+    def test_project_10(self):
+        # Same lines as the compare files, which have CRLF line endings.
+        for path_jack in collect_jack_files(["../projects/10"]):
+            tokens = tokenize_file(path_jack)
+            path = Path(path_jack)
+            expected_tokens = path.with_name(path.stem + "T.xml").read_text().splitlines()
+            self.assertEqual(tokens_xml(tokens), expected_tokens, path_jack)
+            expected = path.with_suffix(".xml").read_text().splitlines()
+            self.assertEqual(class_xml(parse_class(tokens)), expected, path_jack)
+
+    def test_all_classes(self):
+        for path_jack in collect_jack_files(["../projects"]):
+            tokens = tokenize_file(path_jack)
+            jack_class = parse_class(tokens)
+            self.assertEqual(jack_class.name, Path(path_jack).stem)
+            # The XML tree holds every token, in order.
+            tree_tokens = [line.strip() for line in class_xml(jack_class)
+                           if line.strip().count("<") == 2]
+            self.assertEqual(tree_tokens, tokens_xml(tokens)[1:-1], path_jack)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+from pathlib import Path
+from CPUEmulator import build_program
+from TestRunner import FAIL, PASS, SKIP, discover_scripts, run_test, run_tests, script_engine
+
+
+class TestTestRunner(unittest.TestCase):
+    def test_script_engine(self):
+        self.assertEqual(script_engine("../projects/01/And.tst"), "hdl")
+        self.assertEqual(script_engine("../projects/04/mult/Mult.tst"), "cpu")
+        self.assertEqual(script_engine("../projects/07/StackArithmetic/SimpleAdd/SimpleAdd.tst"),
+            "cpu")
+        self.assertEqual(script_engine(
+            "../projects/07/StackArithmetic/SimpleAdd/SimpleAddVME.tst"), "vm")
+        self.assertEqual(script_engine(
+            "../projects/08/FunctionCalls/FibonacciElement/FibonacciElementVME.tst"), "vm")
+
+    def test_discover_scripts(self):
+        scripts = discover_scripts(["../projects/07", "../projects/01/And.tst"])
+        self.assertEqual(len(scripts), 11)
+        self.assertEqual(scripts[-1], "../projects/01/And.tst")
+
+    def test_build_program(self):
+        # Mult.hack is assembled from mult.asm, FibonacciElement.asm translated
+        # from the directory with bootstrap code.
+        self.assertTrue(len(build_program(Path("../projects/04/mult/Mult.hack"))) > 0)
+        code = build_program(Path(
+            "../projects/08/FunctionCalls/FibonacciElement/FibonacciElement.asm"))
+        self.assertEqual(list(code[:4]), [256, 0b1110110000010000, 0, 0b1110001100001000])
+
+    def test_run_test(self):
+        for path_tst in ["../projects/02/ALU.tst", "../projects/03/a/PC.tst",
+                "../projects/04/mult/Mult.tst",
+                "../projects/05/ComputerMax.tst",
+                "../projects/07/MemoryAccess/BasicTest/BasicTest.tst",
+                "../projects/08/FunctionCalls/StaticsTest/StaticsTest.tst",
+                "../projects/08/FunctionCalls/StaticsTest/StaticsTestVME.tst"]:
+            with self.subTest(path_tst):
+                result = run_test(path_tst)
+                self.assertEqual(result.status, PASS, result.message)
+                self.assertTrue(result.num_lines > 1)
+        self.assertEqual(run_test("../projects/04/fill/Fill.tst").status, SKIP)
+        self.assertEqual(run_test("../projects/05/Memory.tst").status, SKIP)
+        result = run_test("../projects/12/MathTest/MathTest.tst")
+        self.assertEqual(result.status, FAIL)
+        self.assertIn("No .vm file", result.message)
+
+    def test_run_tests(self):
+        scripts = discover_scripts(["../projects/07"])
+        results = run_tests(scripts, jobs=2)
+        self.assertEqual([result.path for result in results], scripts)
+        self.assertTrue(all(result.status == PASS for result in results))
+        self.assertEqual(set(result.engine for result in results), {"cpu", "vm"})
+
+
+if __name__ == "__main__":
+    unittest.main()
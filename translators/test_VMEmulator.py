@@ -0,0 +1,91 @@
+import re
+import unittest
+from pathlib import Path
+from typing import List, Tuple
+from VMEmulator import VMEmulator, POINTER_ADDRESSES
+from VMTranslator import parse_commands
+
+
+VME_SCRIPTS = sorted(Path("..").glob("projects/0[78]/*/*/*VME.tst"))
+
+
+def run_vme_script(path_tst: Path) -> Tuple[List[int], List[int]]:
+    # Replays the set/repeat vmstep commands of a VM emulator test script and
+    # returns the RAM values of its output-list along with the expected ones.
+    script = re.sub(r"//.*", "", path_tst.read_text())
+    emulator = VMEmulator.from_paths(sorted(path_tst.parent.glob("*.vm")))
+    for name, index, value in re.findall(r"set (\w+)(?:\[(\d+)\])? (-?\d+)", script):
+        if name == "RAM":
+            address = int(index)
+        elif index:
+            address = emulator.segment_address(name, int(index))
+        else:
+            address = POINTER_ADDRESSES[name]
+        emulator.ram[address] = int(value)
+    emulator.run(int(re.search(r"repeat (\d+)", script).group(1)))
+    addresses = [int(address) for address in re.findall(r"RAM\[(\d+)\]%", script)]
+    path_cmp = path_tst.parent / re.search(r"compare-to (\S+),", script).group(1)
+    # Header and value lines alternate when the script has several outputs.
+    expected = [int(value) for line in path_cmp.read_text().splitlines()[1::2]
+        for value in line.split("|")[1:-1]]
+    return [emulator.ram[address] for address in addresses], expected
+
+
+class TestVMEmulator(unittest.TestCase):
+    def test_scripts(self):
+        self.assertEqual(len(VME_SCRIPTS), 11)
+        for path_tst in VME_SCRIPTS:
+            actual, expected = run_vme_script(path_tst)
+            self.assertEqual(actual, expected, path_tst.name)
+
+    def test_arithmetic(self):
+        source = "push constant 32767\npush constant 1\nadd\npush constant 0\nsub\nneg\n" \
+            "push constant 7\npush constant 7\neq\nnot\n"
+        emulator = VMEmulator([("Main", parse_commands(source))])
+        emulator.ram[0] = 256
+        self.assertEqual(emulator.run(100), 10)
+        self.assertTrue(emulator.halted)
+        self.assertEqual(list(emulator.ram[256:258]), [-32768, 0])
+        self.assertEqual(emulator.ram[0], 258)
+
+    def test_comparison_overflow(self):
+        # x - y overflows, as in the translated program.
+        source = "push constant 32767\npush constant 1\nneg\ngt\n" \
+            "push constant 2\nneg\npush constant 32767\nlt\npush constant 1\npush constant 0\ngt\n"
+        emulator = VMEmulator([("Main", parse_commands(source))])
+        emulator.ram[0] = 256
+        emulator.run(100)
+        self.assertEqual(list(emulator.ram[256:259]), [0, 0, -1])
+
+    def test_bootstrap(self):
+        emulator = VMEmulator.from_paths(
+            sorted(Path("../projects/08/FunctionCalls/FibonacciElement").glob("*.vm")),
+            bootstrap=True)
+        emulator.run(10000)
+        self.assertTrue(emulator.halted)
+        # As the translated program in test_CPUEmulator.
+        self.assertEqual((emulator.ram[0], emulator.ram[261]), (262, 3))
+        self.assertEqual(emulator.current_command().arg1, "WHILE")
+
+    def test_statics(self):
+        emulator = VMEmulator.from_paths(
+            sorted(Path("../projects/08/FunctionCalls/StaticsTest").glob("*.vm")), bootstrap=True)
+        emulator.run(10000)
+        self.assertEqual(emulator.static_addresses,
+            {("Class1", 0): 16, ("Class1", 1): 17, ("Class2", 0): 18, ("Class2", 1): 19})
+        self.assertEqual(list(emulator.ram[16:20]), [6, 8, 23, 15])
+        self.assertEqual(emulator.segment_address("static", 1, "Class2"), 19)
+        with self.assertRaisesRegex(ValueError, "No static 2 in Class1"):
+            emulator.segment_address("static", 2, "Class1")
+
+    def test_unknown_function(self):
+        with self.assertRaises(ValueError):
+            VMEmulator([("Main", parse_commands("function Main.main 0\ncall Math.multiply 2\n"))])
+
+    def test_pop_constant(self):
+        with self.assertRaisesRegex(ValueError, "popped"):
+            VMEmulator([("Main", parse_commands("function Main.main 0\npop constant 1\n"))])
+
+
+if __name__ == "__main__":
+    unittest.main()
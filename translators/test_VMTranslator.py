@@ -1,6 +1,14 @@
+import shutil
 import unittest
 from pathlib import Path
-from VMTranslator import Parser, CodeWriter, Command, CommandType
+from tempfile import TemporaryDirectory
+from VMTranslator import Parser, CodeWriter, Command, CommandType, parse_commands, \
+    read_commands, read_commands_from_files, translate_file, translate_directory, optimize_commands, \
+    build_hack, translate_unit, eliminate_dead_functions, plan_inlining, inline_body
+from assemble import assemble_file, AInstruction, AInstructionSymbol, CInsturction, Label
+from CPUEmulator import CPUEmulator, CPUScriptEngine
+from sourcemap import SourceMap
+from testscript import run_script
 
 
 class TestParser(unittest.TestCase):
@@ -50,6 +58,32 @@ class TestParser(unittest.TestCase):
         parser.close()
 
 
+class TestReadCommands(unittest.TestCase):
+    def test_whitespace(self):
+        source = "// comment\n\n\tpush  constant 7 // seven\r\n   \n  // indented comment\npush\tlocal\t0\nadd"
+        self.assertEqual(list(parse_commands(source)), [
+            Command(CommandType.PUSH, "constant", "7"),
+            Command(CommandType.PUSH, "local", "0"),
+            Command(CommandType.ARITHMETIC, "add", None)
+        ])
+
+    def test_iterator(self):
+        path_vm = "../projects/07/StackArithmetic/StackTest/StackTest.vm"
+        commands = list(read_commands(path_vm))
+        self.assertEqual(len(commands), 38)
+        self.assertEqual(commands[-1], Command(CommandType.ARITHMETIC, "not", None))
+        self.assertEqual(list(Parser(path_vm)), commands)
+
+    def test_multiple_files(self):
+        directory = Path("../projects/08/FunctionCalls/StaticsTest")
+        paths_vm = [directory / "Class1.vm", directory / "Class2.vm"]
+        commands = list(read_commands_from_files(paths_vm))
+        self.assertEqual(commands[0], ("Class1", Command(CommandType.FUNCTION, "Class1.set", "0")))
+        self.assertEqual(commands[-1], ("Class2", Command(CommandType.RETURN, None, None)))
+        self.assertEqual(len(commands), len(list(read_commands(str(paths_vm[0]))))
+            + len(list(read_commands(str(paths_vm[1])))))
+
+
 class TestCodeGenerator(unittest.TestCase):
     def test1(self):
         temp_path = "./temp.asm"
@@ -100,5 +134,301 @@ class TestCodeGenerator(unittest.TestCase):
         Path(temp_path).unlink()
 
 
+def read_asm(path_asm):
+    with open(path_asm, "r") as fin:
+        return [line.strip() for line in fin if line.strip() and not line.startswith("//")]
+
+
+class TestSharedRuntime(unittest.TestCase):
+    def test_comparisons(self):
+        with TemporaryDirectory() as temp_dir:
+            inline_asm = str(Path(temp_dir) / "Inline.asm")
+            shared_asm = str(Path(temp_dir) / "Shared.asm")
+            path_vm = "../projects/07/StackArithmetic/StackTest/StackTest.vm"
+            translate_file(path_vm, inline_asm)
+            translate_file(path_vm, shared_asm, shared_runtime=True)
+            inline, shared = read_asm(inline_asm), read_asm(shared_asm)
+        self.assertLess(len(shared), len(inline))
+        for routine in ("(RT$eq)", "(RT$gt)", "(RT$lt)", "(RT$end)"):
+            self.assertEqual(shared.count(routine), 1)
+        self.assertNotIn("(RT$call)", shared)
+        self.assertEqual(shared[:7], ["@17", "D=A", "@SP", "A=M", "M=D", "@SP", "M=M+1"])
+
+    def test_call_return(self):
+        with TemporaryDirectory() as temp_dir:
+            path_asm = str(Path(temp_dir) / "FibonacciElement.asm")
+            paths_vm = sorted(Path("../projects/08/FunctionCalls/FibonacciElement").glob("*.vm"))
+            translate_directory(paths_vm, path_asm, shared_runtime=True)
+            shared = read_asm(path_asm)
+        self.assertEqual(shared.count("(RT$call)"), 1)
+        self.assertEqual(shared.count("(RT$return)"), 1)
+        self.assertEqual(shared.count("@RT$return"), 2)
+        call_site = shared.index("@Main.fibonacci$ret.0")
+        self.assertEqual(shared[call_site:call_site + 12], [
+            "@Main.fibonacci$ret.0", "D=A", "@R13", "M=D", "@Main.fibonacci", "D=A", "@R14", "M=D",
+            "@1", "D=A", "@RT$call", "0;JMP"
+        ])
+
+
+class TestOptimizeCommands(unittest.TestCase):
+    def test_constant_folding(self):
+        commands = list(optimize_commands(parse_commands(
+            "push constant 7\npush constant 8\nadd\nneg\npush constant 32767\nadd\n"
+            "push constant 1\npush constant 2\ngt\nnot\n")))
+        self.assertEqual(commands, [
+            Command(CommandType.PUSH, "constant", "32752"),
+            Command(CommandType.PUSH, "constant", "-1"),
+        ])
+
+    def test_folding_wraps(self):
+        commands = list(optimize_commands(parse_commands(
+            "push constant 32767\npush constant 1\nadd\n")))
+        self.assertEqual(commands, [Command(CommandType.PUSH, "constant", "-32768")])
+
+    def test_push_pop_fusion(self):
+        commands = list(optimize_commands(parse_commands(
+            "push local 0\npush argument 1\npop that 2\nlabel LOOP\npush constant 3\n"
+            "push static 1\nadd\npop temp 0\n")))
+        self.assertEqual(commands, [
+            Command(CommandType.PUSH, "local", "0"),
+            Command(CommandType.MOVE, Command(CommandType.PUSH, "argument", "1"),
+                Command(CommandType.POP, "that", "2")),
+            Command(CommandType.LABEL, "LOOP", None),
+            Command(CommandType.PUSH, "constant", "3"),
+            Command(CommandType.PUSH, "static", "1"),
+            Command(CommandType.ARITHMETIC, "add", None),
+            Command(CommandType.POP, "temp", "0"),
+        ])
+
+    def test_translate(self):
+        with TemporaryDirectory() as temp_dir:
+            plain_asm = str(Path(temp_dir) / "Plain.asm")
+            optimized_asm = str(Path(temp_dir) / "Optimized.asm")
+            path_vm = "../projects/07/MemoryAccess/BasicTest/BasicTest.vm"
+            translate_file(path_vm, plain_asm)
+            translate_file(path_vm, optimized_asm, optimize=True)
+            plain, optimized = read_asm(plain_asm), read_asm(optimized_asm)
+        self.assertLess(len(optimized), len(plain))
+        # push constant 10 / pop local 0
+        self.assertEqual(optimized[:5], ["@10", "D=A", "@LCL", "A=M", "M=D"])
+
+    def test_folded_comparisons_match_translation(self):
+        # gt and lt compare the sign of the wrapped x - y, like the generated code.
+        source = "".join("push constant {}\npush constant {}\n{}{}\npop temp {}\n".format(
+            x, y, "neg\n" if negate else "", operation, index) for index, (x, y, negate, operation)
+            in enumerate(((30000, 30000, True, "gt"), (30000, 30000, True, "lt"),
+            (5, 3, False, "gt"), (3, 5, False, "lt"), (7, 7, False, "eq"))))
+        with TemporaryDirectory() as temp_dir:
+            path_vm = Path(temp_dir) / "Compare.vm"
+            path_vm.write_text(source)
+            temps = []
+            for optimize in (False, True):
+                path_hack = str(Path(temp_dir) / "Compare{}.hack".format(int(optimize)))
+                build_hack([path_vm], path_hack, False, optimize=optimize)
+                emulator = CPUEmulator.from_file(path_hack)
+                emulator.ram[0] = 256
+                emulator.run(1000)
+                temps.append(list(emulator.ram[5:10]))
+        self.assertEqual(temps[0], [0, -1, -1, -1, -1])
+        self.assertEqual(temps[1], temps[0])
+
+    def test_cmp_files(self):
+        # The test scripts of projects 7 and 8 pass on the optimized translations.
+        paths_tst = [path_tst for project in ("07", "08")
+            for path_tst in sorted(Path("../projects", project).rglob("*.tst"))
+            if not path_tst.stem.endswith("VME")]
+        self.assertTrue(paths_tst)
+        for path_tst in paths_tst:
+            with TemporaryDirectory() as temp_dir:
+                directory = Path(temp_dir)
+                for path in path_tst.parent.iterdir():
+                    if path.suffix in (".vm", ".tst", ".cmp"):
+                        shutil.copy(str(path), temp_dir)
+                paths_vm = sorted(directory.glob("*.vm"))
+                path_asm = str(directory / (path_tst.stem + ".asm"))
+                if any(path_vm.stem == "Sys" for path_vm in paths_vm):
+                    translate_directory(paths_vm, path_asm, optimize=True)
+                else:
+                    translate_file(str(directory / (path_tst.stem + ".vm")), path_asm,
+                        optimize=True)
+                result = run_script(CPUScriptEngine(), str(directory / path_tst.name))
+                self.assertTrue(result.passed, "{}: {}".format(path_tst, result.message))
+
+
+class TestCacheTos(unittest.TestCase):
+    def test_simpleadd(self):
+        with TemporaryDirectory() as temp_dir:
+            path_asm = str(Path(temp_dir) / "SimpleAdd.asm")
+            translate_file("../projects/07/StackArithmetic/SimpleAdd/SimpleAdd.vm", path_asm,
+                cache_tos=True)
+            translations = read_asm(path_asm)
+        self.assertEqual(translations, [
+            "@7", "D=A",
+            "@SP", "M=M+1", "A=M-1", "M=D", "@8", "D=A",
+            "@SP", "AM=M-1", "D=D+M",
+            "@SP", "M=M+1", "A=M-1", "M=D",
+        ])
+
+    def test_flush_before_label(self):
+        with TemporaryDirectory() as temp_dir:
+            path_asm = str(Path(temp_dir) / "Loop.asm")
+            with open(str(Path(temp_dir) / "Loop.vm"), "w") as fout:
+                fout.write("push constant 1\nlabel LOOP\npush constant 2\nif-goto LOOP\n")
+            translate_file(str(Path(temp_dir) / "Loop.vm"), path_asm, cache_tos=True)
+            translations = read_asm(path_asm)
+        self.assertEqual(translations, [
+            "D=1", "@SP", "M=M+1", "A=M-1", "M=D",
+            "(Loop$LOOP)",
+            "@2", "D=A", "@Loop$LOOP", "D;JNE",
+        ])
+
+
+class TestBuildHack(unittest.TestCase):
+    def test_emits_instructions(self):
+        # The assembler gets instructions, never assembly text to parse.
+        translations, _ = translate_unit(
+            "../projects/08/FunctionCalls/SimpleFunction/SimpleFunction.vm", cache_tos=True)
+        for translation in translations:
+            if isinstance(translation, str):
+                self.assertTrue(translation.startswith("// "), translation)
+            else:
+                self.assertIsInstance(translation,
+                    (AInstruction, AInstructionSymbol, CInsturction, Label))
+
+    def test_same_as_assembled(self):
+        paths_vm = sorted(Path("../projects/08/FunctionCalls/StaticsTest").glob("*.vm"))
+        with TemporaryDirectory() as temp_dir:
+            path_asm = str(Path(temp_dir) / "StaticsTest.asm")
+            translate_directory(paths_vm, path_asm, cache_tos=True)
+            assemble_file(path_asm)
+            expected = Path(temp_dir, "StaticsTest.hack").read_text()
+            path_hack = str(Path(temp_dir) / "Built.hack")
+            path_dump = str(Path(temp_dir) / "Dump.asm")
+            num_instructions = build_hack(paths_vm, path_hack, True, path_dump, True, cache_tos=True)
+            self.assertEqual(Path(path_hack).read_text(), expected)
+            self.assertEqual(num_instructions, len(expected.split()))
+            # The dumped assembly is the translation, and the source map points into it.
+            with open(path_dump) as fin:
+                dump = [line.rstrip("\n") for line in fin]
+            self.assertEqual([line.strip() for line in dump],
+                [line.strip() for line in Path(path_asm).read_text().splitlines()])
+            source_map = SourceMap.load(str(Path(temp_dir) / "Built.smap"))
+            location = source_map.lookup(num_instructions - 1)
+            self.assertEqual((location.vm_file, location.vm_function), ("Sys.vm", "Sys.init"))
+            self.assertEqual(dump[location.asm_line - 1], "0;JMP")
+
+
+class TestParallelTranslation(unittest.TestCase):
+    def test_same_output_for_any_number_of_jobs(self):
+        paths_vm = sorted(Path("../projects/08/FunctionCalls/StaticsTest").glob("*.vm"))
+        with TemporaryDirectory() as temp_dir:
+            outputs = []
+            for jobs in (1, 2, 3):
+                path_asm = str(Path(temp_dir) / "StaticsTest{}.asm".format(jobs))
+                translate_directory(paths_vm, path_asm, jobs, shared_runtime=True)
+                outputs.append(Path(path_asm).read_bytes())
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual(outputs[0], outputs[2])
+
+    def test_file_scoped_labels(self):
+        with TemporaryDirectory() as temp_dir:
+            for name in ("A", "B"):
+                with open(str(Path(temp_dir) / "{}.vm".format(name)), "w") as fout:
+                    fout.write("function {0}.f 0\npush constant 1\npush constant 2\neq\n"
+                        "call Sys.halt 0\nreturn\n".format(name))
+            labels = []
+            for name in ("A", "B"):
+                translations, runtime_routines_used = translate_unit(
+                    str(Path(temp_dir) / "{}.vm".format(name)))
+                labels.append({translation.name for translation in translations
+                    if isinstance(translation, Label)})
+                self.assertEqual(runtime_routines_used, set())
+        self.assertIn("A.f$ret.0", labels[0])
+        self.assertIn("A.STORE_3", labels[0])
+        self.assertFalse(labels[0] & labels[1])
+
+
+class TestEliminateDeadFunctions(unittest.TestCase):
+    def test_unreachable_functions_removed(self):
+        sources = {
+            "Sys": "function Sys.init 0\ncall Main.main 0\nlabel LOOP\ngoto LOOP\n",
+            # Commands before the first function are kept.
+            "Main": "push constant 7\npop temp 0\n"
+                "function Main.main 0\ncall Main.used 0\nreturn\n"
+                "function Main.used 0\npush constant 1\nreturn\n"
+                "function Main.unused 0\ncall Main.alsoUnused 0\nreturn\n"
+                "function Main.alsoUnused 1\npush local 0\ncall Main.unused 0\nreturn\n",
+        }
+        with TemporaryDirectory() as temp_dir:
+            for name, source in sources.items():
+                Path(temp_dir, "{}.vm".format(name)).write_text(source)
+            paths_vm = sorted(Path(temp_dir).glob("*.vm"))
+            functions, report = eliminate_dead_functions(paths_vm)
+            full_asm = str(Path(temp_dir) / "Full.asm")
+            path_asm = str(Path(temp_dir) / "Program.asm")
+            translate_directory(paths_vm, full_asm)
+            translate_directory(paths_vm, path_asm, functions=functions)
+            full, translations = read_asm(full_asm), read_asm(path_asm)
+        self.assertEqual(functions, {"Sys.init", "Main.main", "Main.used"})
+        self.assertEqual(report.num_functions, 5)
+        self.assertEqual(report.removed_functions, ["Main.alsoUnused", "Main.unused"])
+        self.assertEqual(report.num_commands_removed, 7)
+        self.assertNotIn("(Main.unused)", translations)
+        self.assertIn("(Main.used)", translations)
+        count = lambda lines: sum(not line.startswith("(") for line in lines)
+        self.assertEqual(count(full) - count(translations), report.num_instructions_removed)
+
+
+INLINE_SOURCES = {
+    "Sys": "function Sys.init 0\npush constant 5\nneg\ncall Main.abs 1\npush constant 3\n"
+        "push constant 9\ncall Main.max 2\nadd\ncall Main.setThis 1\ncall Main.leaves 0\n"
+        "label HALT\ngoto HALT\n",
+    "Main": "function Main.abs 0\npush argument 0\npush constant 0\nlt\nif-goto NEG\n"
+        "push argument 0\nreturn\nlabel NEG\npush argument 0\nneg\nreturn\n"
+        "function Main.max 0\npush argument 0\npush argument 1\ngt\nif-goto FIRST\n"
+        "push argument 1\nreturn\nlabel FIRST\npush argument 0\nreturn\n"
+        "function Main.setThis 0\npush argument 0\npop pointer 0\npush constant 0\nreturn\n"
+        "function Main.leaves 0\npush constant 1\npush constant 2\nreturn\n",
+}
+
+
+class TestInlining(unittest.TestCase):
+    def write_sources(self, temp_dir):
+        for name, source in INLINE_SOURCES.items():
+            Path(temp_dir, "{}.vm".format(name)).write_text(source)
+        return sorted(Path(temp_dir).glob("*.vm"))
+
+    def test_plan(self):
+        with TemporaryDirectory() as temp_dir:
+            paths_vm = self.write_sources(temp_dir)
+            # setThis changes the caller's THIS and leaves returns with two values.
+            self.assertEqual(set(plan_inlining(paths_vm, 16)), {"Main.abs", "Main.max"})
+            self.assertEqual(set(plan_inlining(paths_vm, 9)), {"Main.max"})
+            # Both grow the program by 10 commands; ties are broken by name.
+            self.assertEqual(set(plan_inlining(paths_vm, 16, 10)), {"Main.abs"})
+
+    def test_inline_body(self):
+        with TemporaryDirectory() as temp_dir:
+            plan = plan_inlining(self.write_sources(temp_dir), 16)
+        commands = inline_body(plan["Main.max"], 2, 3, "Main.max.0")
+        self.assertEqual(commands, list(parse_commands(
+            "pop static 4\npop static 3\npush static 3\npush static 4\ngt\n"
+            "if-goto Main.max.0.FIRST\npush static 4\ngoto Main.max.0.end\n"
+            "label Main.max.0.FIRST\npush static 3\nlabel Main.max.0.end\n")))
+
+    def test_translate(self):
+        with TemporaryDirectory() as temp_dir:
+            paths_vm = self.write_sources(temp_dir)
+            plan = plan_inlining(paths_vm, 16)
+            path_asm = str(Path(temp_dir) / "Program.asm")
+            translate_directory(paths_vm, path_asm, inline=plan)
+            with open(path_asm) as fin:
+                comments = [line.strip() for line in fin if line.startswith("//")]
+        self.assertNotIn("// call Main.abs 1", comments)
+        self.assertNotIn("// call Main.max 2", comments)
+        self.assertIn("// call Main.setThis 1", comments)
+        self.assertIn("// label Main.abs.0.NEG", comments)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,7 +1,13 @@
+import shutil
 import unittest
-from tempfile import NamedTemporaryFile
+from pathlib import Path
+from tempfile import NamedTemporaryFile, TemporaryDirectory
 from assemble import parse_assembly_with_emptylines_and_comments_removal, add_labels, \
-    translate_into_machine_code, main, AInstruction, AInstructionSymbol, CInsturction, Label
+    translate_into_machine_code, encode_into_machine_code, assemble_streaming, main, \
+    symbol_table, read_hack, write_hackb, read_hackb, map_hackb, \
+    parse_assembly_into_program, collect_sources, assemble_batch, \
+    optimize_peephole, parse_line, \
+    AInstruction, AInstructionSymbol, CInsturction, Label
 
 
 class TestParseAssemblyWithEmptyLinesAndCommentRemoval(unittest.TestCase):
@@ -131,5 +137,194 @@ class TestTranslateIntoMachineCode(unittest.TestCase):
         self.assertEqual(machine_code, ans)
 
 
+class TestProgram(unittest.TestCase):
+    def test_view(self):
+        path = "../projects/06/max/Max.asm"
+        program = parse_assembly_into_program(path)
+        list_instructions = parse_assembly_with_emptylines_and_comments_removal(path)
+        self.assertEqual(len(program), len(list_instructions))
+        self.assertEqual(list(program), list_instructions)
+        self.assertEqual(program[10], Label("OUTPUT_FIRST"))
+        self.assertEqual(program[5], CInsturction("null", "D", "JGT"))
+
+    def test_a_instruction_out_of_range(self):
+        self.assertEqual(parse_line("@32767"), AInstruction(32767))
+        with TemporaryDirectory() as temp_dir:
+            path = str(Path(temp_dir) / "Big.asm")
+            Path(path).write_text("@1\nD=A\n@32768\n")
+            with self.assertRaisesRegex(ValueError, r"Big.asm:3: A-instruction @32768"):
+                parse_assembly_into_program(path)
+            with self.assertRaisesRegex(ValueError, r"Big.asm:3: A-instruction @32768"):
+                assemble_streaming(path, str(Path(temp_dir) / "Big.hack"), dict(symbol_table))
+
+    def test_interning(self):
+        program = parse_assembly_into_program("../projects/06/max/Max.asm")
+        self.assertEqual(program.symbols, ["R0", "R1", "OUTPUT_FIRST", "OUTPUT_D", "R2", "INFINITE_LOOP"])
+        self.assertEqual(len(program.c_instructions), 5)
+
+    def test_translate(self):
+        path = "../projects/06/pong/Pong.asm"
+        program = parse_assembly_into_program(path)
+        table = dict(symbol_table)
+        add_labels(program, table)
+        list_instructions = parse_assembly_with_emptylines_and_comments_removal(path)
+        list_table = dict(symbol_table)
+        add_labels(list_instructions, list_table)
+        self.assertEqual(translate_into_machine_code(program, table),
+            translate_into_machine_code(list_instructions, list_table))
+        self.assertEqual(table, list_table)
+
+
+class TestAssembleStreaming(unittest.TestCase):
+    def _assert_same_as_translation(self, path):
+        line_instructions = parse_assembly_with_emptylines_and_comments_removal(path)
+        table = dict(symbol_table)
+        add_labels(line_instructions, table)
+        ans = translate_into_machine_code(line_instructions, table)
+        with NamedTemporaryFile("r", suffix=".hack") as fout:
+            num_instructions = assemble_streaming(path, fout.name, dict(symbol_table))
+            machine_code = fout.read().splitlines()
+        self.assertEqual(num_instructions, len(ans))
+        self.assertEqual(machine_code, ans)
+
+    def test_max(self):
+        self._assert_same_as_translation("../projects/06/max/Max.asm")
+
+    def test_rect(self):
+        self._assert_same_as_translation("../projects/06/rect/Rect.asm")
+
+    def test_pong(self):
+        self._assert_same_as_translation("../projects/06/pong/Pong.asm")
+
+
+class TestPackedMachineCode(unittest.TestCase):
+    def _encode(self, path):
+        line_instructions = parse_assembly_with_emptylines_and_comments_removal(path)
+        table = dict(symbol_table)
+        add_labels(line_instructions, table)
+        return encode_into_machine_code(line_instructions, table)
+
+    def test_matches_reference_hack(self):
+        machine_code = self._encode("../projects/06/max/Max.asm")
+        self.assertEqual(machine_code, read_hack("../projects/05/Max.hack"))
+
+    def test_hackb_roundtrip(self):
+        machine_code = self._encode("../projects/06/rect/Rect.asm")
+        with NamedTemporaryFile(suffix=".hackb") as fout:
+            write_hackb(fout.name, machine_code)
+            self.assertEqual(len(fout.read()), 2 * len(machine_code))
+            self.assertEqual(read_hackb(fout.name), machine_code)
+            self.assertEqual(list(map_hackb(fout.name)), list(machine_code))
+
+    def test_streaming_hackb(self):
+        path = "../projects/06/pong/Pong.asm"
+        machine_code = self._encode(path)
+        with NamedTemporaryFile(suffix=".hackb") as fout:
+            assemble_streaming(path, fout.name, dict(symbol_table), packed=True)
+            self.assertEqual(read_hackb(fout.name), machine_code)
+
+
+class TestOptimizePeephole(unittest.TestCase):
+    def _optimize(self, lines):
+        list_instructions, report = optimize_peephole(parse_line(line) for line in lines)
+        return list_instructions, report
+
+    def test_push_then_pop(self):
+        # push D; pop into D
+        list_instructions, report = self._optimize([
+            "@SP", "A=M", "M=D", "@SP", "M=M+1",
+            "@SP", "M=M-1", "A=M", "D=M", "@R13", "M=D"
+        ])
+        self.assertEqual(list_instructions, [parse_line(line) for line in [
+            "@SP", "A=M", "M=D", "@SP", "A=M", "D=M", "@R13", "M=D"
+        ]])
+        self.assertEqual((report.num_before, report.num_after), (11, 8))
+        self.assertEqual(report.num_removed, {"increment-decrement": 3})
+
+    def test_reload(self):
+        list_instructions, report = self._optimize([
+            "@SP", "M=M-1", "A=M", "D=M", "@SP", "A=M", "A=A-1", "M=D+M"
+        ])
+        self.assertEqual(list_instructions, [parse_line(line) for line in [
+            "@SP", "M=M-1", "A=M", "D=M", "A=A-1", "M=D+M"
+        ]])
+        self.assertEqual(report.num_removed, {"redundant-reload": 2})
+
+    def test_jump_to_next_label(self):
+        list_instructions, report = self._optimize([
+            "@STORE", "0;JMP", "(STORE)", "@SP", "A=M", "M=D"
+        ])
+        self.assertEqual(list_instructions, [parse_line(line) for line in [
+            "(STORE)", "@SP", "A=M", "M=D"
+        ]])
+        self.assertEqual(report.num_removed, {"jump-to-next": 1, "dead-load": 1})
+
+    def test_unreachable(self):
+        list_instructions, report = self._optimize([
+            "(LOOP)", "@LOOP", "0;JMP", "D=M", "(UNUSED)", "D=D+1", "(LOOP2)", "@LOOP2", "D;JGT"
+        ])
+        self.assertEqual(list_instructions, [parse_line(line) for line in [
+            "(LOOP)", "@LOOP", "0;JMP", "(LOOP2)", "@LOOP2", "D;JGT"
+        ]])
+        self.assertEqual(report.num_removed, {"unreachable": 2})
+
+    def test_keeps_effects(self):
+        lines = ["@SP", "M=M+1", "@R13", "M=M-1", "@SP", "A=M", "M=D", "@SP", "A=M", "D=M"]
+        list_instructions, report = self._optimize(lines)
+        self.assertEqual(list_instructions, [parse_line(line) for line in lines])
+        self.assertEqual(report.num_removed, {})
+
+    def test_numeric_jump_targets(self):
+        list_instructions, report = self._optimize([
+            "@3", "0;JMP", "D=M", "D=D+1", "@0", "0;JMP"
+        ])
+        self.assertEqual(list_instructions, [parse_line(line) for line in [
+            "(ROM$0)", "@ROM$3", "(ROM$3)", "D=D+1", "@ROM$0", "0;JMP"
+        ]])
+        self.assertEqual(report.num_removed, {"unreachable": 1, "jump-to-next": 1})
+        table = {}
+        add_labels(list_instructions, table)
+        machine_code = translate_into_machine_code(list_instructions, table)
+        self.assertEqual(machine_code[0], "0000000000000001")
+        self.assertEqual(machine_code[2], "0000000000000000")
+
+    def test_numeric_jump_target_past_the_end(self):
+        list_instructions, _ = self._optimize(["@5", "0;JMP", "D=1"])
+        self.assertEqual(list_instructions[:2], [AInstruction(5), parse_line("0;JMP")])
+        table = {}
+        add_labels(list_instructions, table)
+        self.assertEqual(translate_into_machine_code(list_instructions, table)[0],
+            "0000000000000101")
+
+    def test_pong(self):
+        list_instructions, report = optimize_peephole(
+            parse_assembly_into_program("../projects/06/pong/Pong.asm"))
+        self.assertEqual(report.num_before, 27483)
+        self.assertLess(report.num_after, report.num_before)
+        self.assertEqual(report.num_before - report.num_after, sum(report.num_removed.values()))
+
+
+class TestAssembleBatch(unittest.TestCase):
+    def test_batch(self):
+        predefined = dict(symbol_table)
+        with TemporaryDirectory() as temp_dir:
+            for name in ("max/Max.asm", "rect/Rect.asm", "pong/Pong.asm"):
+                dest = Path(temp_dir) / name
+                dest.parent.mkdir()
+                shutil.copy("../projects/06/" + name, str(dest))
+            sources = collect_sources([temp_dir])
+            self.assertEqual([Path(source).name for source in sources], ["Max.asm", "Pong.asm", "Rect.asm"])
+            results = assemble_batch(sources, jobs=2)
+            self.assertEqual([result.num_instructions for result in results], [16, 27483, 25])
+            for source, result in zip(sources, results):
+                list_instructions = parse_assembly_with_emptylines_and_comments_removal(source)
+                table = dict(predefined)
+                add_labels(list_instructions, table)
+                with open(result.dest) as fin:
+                    self.assertEqual(fin.read().splitlines(),
+                        translate_into_machine_code(list_instructions, table))
+        self.assertEqual(symbol_table, predefined)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,94 @@
+import io
+import os
+import shutil
+import sys
+import unittest
+from contextlib import redirect_stdout
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+from buildcache import TEMP_SUFFIX, BuildCache, source_version
+from assemble import assemble_file
+import VMTranslator
+
+
+class TestBuildCache(unittest.TestCase):
+    def test_get_put(self):
+        with TemporaryDirectory() as cache_dir:
+            cache = BuildCache(cache_dir)
+            key = cache.make_key("tool", "1", (), [("a.vm", b"push constant 1")])
+            self.assertIsNone(cache.get(key))
+            cache.put(key, b"@1")
+            self.assertEqual(cache.get(key), b"@1")
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+            self.assertEqual(cache.stats().entries, 1)
+
+    def test_key(self):
+        key = BuildCache.make_key("tool", "1", (), [("a.vm", b"push constant 1")])
+        self.assertEqual(key, BuildCache.make_key("tool", "1", (), [("a.vm", b"push constant 1")]))
+        self.assertNotEqual(key, BuildCache.make_key("tool", "2", (), [("a.vm", b"push constant 1")]))
+        self.assertNotEqual(key, BuildCache.make_key("tool", "1", (True,), [("a.vm", b"push constant 1")]))
+        self.assertNotEqual(key, BuildCache.make_key("tool", "1", (), [("b.vm", b"push constant 1")]))
+        self.assertNotEqual(key, BuildCache.make_key("tool", "1", (), [("a.vm", b"push constant 2")]))
+
+    def test_lru_eviction(self):
+        with TemporaryDirectory() as cache_dir:
+            cache = BuildCache(cache_dir, max_bytes=250)
+            keys = [cache.make_key("tool", "1", (), [("a", bytes([i]))]) for i in range(3)]
+            for i, key in enumerate(keys[:2]):
+                cache.put(key, b"x" * 100)
+                os.utime(str(cache._path(key)), ns=(i * 10**9, i * 10**9))
+            # Touch the oldest entry so that the second one becomes the least recently used.
+            self.assertIsNotNone(cache.get(keys[0]))
+            cache.put(keys[2], b"x" * 100)
+            self.assertEqual(cache.evictions, 1)
+            self.assertIsNotNone(cache.get(keys[0]))
+            self.assertIsNone(cache.get(keys[1]))
+            self.assertIsNotNone(cache.get(keys[2]))
+
+    def test_eviction_skips_temp_files(self):
+        with TemporaryDirectory() as cache_dir:
+            cache = BuildCache(cache_dir, max_bytes=150)
+            key = cache.make_key("tool", "1", (), [])
+            cache._path(key).parent.mkdir()
+            temp_path = cache._path(key).parent / ("pending" + TEMP_SUFFIX)
+            temp_path.write_bytes(b"x" * 100)
+            cache.put(key, b"x" * 100)
+            self.assertTrue(temp_path.exists())
+            self.assertEqual(cache.evictions, 0)
+            self.assertEqual(cache.stats().entries, 1)
+
+    def test_assemble(self):
+        with TemporaryDirectory() as temp_dir:
+            cache = BuildCache(str(Path(temp_dir) / "cache"))
+            dest = str(Path(temp_dir) / "Max.hack")
+            first = assemble_file("../projects/06/max/Max.asm", dest, cache=cache)
+            expected = Path(dest).read_bytes()
+            Path(dest).unlink()
+            second = assemble_file("../projects/06/max/Max.asm", dest, cache=cache)
+            self.assertFalse(first.cached)
+            self.assertTrue(second.cached)
+            self.assertEqual(second.num_instructions, 16)
+            self.assertEqual(Path(dest).read_bytes(), expected)
+
+    def test_vm_translator(self):
+        with TemporaryDirectory() as temp_dir:
+            source = shutil.copytree("../projects/08/FunctionCalls/StaticsTest",
+                str(Path(temp_dir) / "StaticsTest"))
+            argv = ["VMTranslator.py", source, "--hack", "--cache", str(Path(temp_dir) / "cache")]
+            outputs = []
+            for _ in range(2):
+                output = io.StringIO()
+                with redirect_stdout(output), patch.object(sys, "argv", argv):
+                    VMTranslator.main()
+                outputs.append(output.getvalue())
+        self.assertEqual(outputs, ["cache: 0 hits, 1 misses\n", "cache: 1 hits, 0 misses\n"])
+
+    def test_vm_translator_version(self):
+        # Builds are invalidated by changes to the assembler and source maps.
+        self.assertNotEqual(VMTranslator.VM_TRANSLATOR_VERSION,
+            source_version(VMTranslator.__file__))
+
+
+if __name__ == "__main__":
+    unittest.main()
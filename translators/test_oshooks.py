@@ -0,0 +1,114 @@
+import unittest
+from array import array
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from CPUEmulator import CPUEmulator, JITEmulator
+from oshooks import NATIVE_FUNCTIONS, math_divide, math_multiply, math_sqrt, memory_poke
+from sourcemap import SourceMap, source_map_path
+from VMEmulator import VMEmulator
+from VMTranslator import build_hack
+
+
+# Math functions written the slow way, as an OS would emulate them.
+OS_SOURCES = {
+    "Sys": "function Sys.init 0\npush constant 7\npush constant 6\ncall Math.multiply 2\n"
+        "pop temp 0\npush constant 300\npush constant 300\ncall Math.multiply 2\n"
+        "pop temp 1\npush constant 1000\ncall Math.sqrt 1\npop temp 2\n"
+        "label END\ngoto END\n",
+    "Math": "function Math.multiply 1\nlabel LOOP\npush argument 1\npush constant 0\neq\n"
+        "if-goto DONE\npush local 0\npush argument 0\nadd\npop local 0\npush argument 1\n"
+        "push constant 1\nsub\npop argument 1\ngoto LOOP\nlabel DONE\npush local 0\nreturn\n"
+        "function Math.sqrt 1\nlabel LOOP\npush local 0\npush constant 1\nadd\n"
+        "push local 0\npush constant 1\nadd\ncall Math.multiply 2\npush argument 0\ngt\n"
+        "if-goto DONE\npush local 0\npush constant 1\nadd\npop local 0\ngoto LOOP\n"
+        "label DONE\npush local 0\nreturn\n",
+}
+EXPECTED_TEMPS = [42, 24464, 31]
+
+
+def write_sources(temp_dir):
+    for name, source in OS_SOURCES.items():
+        Path(temp_dir, "{}.vm".format(name)).write_text(source)
+    return sorted(Path(temp_dir).glob("*.vm"))
+
+
+def wrong_multiply(args, ram):
+    return math_multiply(args, ram) + 1
+
+
+class TestNativeFunctions(unittest.TestCase):
+    def test_math(self):
+        ram = array("h", bytes(16))
+        self.assertEqual(math_multiply([300, -300], ram), -24464)
+        self.assertEqual(math_divide([-7, 2], ram), -3)
+        self.assertEqual(math_divide([7, -7], ram), -1)
+        self.assertIsNone(math_divide([7, 0], ram))
+        self.assertEqual(math_sqrt([32767], ram), 181)
+        self.assertIsNone(math_sqrt([-4], ram))
+
+    def test_memory(self):
+        ram = array("h", bytes(16))
+        self.assertEqual(memory_poke([3, -5], ram), 0)
+        self.assertEqual(ram[3], -5)
+        self.assertEqual(NATIVE_FUNCTIONS["Memory.peek"]([3], ram), -5)
+
+
+class TestVMEmulatorHooks(unittest.TestCase):
+    def run_program(self, natives, verify=False):
+        with TemporaryDirectory() as temp_dir:
+            emulator = VMEmulator.from_paths(write_sources(temp_dir), bootstrap=True)
+        emulator.register_natives(natives, verify)
+        emulator.run(100000)
+        self.assertTrue(emulator.halted)
+        return emulator
+
+    def test_native(self):
+        emulated = self.run_program({})
+        native = self.run_program(NATIVE_FUNCTIONS)
+        self.assertEqual(list(emulated.ram[5:8]), EXPECTED_TEMPS)
+        self.assertEqual(list(native.ram[5:8]), EXPECTED_TEMPS)
+        # Only the 13 commands of Sys.init run.
+        self.assertEqual(native.steps, 13)
+        verified = self.run_program(NATIVE_FUNCTIONS, verify=True)
+        self.assertEqual(verified.steps, emulated.steps)
+        self.assertEqual(verified.pending_checks, [])
+
+    def test_verify(self):
+        self.assertEqual(list(self.run_program({"Math.multiply": wrong_multiply}).ram[5:8]),
+            [43, 24465, 31])
+        with self.assertRaises(ValueError):
+            self.run_program({"Math.multiply": wrong_multiply}, verify=True)
+
+
+class TestCPUEmulatorHooks(unittest.TestCase):
+    def run_program(self, engine, natives, verify=False):
+        with TemporaryDirectory() as temp_dir:
+            path_hack = str(Path(temp_dir) / "Os.hack")
+            build_hack(write_sources(temp_dir), path_hack, True, emit_source_map=True)
+            emulator = engine.from_file(path_hack)
+            function_entries = SourceMap.load(source_map_path(path_hack)).function_entries()
+        emulator.register_natives(natives, function_entries, verify)
+        emulator.run(1000000)
+        self.assertTrue(emulator.halted)
+        return emulator
+
+    def test_native(self):
+        for engine in (CPUEmulator, JITEmulator):
+            emulated = self.run_program(engine, {})
+            native = self.run_program(engine, NATIVE_FUNCTIONS)
+            self.assertEqual(list(emulated.ram[5:8]), EXPECTED_TEMPS)
+            self.assertEqual(list(native.ram[5:8]), EXPECTED_TEMPS)
+            self.assertLess(native.cycles * 20, emulated.cycles)
+            self.assertEqual(native.ram[0], emulated.ram[0])
+            verified = self.run_program(engine, NATIVE_FUNCTIONS, verify=True)
+            self.assertEqual(verified.cycles, emulated.cycles)
+            self.assertEqual(verified.pending_checks, [])
+
+    def test_verify(self):
+        for engine in (CPUEmulator, JITEmulator):
+            with self.assertRaises(ValueError):
+                self.run_program(engine, {"Math.multiply": wrong_multiply}, verify=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from CPUEmulator import CPUEmulator, JITEmulator
+from oshooks import NATIVE_FUNCTIONS
+from profiler import NO_FUNCTION, FunctionProfiler
+from sourcemap import SourceMap, source_map_path
+from test_oshooks import write_sources
+from VMTranslator import build_hack
+
+
+class TestFunctionProfiler(unittest.TestCase):
+    def run_program(self, engine, natives=None, verify=False, directory=None):
+        # The Math functions of test_oshooks, or the .vm files of directory.
+        with TemporaryDirectory() as temp_dir:
+            path_hack = str(Path(temp_dir) / "Prog.hack")
+            paths_vm = sorted(Path(directory).glob("*.vm")) if directory else \
+                write_sources(temp_dir)
+            build_hack(paths_vm, path_hack, True, emit_source_map=True)
+            emulator = engine.from_file(path_hack)
+            source_map = SourceMap.load(source_map_path(path_hack))
+            if natives is not None:
+                emulator.register_natives(natives, source_map.function_entries(), verify)
+            emulator.register_profiler(FunctionProfiler.from_source_map(source_map))
+        emulator.run(1000000)
+        self.assertTrue(emulator.halted)
+        emulator.profiler.finish(emulator.cycles)
+        return emulator
+
+    def test_profiles(self):
+        for engine in (CPUEmulator, JITEmulator):
+            emulator = self.run_program(engine)
+            profiles = dict((profile.name, profile) for profile in emulator.profiler.profiles())
+            self.assertEqual(set(profiles), {NO_FUNCTION, "Sys.init", "Math.multiply",
+                "Math.sqrt"})
+            # Math.sqrt calls Math.multiply 32 times, Sys.init twice.
+            self.assertEqual(profiles["Math.multiply"].calls, 34)
+            self.assertEqual(profiles["Math.sqrt"].calls, 1)
+            self.assertEqual(sum(profile.exclusive for profile in profiles.values()),
+                emulator.cycles)
+            self.assertEqual(profiles["Sys.init"].inclusive + profiles[NO_FUNCTION].exclusive,
+                emulator.cycles)
+            self.assertEqual(profiles["Math.multiply"].inclusive,
+                profiles["Math.multiply"].exclusive)
+            self.assertGreater(profiles["Math.sqrt"].inclusive, profiles["Math.sqrt"].exclusive)
+            stacks = dict(line.rsplit(" ", 1) for line in emulator.profiler.collapsed_stacks())
+            self.assertEqual(set(stacks), {NO_FUNCTION, "Sys.init", "Sys.init;Math.multiply",
+                "Sys.init;Math.sqrt", "Sys.init;Math.sqrt;Math.multiply"})
+            self.assertEqual(int(stacks["Sys.init;Math.multiply"]) +
+                int(stacks["Sys.init;Math.sqrt;Math.multiply"]),
+                profiles["Math.multiply"].exclusive)
+
+    def test_recursion(self):
+        # Main.fibonacci(4) calls itself down to a depth of 4.
+        profiler = self.run_program(JITEmulator,
+            directory="../projects/08/FunctionCalls/FibonacciElement").profiler
+        profiles = dict((profile.name, profile) for profile in profiler.profiles())
+        self.assertEqual(profiles["Main.fibonacci"].calls, 9)
+        self.assertEqual(profiles["Main.fibonacci"].inclusive, profiles["Main.fibonacci"].exclusive)
+        self.assertTrue(any(line.startswith("Sys.init;" + ";".join(["Main.fibonacci"] * 4) + " ")
+            for line in profiler.collapsed_stacks()))
+
+    def test_natives(self):
+        # Native functions run in no cycles but are still counted as calls.
+        for engine in (CPUEmulator, JITEmulator):
+            emulator = self.run_program(engine, NATIVE_FUNCTIONS)
+            profiles = dict((profile.name, profile) for profile in emulator.profiler.profiles())
+            self.assertEqual(profiles["Math.multiply"].calls, 2)
+            self.assertEqual(profiles["Math.multiply"].inclusive, 0)
+            self.assertEqual(list(emulator.ram[5:8]), [42, 24464, 31])
+            verified = self.run_program(engine, NATIVE_FUNCTIONS, verify=True)
+            self.assertEqual(verified.profiler.profiles(),
+                self.run_program(engine).profiler.profiles())
+            self.assertEqual(verified.pending_checks, [])
+
+    def test_save(self):
+        emulator = self.run_program(CPUEmulator)
+        with TemporaryDirectory() as temp_dir:
+            path = str(Path(temp_dir) / "stacks.txt")
+            emulator.profiler.save_collapsed_stacks(path)
+            self.assertEqual(Path(path).read_text().splitlines(),
+                emulator.profiler.collapsed_stacks())
+
+
+if __name__ == "__main__":
+    unittest.main()
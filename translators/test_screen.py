@@ -0,0 +1,63 @@
+import unittest
+import zlib
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from CPUEmulator import CPUEmulator
+from screen import SCREEN, SCREEN_WIDTH, ROW_BYTES, Screen, record_frames
+
+
+class TestScreen(unittest.TestCase):
+    def setUp(self):
+        # Rect draws a 16 pixels wide rectangle of RAM[0] rows at the top left.
+        self.emulator = CPUEmulator.from_file("../projects/05/Rect.hack")
+        self.emulator.ram[0] = 4
+        self.screen = Screen(self.emulator.ram)
+
+    def test_view(self):
+        self.emulator.run(1000)
+        self.assertTrue(self.screen.pixel(3, 15))
+        self.assertFalse(self.screen.pixel(3, 16))
+        self.assertFalse(self.screen.pixel(4, 0))
+        # Writes to RAM show through the view.
+        self.emulator.ram[SCREEN + 32 * 100 + 1] = 0b100
+        self.assertTrue(self.screen.pixel(100, 18))
+
+    def test_dirty_rows(self):
+        self.assertEqual(self.screen.update(), [])
+        self.emulator.run(1000)
+        self.assertEqual(self.screen.dirty_rows(), [0, 1, 2, 3])
+        self.assertEqual(self.screen.update(), [0, 1, 2, 3])
+        self.assertEqual(self.screen.update(), [])
+        self.emulator.ram[SCREEN + 32 * 2] = 0
+        self.assertEqual(self.screen.update(), [2])
+
+    def test_bitmap(self):
+        self.emulator.run(1000)
+        bitmap = self.screen.bitmap()
+        self.assertEqual(list(bitmap[0][:17]), [1] * 16 + [0])
+        self.assertEqual(sum(sum(row) for row in bitmap), 4 * 16)
+
+    def test_images(self):
+        self.emulator.ram[SCREEN] = 0b10000001
+        pbm = self.screen.to_pbm()
+        header = b"P4\n512 256\n"
+        self.assertEqual(pbm[:len(header)], header)
+        self.assertEqual(pbm[len(header):len(header) + 2], bytes((0b10000001, 0)))
+        png = self.screen.to_png()
+        self.assertEqual(png[:8], b"\x89PNG\r\n\x1a\n")
+        scanlines = zlib.decompress(png[png.index(b"IDAT") + 4:png.index(b"IEND") - 8])
+        self.assertEqual(len(scanlines), 256 * (1 + SCREEN_WIDTH // 8))
+        self.assertEqual(scanlines[:3], bytes((0, 0b01111110, 0xFF)))
+
+    def test_record_frames(self):
+        with TemporaryDirectory() as temp_dir:
+            paths = record_frames(self.emulator, 1000, 10, temp_dir, "pbm")
+            # One frame for each of the 4 rows: a row is drawn every 14 cycles.
+            self.assertEqual(len(paths), 4)
+            self.assertTrue(self.emulator.halted)
+            last = Path(paths[-1]).read_bytes()
+        self.assertEqual(last[-256 * ROW_BYTES:], self.screen.to_pbm()[-256 * ROW_BYTES:])
+
+
+if __name__ == "__main__":
+    unittest.main()
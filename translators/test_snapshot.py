@@ -0,0 +1,98 @@
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from CPUEmulator import CPUEmulator, JITEmulator
+from screen import SCREEN
+from snapshot import HEADER_SIZE, SnapshotStore, map_snapshot
+from test_oshooks import EXPECTED_TEMPS, write_sources
+from VMTranslator import build_hack
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.directory = Path(self.temp_dir.name)
+        self.path_hack = str(self.directory / "Os.hack")
+        build_hack(write_sources(self.temp_dir.name), self.path_hack, True)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_restore(self):
+        for engine in (CPUEmulator, JITEmulator):
+            path = str(self.directory / "{}.hsnap".format(engine.__name__))
+            emulator = engine.from_file(self.path_hack)
+            emulator.run(5000)
+            emulator.save_snapshot(path)
+            emulator.run(1000000)
+            self.assertTrue(emulator.halted)
+            restored = engine.from_file(self.path_hack)
+            restored.restore_snapshot(path)
+            self.assertEqual(restored.cycles, 5000)
+            self.assertIsInstance(restored.ram, memoryview)
+            restored.run(1000000)
+            self.assertTrue(restored.halted)
+            self.assertEqual(list(restored.ram[5:8]), EXPECTED_TEMPS)
+            self.assertEqual((restored.a, restored.d, restored.pc, restored.cycles),
+                (emulator.a, emulator.d, emulator.pc, emulator.cycles))
+            self.assertEqual(list(restored.ram), list(emulator.ram))
+
+    def test_copy_on_write(self):
+        path = str(self.directory / "state.hsnap")
+        emulator = CPUEmulator.from_file(self.path_hack)
+        emulator.ram[SCREEN] = 1
+        emulator.save_snapshot(path)
+        data = Path(path).read_bytes()
+        self.assertEqual(len(data), HEADER_SIZE + 2 * len(emulator.ram))
+        restored = CPUEmulator.from_file(self.path_hack)
+        restored.restore_snapshot(path)
+        # The screen shows the restored RAM; writes do not reach the file.
+        self.assertTrue(restored.screen.pixel(0, 0))
+        restored.ram[SCREEN] = -1
+        self.assertTrue(restored.screen.pixel(0, 15))
+        self.assertEqual(Path(path).read_bytes(), data)
+        self.assertEqual(map_snapshot(path, len(emulator.ram)).ram[SCREEN], 1)
+
+    def test_other_program(self):
+        path = str(self.directory / "state.hsnap")
+        CPUEmulator.from_file(self.path_hack).save_snapshot(path)
+        with self.assertRaisesRegex(ValueError, "another program"):
+            CPUEmulator.from_file("../projects/05/Max.hack").restore_snapshot(path)
+        Path(path).write_bytes(b"not a snapshot".ljust(HEADER_SIZE, b"\0"))
+        with self.assertRaises(ValueError):
+            CPUEmulator.from_file(self.path_hack).restore_snapshot(path)
+
+    def test_store(self):
+        store = SnapshotStore(str(self.directory / "snapshots"))
+        warm_ups = []
+
+        def warm_up(emulator):
+            warm_ups.append(emulator)
+            emulator.run(5000)
+
+        first, second = (JITEmulator.from_file(self.path_hack) for _ in range(2))
+        self.assertFalse(store.start("init", first, warm_up))
+        self.assertTrue(store.start("init", second, warm_up))
+        self.assertEqual(warm_ups, [first])
+        self.assertEqual(second.cycles, 5000)
+        self.assertEqual(second.pc, first.pc)
+        # A snapshot of another program is taken again.
+        other = CPUEmulator.from_file("../projects/05/Max.hack")
+        self.assertFalse(store.start("init", other, warm_up))
+        self.assertEqual(warm_ups, [first, other])
+
+    def test_truncated(self):
+        store = SnapshotStore(str(self.directory / "snapshots"))
+        for data in (b"", b"HSNP"):
+            store.path("init").write_bytes(data)
+            with self.assertRaisesRegex(ValueError, "too short"):
+                map_snapshot(str(store.path("init")), 32768)
+            # A corrupt snapshot is taken again.
+            emulator = CPUEmulator.from_file(self.path_hack)
+            self.assertFalse(store.start("init", emulator, lambda emulator: emulator.run(100)))
+            self.assertEqual(emulator.cycles, 100)
+            self.assertTrue(store.restore("init", CPUEmulator.from_file(self.path_hack)))
+
+
+if __name__ == "__main__":
+    unittest.main()
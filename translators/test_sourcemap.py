@@ -0,0 +1,56 @@
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from assemble import parse_assembly_into_program, add_labels, encode_into_machine_code, \
+    new_symbol_table
+from sourcemap import SourceMap, SourceLocation
+from VMTranslator import translate_directory
+
+
+class TestSourceMap(unittest.TestCase):
+    def test_asm_lines(self):
+        program = parse_assembly_into_program("../projects/06/max/Max.asm")
+        table = new_symbol_table()
+        add_labels(program, table)
+        source_map = SourceMap()
+        machine_code = encode_into_machine_code(program, table, source_map)
+        self.assertEqual(len(source_map), len(machine_code))
+        # @R0 is on line 8 and the first instruction after (OUTPUT_FIRST) on line 19.
+        self.assertEqual(source_map.asm_line(0), 8)
+        self.assertEqual(source_map.asm_line(10), 19)
+        self.assertEqual(source_map.labels(), {"OUTPUT_FIRST": 10, "OUTPUT_D": 12, "INFINITE_LOOP": 14})
+        self.assertEqual(source_map.labels_at(12), ["OUTPUT_D"])
+        # The comments of hand-written assembly are not VM commands.
+        self.assertEqual(source_map.lookup(0), SourceLocation(0, 8, None, None, None))
+
+    def test_vm_commands(self):
+        with TemporaryDirectory() as temp_dir:
+            paths_vm = sorted(Path("../projects/08/FunctionCalls/FibonacciElement").glob("*.vm"))
+            path_asm = str(Path(temp_dir) / "FibonacciElement.asm")
+            translate_directory(paths_vm, path_asm)
+            program = parse_assembly_into_program(path_asm)
+            table = new_symbol_table()
+            add_labels(program, table)
+            source_map = SourceMap()
+            encode_into_machine_code(program, table, source_map)
+            path_smap = str(Path(temp_dir) / "FibonacciElement.smap")
+            source_map.save(path_smap)
+
+            loaded = SourceMap.load(path_smap)
+            self.assertEqual(len(loaded), len(source_map))
+            self.assertEqual(list(loaded.asm_lines), list(source_map.asm_lines))
+            self.assertEqual(loaded.labels(), source_map.labels())
+            entries = dict((name, address) for address, name in loaded.function_entries())
+            self.assertEqual(set(entries), {"Main.fibonacci", "Sys.init"})
+            self.assertEqual(entries["Main.fibonacci"], table["Main.fibonacci"])
+            self.assertEqual(loaded.lookup(entries["Sys.init"]), SourceLocation(
+                entries["Sys.init"], loaded.asm_line(entries["Sys.init"]), "Sys.vm",
+                "function Sys.init 0", "Sys.init"))
+            location = loaded.lookup(entries["Main.fibonacci"] + 20)
+            self.assertEqual((location.vm_file, location.vm_function), ("Main.vm", "Main.fibonacci"))
+            self.assertEqual(loaded.lookup(0).vm_command, "init")
+            self.assertIsNone(loaded.lookup(0).vm_function)
+
+
+if __name__ == "__main__":
+    unittest.main()
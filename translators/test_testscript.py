@@ -0,0 +1,41 @@
+import unittest
+from testscript import OutputColumn, Repeat, ScriptCommand, While, format_header, format_line, \
+    lines_match, parse_column, parse_script, parse_value
+
+
+class TestScript(unittest.TestCase):
+    def test_parse_script(self):
+        statements = parse_script("""// comment
+load And.hdl, output-list a%B3.1.3 out%D1.6.1;
+repeat 2 { tick, tock, output; }
+/* a keyboard
+   wait */ while out <> 75 { eval, }
+""")
+        self.assertEqual(statements, [
+            ScriptCommand("load", ["And.hdl"]),
+            ScriptCommand("output-list", ["a%B3.1.3", "out%D1.6.1"]),
+            Repeat(2, [ScriptCommand("tick", []), ScriptCommand("tock", []),
+                ScriptCommand("output", [])]),
+            While("out", "<>", "75", [ScriptCommand("eval", [])])])
+
+    def test_values(self):
+        self.assertEqual(parse_value("%B0101"), 5)
+        self.assertEqual(parse_value("%XFF"), 255)
+        self.assertEqual(parse_value("%D-1"), -1)
+        self.assertEqual(parse_value("-32768"), -32768)
+
+    def test_format(self):
+        columns = [parse_column("time%S1.4.1"), parse_column("in%D1.6.1"),
+            parse_column("address%B1.3.1"), parse_column("out%X1.4.1")]
+        self.assertEqual(columns[2], OutputColumn("address", "B", 1, 3, 1))
+        self.assertEqual(format_header(columns), "| time |   in   |addre| out  |")
+        self.assertEqual(format_line(columns, ["3+", -1, 5, -1]),
+            "| 3+   |     -1 | 101 | FFFF |")
+
+    def test_lines_match(self):
+        self.assertTrue(lines_match("|  *** | 1 |", "|  -12 | 1 |  "))
+        self.assertFalse(lines_match("|  *** | 1 |", "|  -12 | 0 |"))
+
+
+if __name__ == "__main__":
+    unittest.main()
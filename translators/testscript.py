@@ -0,0 +1,270 @@
+import re
+from collections import namedtuple
+from pathlib import Path
+from typing import List, Sequence, Union
+
+
+# Test scripts (.tst) of the course tools: commands separated by "," or ";",
+# with repeat and while blocks.
+ScriptCommand = namedtuple("ScriptCommand", ("name", "args"))
+Repeat = namedtuple("Repeat", ("count", "body"))
+While = namedtuple("While", ("name", "operator", "value", "body"))
+OutputColumn = namedtuple("OutputColumn", ("name", "format", "left", "width", "right"))
+# Scripts without a comparison file or waiting for input are skipped.
+ScriptResult = namedtuple("ScriptResult", ("path", "passed", "num_lines", "message", "skipped"),
+    defaults=(False,))
+
+Value = Union[int, str]
+Statement = Union[ScriptCommand, Repeat, While]
+
+TOKEN = re.compile(r'"[^"]*"|<>|<=|>=|[{},;=<>]|[^\s{},;"=<>]+')
+COMMENT = re.compile(r"//[^\n]*|/\*.*?\*/", re.DOTALL)
+COLUMN = re.compile(r"(.+)%([BDXS])(\d+)\.(\d+)\.(\d+)$")
+CONDITIONS = {
+    "=": lambda x, y: x == y,
+    "<>": lambda x, y: x != y,
+    "<": lambda x, y: x < y,
+    ">": lambda x, y: x > y,
+    "<=": lambda x, y: x <= y,
+    ">=": lambda x, y: x >= y,
+}
+MAX_WHILE_ITERATIONS = 1000000
+# Commands after which an unchanged value stays unchanged: a while loop of
+# only these waits for input, such as a key press in Memory.tst.
+STATELESS_COMMANDS = ("eval", "output", "echo")
+
+
+def parse_script(source: str) -> List[Statement]:
+    tokens = TOKEN.findall(COMMENT.sub("", source))
+    statements, position = _parse_block(tokens, 0)
+    if position != len(tokens):
+        raise ValueError("Unexpected }} at token {}.".format(position))
+    return statements
+
+
+def _parse_block(tokens: List[str], position: int):
+    statements, words = [], []
+    while position < len(tokens):
+        token = tokens[position]
+        position += 1
+        if token in (",", ";"):
+            if words:
+                statements.append(ScriptCommand(words[0], words[1:]))
+            words = []
+        elif token == "{":
+            body, position = _parse_block(tokens, position)
+            if words[0] == "repeat":
+                statements.append(Repeat(int(words[1]) if len(words) > 1 else -1, body))
+            elif words[0] == "while":
+                statements.append(While(words[1], words[2], words[3], body))
+            else:
+                raise ValueError("Unexpected block after {}.".format(" ".join(words)))
+            words = []
+        elif token == "}":
+            if words:
+                statements.append(ScriptCommand(words[0], words[1:]))
+            return statements, position
+        else:
+            words.append(token)
+    if words:
+        statements.append(ScriptCommand(words[0], words[1:]))
+    return statements, position
+
+
+def parse_value(text: str) -> int:
+    # "%B0101", "%XFF", "%D-1" or a decimal number.
+    if text.startswith("%B"):
+        return int(text[2:], 2)
+    elif text.startswith("%X"):
+        return int(text[2:], 16)
+    elif text.startswith("%D"):
+        return int(text[2:])
+    return int(text)
+
+
+def parse_column(text: str) -> OutputColumn:
+    match = COLUMN.match(text)
+    if match is None:
+        raise ValueError("Invalid output column {}.".format(text))
+    name, value_format, left, width, right = match.groups()
+    return OutputColumn(name, value_format, int(left), int(width), int(right))
+
+
+def format_header(columns: Sequence[OutputColumn]) -> str:
+    cells = []
+    for column in columns:
+        size = column.left + column.width + column.right
+        name = column.name[:size]
+        left = (size - len(name)) // 2
+        cells.append(" " * left + name + " " * (size - len(name) - left))
+    return "|" + "|".join(cells) + "|"
+
+
+def format_value(column: OutputColumn, value: Value) -> str:
+    if column.format == "S":
+        text = str(value).ljust(column.width)
+    elif column.format == "D":
+        text = str(value).rjust(column.width)
+    elif column.format == "B":
+        text = format(value & ((1 << column.width) - 1), "0{}b".format(column.width))
+    else:
+        text = format(value & ((1 << 4 * column.width) - 1), "0{}X".format(column.width))
+    return " " * column.left + text + " " * column.right
+
+
+def format_line(columns: Sequence[OutputColumn], values: Sequence[Value]) -> str:
+    return "|" + "|".join(format_value(column, value)
+        for column, value in zip(columns, values)) + "|"
+
+
+def lines_match(expected: str, actual: str) -> bool:
+    # "*" in a comparison file matches any character.
+    expected, actual = expected.rstrip(), actual.rstrip()
+    return len(expected) == len(actual) and all(e == a or e == "*"
+        for e, a in zip(expected, actual))
+
+
+class ScriptRunner:
+    # Runs a test script against an engine, which executes the commands
+    # specific to its tool (load, set, eval, tick, vmstep...) through
+    # run_command(name, args) and gives the values of output columns through
+    # value(name). An engine may return a callable instead of a value when it
+    # evaluates outputs in a batch; the lines are then formatted after its
+    # flush(). Lines are compared with the comparison file as they come.
+    # An engine with run_repeated(name, args, count, directory) runs the
+    # repeat blocks of a single command itself, as "repeat 1000000 {
+    # ticktock; }", and returns False for the commands it does not.
+    def __init__(self, engine, path_tst: str, write_output: bool = False):
+        self.engine = engine
+        self.path_tst = Path(path_tst)
+        self.write_output = write_output
+        self.columns = []
+        self.lines = []
+        self.pending = []
+        self.expected = None
+        self.output_path = None
+        self.num_compared = 0
+        self.failure = None
+
+    def run(self) -> ScriptResult:
+        statements = parse_script(self.path_tst.read_text())
+        if not any(isinstance(statement, ScriptCommand) and statement.name == "compare-to"
+                for statement in statements):
+            return ScriptResult(str(self.path_tst), False, 0, "No comparison file.", True)
+        skipped = False
+        try:
+            self._run_block(statements)
+            self.engine.flush()
+            self._resolve_pending()
+            if self.failure is None and self.expected is not None and \
+                    self.num_compared < len(self.expected):
+                self.failure = "Output ended at line {} of {}.".format(
+                    self.num_compared, len(self.expected))
+        except _ComparisonFailure:
+            pass
+        except ValueError as error:
+            self.failure = str(error)
+            skipped = isinstance(error, InputRequired)
+        if self.write_output and self.output_path is not None:
+            self.output_path.write_text("".join(line + "\n" for line in self.lines))
+        return ScriptResult(str(self.path_tst), self.failure is None, len(self.lines),
+            self.failure, skipped)
+
+    def _run_block(self, statements: List[Statement]) -> None:
+        for statement in statements:
+            if isinstance(statement, Repeat):
+                if statement.count > 0 and len(statement.body) == 1 and \
+                        self._run_repeated(statement.body[0], statement.count):
+                    continue
+                count = 0
+                while count != statement.count:
+                    self._run_block(statement.body)
+                    count += 1
+            elif isinstance(statement, While):
+                self._run_while(statement)
+            else:
+                self._run_command(statement)
+
+    def _run_while(self, statement: While) -> None:
+        condition = CONDITIONS[statement.operator]
+        value = parse_value(statement.value)
+        stateless = all(isinstance(command, ScriptCommand) and
+            command.name in STATELESS_COMMANDS for command in statement.body)
+        previous = None
+        for _ in range(MAX_WHILE_ITERATIONS):
+            current = self.engine.value(statement.name)
+            if callable(current):
+                self.engine.flush()
+                current = current()
+            if not condition(current, value):
+                return
+            if stateless and current == previous:
+                raise InputRequired("while {} {} {} waits for input.".format(
+                    statement.name, statement.operator, statement.value))
+            previous = current
+            self._run_block(statement.body)
+        raise ValueError("while {} {} {} did not end.".format(
+            statement.name, statement.operator, statement.value))
+
+    def _run_repeated(self, command: Statement, count: int) -> bool:
+        run_repeated = getattr(self.engine, "run_repeated", None)
+        return isinstance(command, ScriptCommand) and run_repeated is not None and \
+            run_repeated(command.name, command.args, count, self.path_tst.parent)
+
+    def _run_command(self, command: ScriptCommand) -> None:
+        name, args = command
+        directory = self.path_tst.parent
+        if name == "output-file":
+            self.output_path = directory / args[0]
+        elif name == "compare-to":
+            with open(directory / args[0]) as fin:
+                self.expected = fin.read().splitlines()
+        elif name == "output-list":
+            self.columns = [parse_column(arg) for arg in args]
+            self._emit(format_header(self.columns))
+        elif name == "output":
+            values = [self.engine.value(column.name) for column in self.columns]
+            if any(callable(value) for value in values):
+                self.pending.append((self.columns, values))
+            else:
+                self._emit(format_line(self.columns, values))
+        elif name in ("echo", "clear-echo", "breakpoint", "clear-breakpoints"):
+            pass
+        else:
+            self.engine.run_command(name, args, directory)
+
+    def _emit(self, line: str) -> None:
+        if self.pending:
+            self.pending.append(line)
+            return
+        self.lines.append(line)
+        if self.expected is None:
+            return
+        index = self.num_compared
+        if index >= len(self.expected) or not lines_match(self.expected[index], line):
+            self.failure = "Comparison failure at line {}: expected {!r}, got {!r}.".format(
+                index + 1, self.expected[index] if index < len(self.expected) else None, line)
+            raise _ComparisonFailure()
+        self.num_compared += 1
+
+    def _resolve_pending(self) -> None:
+        pending, self.pending = self.pending, []
+        for entry in pending:
+            if isinstance(entry, str):
+                self._emit(entry)
+            else:
+                columns, values = entry
+                self._emit(format_line(columns,
+                    [value() if callable(value) else value for value in values]))
+
+
+class _ComparisonFailure(Exception):
+    pass
+
+
+class InputRequired(ValueError):
+    pass
+
+
+def run_script(engine, path_tst: str, write_output: bool = False) -> ScriptResult:
+    return ScriptRunner(engine, path_tst, write_output).run()